@@ -0,0 +1,41 @@
+# alembic/env.py
+from logging.config import fileConfig
+from alembic import context
+from api.services.utils.db import Base, engine
+# Import every model so their tables are part of the metadata
+from api.models import chat, chatbot, datasource, user  # noqa: F401
+
+# Alembic configuration of alembic.ini
+config = context.config
+if config.config_file_name is not None:
+    fileConfig(config.config_file_name)
+
+# Metadata compared against the database by --autogenerate
+target_metadata = Base.metadata
+
+def run_migrations_offline() -> None:
+    """
+    Emit the SQL of the migrations to the output instead of running them
+    """
+    context.configure(
+        url=engine.url.render_as_string(hide_password=False),
+        target_metadata=target_metadata,
+        literal_binds=True,
+        dialect_opts={"paramstyle": "named"},
+    )
+    with context.begin_transaction():
+        context.run_migrations()
+
+def run_migrations_online() -> None:
+    """
+    Run the migrations on the database of the app, with the same engine and connection arguments
+    """
+    with engine.connect() as connection:
+        context.configure(connection=connection, target_metadata=target_metadata)
+        with context.begin_transaction():
+            context.run_migrations()
+
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    run_migrations_online()
@@ -0,0 +1,92 @@
+"""Baseline of the tables created by the models before migrations
+
+Databases created by the old create_all at startup already have some of these tables,
+only the missing ones are created so they can be upgraded in place.
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-18
+"""
+from alembic import context, op
+import sqlalchemy as sa
+
+# Revision identifiers, used by Alembic
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def _base_columns():
+    """
+    Columns every model inherits from BaseModel
+    """
+    return [
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("created_at", sa.DateTime(), nullable=True),
+        sa.Column("status", sa.SmallInteger(), nullable=True),
+    ]
+
+
+def upgrade() -> None:
+    # The SQL emitted offline creates every table
+    existing = set() if context.is_offline_mode() else set(sa.inspect(op.get_bind()).get_table_names())
+
+    if "user" not in existing:
+        op.create_table(
+            "user",
+            *_base_columns(),
+            sa.Column("name", sa.String(length=50), nullable=False),
+            sa.Column("email", sa.String(length=255), nullable=False),
+            sa.Column("password", sa.String(length=255), nullable=False),
+        )
+        op.create_index("ix_user_id", "user", ["id"])
+        op.create_index("ix_user_name", "user", ["name"])
+        op.create_index("ix_user_email", "user", ["email"], unique=True)
+
+    if "chatbot" not in existing:
+        op.create_table(
+            "chatbot",
+            *_base_columns(),
+            sa.Column("chatbot_type", sa.String(length=255), nullable=False),
+            sa.Column("user_id", sa.Integer(), nullable=False),
+        )
+        op.create_index("ix_chatbot_id", "chatbot", ["id"])
+
+    if "data_sources" not in existing:
+        op.create_table(
+            "data_sources",
+            *_base_columns(),
+            sa.Column("data_type", sa.String(length=5), nullable=False),
+            sa.Column("chatbot_id", sa.Integer(), nullable=False),
+        )
+        op.create_index("ix_data_sources_id", "data_sources", ["id"])
+
+    if "message" not in existing:
+        op.create_table(
+            "message",
+            *_base_columns(),
+            sa.Column("user_content", sa.Text(), nullable=False),
+            sa.Column("chatbot_content", sa.Text(), nullable=False),
+            sa.Column("user_id", sa.Integer(), nullable=False),
+            sa.Column("chatbot_id", sa.Integer(), nullable=False),
+            sa.Column("timestamp", sa.DateTime(), nullable=False),
+        )
+        op.create_index("ix_message_id", "message", ["id"])
+
+    if "conversation_summary" not in existing:
+        op.create_table(
+            "conversation_summary",
+            *_base_columns(),
+            sa.Column("user_id", sa.Integer(), nullable=False),
+            sa.Column("chatbot_id", sa.Integer(), nullable=False),
+            sa.Column("summary", sa.Text(), nullable=False),
+            sa.Column("summarized_until", sa.DateTime(), nullable=False),
+            sa.UniqueConstraint("user_id", "chatbot_id"),
+        )
+        op.create_index("ix_conversation_summary_id", "conversation_summary", ["id"])
+
+
+def downgrade() -> None:
+    for table in ("conversation_summary", "message", "data_sources", "chatbot", "user"):
+        op.drop_table(table)
@@ -0,0 +1,37 @@
+"""Indexes on the columns the queries filter on
+
+The message table is read by conversation and history, always filtered by user and chatbot
+and ordered by timestamp then id, so the composite index serves the filter, the order and the keyset cursor.
+Indexes are built concurrently on PostgreSQL so the tables stay writable during the upgrade.
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18
+"""
+from alembic import op
+
+# Revision identifiers, used by Alembic
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+# Name, table and columns of each index
+INDEXES = [
+    ("ix_message_conversation", "message", ["user_id", "chatbot_id", "timestamp", "id"]),
+    ("ix_chatbot_user_id", "chatbot", ["user_id"]),
+    ("ix_data_sources_chatbot_id", "data_sources", ["chatbot_id"]),
+]
+
+
+def upgrade() -> None:
+    # CREATE INDEX CONCURRENTLY can't run inside a transaction
+    with op.get_context().autocommit_block():
+        for name, table, columns in INDEXES:
+            op.create_index(name, table, columns, postgresql_concurrently=True, if_not_exists=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        for name, table, _ in INDEXES:
+            op.drop_index(name, table_name=table, postgresql_concurrently=True, if_exists=True)
@@ -0,0 +1,29 @@
+"""Ingestion state of the data sources
+
+Data sources are ingested by background jobs, their content is stored to be picked up by a worker,
+with the progress and error of the ingestion. The status column tracks the state of the job.
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# Revision identifiers, used by Alembic
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column("data_sources", sa.Column("content", sa.Text(), nullable=True))
+    op.add_column("data_sources", sa.Column("progress", sa.SmallInteger(), nullable=False, server_default="0"))
+    op.add_column("data_sources", sa.Column("error", sa.Text(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column("data_sources", "error")
+    op.drop_column("data_sources", "progress")
+    op.drop_column("data_sources", "content")
@@ -0,0 +1,25 @@
+"""Last update of the data sources
+
+Ingestion jobs touch their data source after every indexed window, a job left processing
+by a process that stopped is found by its last update and resumed by another one.
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# Revision identifiers, used by Alembic
+revision = "0004"
+down_revision = "0003"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column("data_sources", sa.Column("updated_at", sa.DateTime(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column("data_sources", "updated_at")
@@ -0,0 +1,41 @@
+"""Chunks of the data sources
+
+The ingested content of the data sources is stored as chunk rows,
+the vector index of a chatbot is built from them.
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# Revision identifiers, used by Alembic
+revision = "0005"
+down_revision = "0004"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "data_source_chunk",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("created_at", sa.DateTime(), nullable=True),
+        sa.Column("status", sa.SmallInteger(), nullable=True),
+        sa.Column("datasource_id", sa.Integer(), sa.ForeignKey("data_sources.id"), nullable=False),
+        sa.Column("chatbot_id", sa.Integer(), nullable=False),
+        sa.Column("ordinal", sa.Integer(), nullable=False),
+        sa.Column("page", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("text", sa.Text(), nullable=False),
+        sa.Column("token_count", sa.Integer(), nullable=False),
+        sa.UniqueConstraint("datasource_id", "ordinal"),
+    )
+    op.create_index("ix_data_source_chunk_id", "data_source_chunk", ["id"])
+    op.create_index("ix_data_source_chunk_chatbot", "data_source_chunk", ["chatbot_id", "datasource_id", "ordinal"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_data_source_chunk_chatbot", table_name="data_source_chunk")
+    op.drop_index("ix_data_source_chunk_id", table_name="data_source_chunk")
+    op.drop_table("data_source_chunk")
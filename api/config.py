@@ -5,4 +5,125 @@ import os
 load_dotenv()
 
 SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL")
-DATABASE_PASSWORD = os.getenv("DATABASE_PASSWORD")
\ No newline at end of file
+DATABASE_PASSWORD = os.getenv("DATABASE_PASSWORD")
+# Connections kept open by the pool of each process, and extra connections opened under load
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 5))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 10))
+# Seconds a request waits for a free connection before it fails
+DB_POOL_TIMEOUT_SECONDS = float(os.getenv("DB_POOL_TIMEOUT_SECONDS", 30))
+# Seconds after which a connection is replaced, before the server or a proxy drops it
+DB_POOL_RECYCLE_SECONDS = int(os.getenv("DB_POOL_RECYCLE_SECONDS", 1800))
+# Test each connection when it is checked out, dropped connections are replaced instead of failing the request
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+
+# Trained chatbots
+# Seed corpus used to build the index of a chatbot that has none yet
+TRAINING_DATA_PATH = os.getenv("TRAINING_DATA_PATH", "TrainingData.pdf")
+# Directory where the vector index of every chatbot is saved
+VECTOR_INDEX_DIR = os.getenv("VECTOR_INDEX_DIR", "indexes")
+# Memory map the vectors of the indexes, and memory in megabytes the indexes loaded by each process can take
+VECTOR_INDEX_MMAP = os.getenv("VECTOR_INDEX_MMAP", "true").lower() == "true"
+VECTOR_INDEX_MEMORY_BUDGET_MB = int(os.getenv("VECTOR_INDEX_MEMORY_BUDGET_MB", 1024))
+# Compression of the vectors searched in memory: "none", "int8" one byte per dimension, or "pq" one byte per sub vector,
+# sub vectors of the product quantization, and candidates re-scored exactly per chunk retrieved
+VECTOR_INDEX_COMPRESSION = os.getenv("VECTOR_INDEX_COMPRESSION", "none").lower()
+VECTOR_INDEX_PQ_SUBVECTORS = int(os.getenv("VECTOR_INDEX_PQ_SUBVECTORS", 192))
+VECTOR_INDEX_RESCORE_FACTOR = int(os.getenv("VECTOR_INDEX_RESCORE_FACTOR", 8))
+# Growth of an index since its quantizer was trained past which the quantizer is trained again
+VECTOR_INDEX_RETRAIN_GROWTH = float(os.getenv("VECTOR_INDEX_RETRAIN_GROWTH", 2.0))
+# Directory of the embedding cache, shared by every chatbot
+EMBEDDING_CACHE_DIR = os.getenv("EMBEDDING_CACHE_DIR", "embedding_cache")
+# Maximum chunks per embedding request, and time a partial batch waits for chunks of concurrent ingests
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", 512))
+# Maximum estimated tokens per embedding request, under the 300000 tokens OpenAI accepts in one request
+EMBEDDING_REQUEST_MAX_TOKENS = int(os.getenv("EMBEDDING_REQUEST_MAX_TOKENS", 250000))
+EMBEDDING_BATCH_WAIT_MS = int(os.getenv("EMBEDDING_BATCH_WAIT_MS", 50))
+# Token per minute limit of the embedding provider, 0 disables it
+EMBEDDING_TOKENS_PER_MINUTE = int(os.getenv("EMBEDDING_TOKENS_PER_MINUTE", 1000000))
+# Exact answer cache: "memory" per process, "sqlite" shared by the workers of a node, or "none"
+ANSWER_CACHE_BACKEND = os.getenv("ANSWER_CACHE_BACKEND", "memory")
+ANSWER_CACHE_PATH = os.getenv("ANSWER_CACHE_PATH", "answer_cache.sqlite3")
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", 10000))
+ANSWER_CACHE_TTL_SECONDS = int(os.getenv("ANSWER_CACHE_TTL_SECONDS", 3600))
+# Semantic answer cache of trained chatbots: minimum cosine similarity of a cached question, seconds an answer is kept,
+# answers kept per chatbot and chatbots kept per process
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "true").lower() == "true"
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", 0.95))
+SEMANTIC_CACHE_TTL_SECONDS = int(os.getenv("SEMANTIC_CACHE_TTL_SECONDS", 3600))
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", 500))
+SEMANTIC_CACHE_MAX_CHATBOTS = int(os.getenv("SEMANTIC_CACHE_MAX_CHATBOTS", 1000))
+# Chatbot used by the trained chat when the request does not name one
+TRAINED_CHATBOT_ID = int(os.getenv("TRAINED_CHATBOT_ID", 2))
+# Chunks fetched from the index for a trained answer, tokens of them sent to the LLM,
+# and similarity under the best chunk past which the other chunks are dropped
+CONTEXT_FETCH_K = int(os.getenv("CONTEXT_FETCH_K", 8))
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", 1500))
+CONTEXT_SCORE_MARGIN = float(os.getenv("CONTEXT_SCORE_MARGIN", 0.15))
+# Retrieval of the chunks of a trained answer: "vector" by embedding, "lexical" by BM25 without embedding the question,
+# "hybrid" fusing both rankings, or "auto", lexical for short keyword questions and hybrid for the others
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "vector").lower()
+# Maximum terms of a question retrieved lexically in auto mode, and rank constant of the reciprocal rank fusion
+RETRIEVAL_LEXICAL_MAX_TERMS = int(os.getenv("RETRIEVAL_LEXICAL_MAX_TERMS", 4))
+RETRIEVAL_RRF_K = int(os.getenv("RETRIEVAL_RRF_K", 60))
+# Maximal marginal relevance of the vector retrieval: candidates fetched before the selection,
+# and weight of the relevance against the diversity of the selected chunks, 1 keeps the nearest chunks
+RETRIEVAL_MMR_FETCH_K = int(os.getenv("RETRIEVAL_MMR_FETCH_K", 20))
+RETRIEVAL_MMR_LAMBDA = float(os.getenv("RETRIEVAL_MMR_LAMBDA", 0.7))
+
+# LLM calls
+# Maximum connections kept open to the OpenAI API by the async chat path
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", 500))
+# Timeout of an async OpenAI call
+LLM_TIMEOUT_SECONDS = int(os.getenv("LLM_TIMEOUT_SECONDS", 120))
+
+# Conversations
+# Conversations whose recent turns are kept in memory by each process, and seconds they are kept
+CONVERSATION_CACHE_SIZE = int(os.getenv("CONVERSATION_CACHE_SIZE", 1000))
+CONVERSATION_CACHE_TTL_SECONDS = int(os.getenv("CONVERSATION_CACHE_TTL_SECONDS", 600))
+# Turns of a conversation loaded from the message table, with summaries the turns past it are folded into the summary
+CONVERSATION_HISTORY_TURNS = int(os.getenv("CONVERSATION_HISTORY_TURNS", 20))
+# Maximum tokens of the prompt sent to the chat completion
+CONVERSATION_TOKEN_BUDGET = int(os.getenv("CONVERSATION_TOKEN_BUDGET", 3000))
+# Fold the older turns of a conversation into a running summary once its recent turns pass the threshold in tokens
+CONVERSATION_SUMMARY_ENABLED = os.getenv("CONVERSATION_SUMMARY_ENABLED", "false").lower() == "true"
+CONVERSATION_SUMMARY_THRESHOLD = int(os.getenv("CONVERSATION_SUMMARY_THRESHOLD", 2000))
+# Recent turns always sent as they are
+CONVERSATION_SUMMARY_KEEP_TURNS = int(os.getenv("CONVERSATION_SUMMARY_KEEP_TURNS", 4))
+
+# Messages
+# Save the chat messages through an in-process buffer flushed in the background instead of on the request path
+MESSAGE_WRITE_BEHIND = os.getenv("MESSAGE_WRITE_BEHIND", "false").lower() == "true"
+# The buffer is flushed every interval in milliseconds, or as soon as it holds the maximum rows of a flush
+MESSAGE_FLUSH_INTERVAL_MS = int(os.getenv("MESSAGE_FLUSH_INTERVAL_MS", 200))
+MESSAGE_FLUSH_ROWS = int(os.getenv("MESSAGE_FLUSH_ROWS", 500))
+# Messages the buffer holds before new ones are saved on the request path, and failed flushes of a batch before it is dropped
+MESSAGE_BUFFER_MAX_ROWS = int(os.getenv("MESSAGE_BUFFER_MAX_ROWS", 10000))
+MESSAGE_FLUSH_RETRIES = int(os.getenv("MESSAGE_FLUSH_RETRIES", 5))
+
+# Authentication
+# Active users kept in memory by each process for the authentication of requests, and seconds they are kept
+AUTH_USER_CACHE_SIZE = int(os.getenv("AUTH_USER_CACHE_SIZE", 10000))
+AUTH_USER_CACHE_TTL_SECONDS = int(os.getenv("AUTH_USER_CACHE_TTL_SECONDS", 60))
+# Cost factor of the bcrypt password hashes, hashes with another cost are rehashed on login
+PASSWORD_BCRYPT_ROUNDS = int(os.getenv("PASSWORD_BCRYPT_ROUNDS", 12))
+# Threads hashing and verifying passwords, and hashes that can wait for them before requests are rejected
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", 2))
+PASSWORD_HASH_QUEUE = int(os.getenv("PASSWORD_HASH_QUEUE", 8))
+
+# Ingestion
+# Ingestion jobs run at once by each process
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", 2))
+# Size and overlap in tokens of the chunks of the ingested content
+INGEST_CHUNK_TOKENS = int(os.getenv("INGEST_CHUNK_TOKENS", 300))
+INGEST_CHUNK_OVERLAP_TOKENS = int(os.getenv("INGEST_CHUNK_OVERLAP_TOKENS", 40))
+# Chunks embedded and appended to the index at once, and pages read ahead of the embedding
+INGEST_WINDOW_CHUNKS = int(os.getenv("INGEST_WINDOW_CHUNKS", 512))
+INGEST_PREFETCH_PAGES = int(os.getenv("INGEST_PREFETCH_PAGES", 16))
+# Directory where uploaded files wait for their ingestion
+INGEST_UPLOAD_DIR = os.getenv("INGEST_UPLOAD_DIR", "uploads")
+# Seconds after which a job still processing without progress is considered abandoned and can be resumed
+INGEST_STALE_SECONDS = int(os.getenv("INGEST_STALE_SECONDS", 600))
+
+# Metrics
+# Serve the internal counters under /metrics, to authenticated users only
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "false").lower() == "true"
@@ -4,11 +4,15 @@ from api.routers.auth import auth_router
 from api.routers.chatbot import chatbot_router
 from api.routers.datasource import datasource_router
 from api.routers.chat import chat_router
-from api.services.utils.db import Base, engine
+from api.routers.metrics import metrics_router
+from api.services.chatbot import ChatbotService
+from api.services.message_buffer import get_message_buffer
+from api.services.ingestion import IngestionService
+from starlette.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
+from api.config import METRICS_ENABLED
 
-# Create the database tables if they don't exist 
-Base.metadata.create_all(bind=engine)
+# The database schema is managed by the Alembic migrations, run "alembic upgrade head" before starting the app
 
 # Create the FastAPI app
 app = FastAPI()
@@ -20,6 +24,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],  # Allow all methods, including OPTIONS
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],  # Cursor of the next page of the chat history
 )
 
 # App routers
@@ -28,6 +33,25 @@ app.include_router(auth_router, prefix="/auth", tags=["Auth"])
 app.include_router(chatbot_router, prefix="/chatbot", tags=["Chatbot"])
 app.include_router(datasource_router, prefix="/datasource", tags=["DataSource"])
 app.include_router(chat_router, prefix="/chat", tags=["Chat"])
+# Internal counters, only served when enabled
+if METRICS_ENABLED:
+    app.include_router(metrics_router, prefix="/metrics", tags=["Metrics"])
+
+@app.on_event("startup")
+async def startup():
+    """
+    Pick up the ingestion jobs left queued by a previous process
+    """
+    await run_in_threadpool(IngestionService.resume)
+
+@app.on_event("shutdown")
+async def shutdown():
+    """
+    Close the connections kept open by the app and save the buffered messages
+    """
+    await ChatbotService.close_aiosession()
+    await run_in_threadpool(get_message_buffer().close)
+    IngestionService.shutdown()
 
 @app.get("/")
 async def root():
@@ -1,5 +1,5 @@
 # models/chat.py
-from sqlalchemy import Column, Integer, String, ForeignKey, Text, Boolean, DateTime
+from sqlalchemy import Column, Integer, String, ForeignKey, Text, Boolean, DateTime, Index, UniqueConstraint
 from sqlalchemy.orm import relationship
 from api.models.utils.base import BaseModel
 from datetime import datetime
@@ -49,6 +49,8 @@ class MessageModel(BaseModel):
 
     # Table name
     __tablename__ = "message"
+    # Conversations are read by user and chatbot, ordered by timestamp then id
+    __table_args__ = (Index("ix_message_conversation", "user_id", "chatbot_id", "timestamp", "id"),)
 
     # Model's specific attributes
     user_content = Column(Text, nullable=False)
@@ -61,4 +63,21 @@ class MessageModel(BaseModel):
     # Foreign Key relationship to ChatModel
     chat_id = Column(Integer, ForeignKey('chat.id'))
     chat = relationship('ChatModel', back_populates='messages')
-"""
\ No newline at end of file
+"""
+
+class ConversationSummaryModel(BaseModel):
+    """
+    Conversation summary model that inherits from BaseModel and maps to the conversation_summary table in the database.
+    Running summary of the older turns of a conversation, stored alongside its messages.
+    """
+
+    # Table name
+    __tablename__ = "conversation_summary"
+    __table_args__ = (UniqueConstraint("user_id", "chatbot_id"),)
+
+    # Model's specific attributes
+    user_id = Column(Integer, nullable=False)
+    chatbot_id = Column(Integer, nullable=False)
+    summary = Column(Text, nullable=False)
+    # Timestamp of the last message folded into the summary
+    summarized_until = Column(DateTime, nullable=False)
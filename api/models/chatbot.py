@@ -12,7 +12,7 @@ class ChatBotModel(BaseModel):
 
     # Model's specific attributes
     chatbot_type = Column(String(255), nullable=False)
-    user_id = Column(Integer, nullable=False)
+    user_id = Column(Integer, nullable=False, index=True)
     # En vez de utilizar JSON, aplicar herencia para cada tipo de chatbot
     # En los tipos de chatbot especificos agregamos los atributos que corresponden a cada tipo
     # En esta tabla se quedan los atributos de configuracion generales
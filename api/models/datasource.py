@@ -1,18 +1,41 @@
-from sqlalchemy import Column, Integer, DateTime, String, JSON, ForeignKey, Float, ARRAY
+from sqlalchemy import Column, Integer, DateTime, String, JSON, ForeignKey, Float, ARRAY, SmallInteger, Text, Index, UniqueConstraint
+from sqlalchemy.orm import relationship
 from api.models.utils.base import BaseModel
-
-# Alembic -> Migraciones
+from datetime import datetime
 
 class DataSourceModel(BaseModel):
+    """
+    DataSource model that inherits from BaseModel and maps to the data_sources table in the database.
+    Its status tracks the ingestion of its content into the index of the chatbot.
+    """
+
     __tablename__ = 'data_sources'
-    
+
+    # Values of the status column
+    STATUS_DELETED = 0
+    STATUS_READY = 1
+    STATUS_QUEUED = 2
+    STATUS_PROCESSING = 3
+    STATUS_FAILED = 4
+
     data_type = Column(String(5), nullable=False)
     # Ej: Tienda de lentes y subo un PDF con los lentes
     # metadata solo se guarda en ChromaDB y la referencia de la metadata sera el ID del DataSource
     #metadata = Column(JSON)  # Storing metadata as JSON
     # Los embeddings SOLO se guardan en la BD en vector
     # embeddings = Column(ARRAY(Float))  # Storing embeddings as an array of floats
-    chatbot_id = Column(Integer, nullable=False)
+    chatbot_id = Column(Integer, nullable=False, index=True)
+    # Content to ingest, kept so a queued job can run on any worker, or the path of the uploaded file for a PDF,
+    # cleared once the content is stored as chunks
+    content = Column(Text, nullable=True)
+    # Percentage of the content ingested, and error of a failed ingestion
+    progress = Column(SmallInteger, nullable=False, default=0, server_default="0")
+    error = Column(Text, nullable=True)
+    # Last change of the data source, a processing job also touches it after every indexed window
+    updated_at = Column(DateTime, nullable=True, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    # Relationships
+    chunks = relationship("DataSourceChunkModel", back_populates="datasource", order_by="DataSourceChunkModel.ordinal")
 
 
     # Subo archivo
@@ -20,4 +43,28 @@ class DataSourceModel(BaseModel):
     # Generamos los embeddings
     # Agregamos los embeddings a la BD en Vector
     # Eliminamos archivo
-    
\ No newline at end of file
+
+
+class DataSourceChunkModel(BaseModel):
+    """
+    DataSourceChunk model that inherits from BaseModel and maps to the data_source_chunk table in the database.
+    Chunks of the ingested content of a data source, the indexes of the chatbots are built from them.
+    """
+
+    __tablename__ = "data_source_chunk"
+    # Chunks are read by data source in order, and by chatbot to rebuild its index
+    __table_args__ = (
+        UniqueConstraint("datasource_id", "ordinal"),
+        Index("ix_data_source_chunk_chatbot", "chatbot_id", "datasource_id", "ordinal"),
+    )
+
+    datasource_id = Column(Integer, ForeignKey("data_sources.id"), nullable=False)
+    chatbot_id = Column(Integer, nullable=False)
+    # Position of the chunk in the content of the data source, and page it comes from
+    ordinal = Column(Integer, nullable=False)
+    page = Column(Integer, nullable=False, default=0, server_default="0")
+    text = Column(Text, nullable=False)
+    token_count = Column(Integer, nullable=False)
+
+    # Relationships
+    datasource = relationship("DataSourceModel", back_populates="chunks")
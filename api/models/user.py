@@ -1,7 +1,7 @@
 # models/user.py
 from sqlalchemy import Column, Integer, DateTime, SmallInteger, String
 from api.models.utils.base import BaseModel
-import bcrypt
+from api.services.password import PasswordService
 
 class UserModel(BaseModel):
     """
@@ -33,23 +33,38 @@ class UserModel(BaseModel):
         Setter method for the password field
 
         This property hashes the password using bcrypt and stores the hash in the _password field.
+        The hash runs on the password executor, see PasswordService.
 
         Parameters
         ----------
         password : str
             Password to hash
         """
-        try:
-            # If your database expects a string, decode the hashed password
-            self._password = bcrypt.hashpw(password.encode("utf-8"),bcrypt.gensalt()).decode("utf-8")
-        except Exception as e:
-            print(f"An error occurred while hashing the password: {e}")
+        self._password = PasswordService.hash(password)
 
     
     def verify_password(self, password: str) -> bool:
+        """
+        Verify a password against the stored hash, on the password executor
+
+        Parameters
+        ----------
+        password : str
+            Password to verify
+
+        Returns
+        -------
+        bool
+            True if the password is correct
+        """
         try:
-            password_bytes = password.encode("utf-8")
-            return bcrypt.checkpw(password_bytes, self._password.encode("utf-8"))
+            return PasswordService.verify(password, self._password)
         except ValueError as e:
             print(f"An error occurred: {e}")
             return False
+
+    def needs_rehash(self) -> bool:
+        """
+        Check if the stored hash was made with another cost factor than the configured one
+        """
+        return PasswordService.needs_rehash(self._password)
@@ -1,9 +1,11 @@
 # /chat
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Query, Response
+from fastapi.responses import StreamingResponse
 from api.schemas.chat import MessageCreate, MessageGet #ChatCreate, ChatGet
 from api.services.chat import ChatService
 from api.services.jwt import JwtService
 from api.services.utils.db import get_db
+from api.config import TRAINED_CHATBOT_ID
 from sqlalchemy.orm import Session
 from typing import List
 
@@ -12,29 +14,41 @@ chat_router = APIRouter()
 
 # POST /message
 @chat_router.post("/")
-def send_message(message: str, db: Session = Depends(get_db), current_user = Depends(JwtService.get_current_user)):
+async def send_message(message: str, chatbot_id: int = 1, stream: bool = False, stateless: bool = False, db: Session = Depends(get_db), current_user = Depends(JwtService.get_current_user)):
     """
     Send a message to a specific chatbot and receive a response
+    With stream the response is sent token by token as server-sent events
+    With stateless the message is answered without the conversation context, and repeated messages are served from cache
     """
 
-    return ChatService.send_message(message, db)
+    if stream:
+        return StreamingResponse(await ChatService.stream_message(message, current_user.id, chatbot_id, db, stateless), media_type="text/event-stream")
+    return await ChatService.send_message(message, current_user.id, chatbot_id, db, stateless)
 
 @chat_router.post("/trained")
-def send_trained_message(message: str, db: Session = Depends(get_db)):
+async def send_trained_message(message: str, chatbot_id: int = TRAINED_CHATBOT_ID, stream: bool = False, db: Session = Depends(get_db)):
     """
     Send a message to a specific trained chatbot and receive a response
+    With stream the response is sent token by token as server-sent events
     """
 
-    return ChatService.send_trained_message(message, db)
+    if stream:
+        return StreamingResponse(await ChatService.stream_trained_message(message, chatbot_id, db), media_type="text/event-stream")
+    return await ChatService.send_trained_message(message, chatbot_id, db)
 
 # GET /message/{user_id}/{chatbot_id}
 @chat_router.get("/{user_id}/{chatbot_id}", response_model=List[MessageGet])
-def get_chat_history(user_id: int, chatbot_id: int, db: Session = Depends(get_db), current_user = Depends(JwtService.get_current_user)):
+def get_chat_history(user_id: int, chatbot_id: int, response: Response, limit: int = Query(ChatService.HISTORY_PAGE_SIZE, ge=1, le=ChatService.HISTORY_MAX_PAGE_SIZE), cursor: str | None = None, newest_first: bool = False, db: Session = Depends(get_db), current_user = Depends(JwtService.get_current_user)):
     """
-    Retrieve chat history by user and chatbot IDs
+    Retrieve a page of the chat history by user and chatbot IDs
+    The cursor of the next page is sent in the X-Next-Cursor header, it is missing on the last page
+    With newest_first the most recent messages come first
     """
 
-    return ChatService.get_chat_history(user_id, chatbot_id, db)
+    history, next_cursor = ChatService.get_chat_history(user_id, chatbot_id, db, limit, cursor, newest_first)
+    if next_cursor is not None:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return history
 
 """
 # localhost:8000/chat POST
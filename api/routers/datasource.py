@@ -1,9 +1,10 @@
 # /datasource
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, UploadFile
 from api.schemas.datasource import DataSourceCreate, DataSourceGet
 from api.services.datasource import DataSourceService
 from api.services.jwt import JwtService
 from api.services.utils.db import get_db
+from api.config import TRAINED_CHATBOT_ID
 from sqlalchemy.orm import Session
 from typing import List
 
@@ -11,13 +12,31 @@ from typing import List
 datasource_router = APIRouter()
 
 # localhost:8000/datasource POST
-@datasource_router.post("/")
-def create_datasource(dataContent: str, db: Session = Depends(get_db)):
+@datasource_router.post("/", response_model=DataSourceGet, status_code=202)
+def create_datasource(dataContent: str, chatbot_id: int = TRAINED_CHATBOT_ID, db: Session = Depends(get_db)):
     """
     Create a new datasource
+    Its content is ingested in the background, follow the ingestion with GET /datasource/{data_id}
     """
 
-    return DataSourceService.create_datasource(dataContent, db)
+    return DataSourceService.create_datasource(dataContent, chatbot_id, db)
+
+# localhost:8000/datasource/pdf POST
+@datasource_router.post("/pdf", response_model=DataSourceGet, status_code=202)
+def create_pdf_datasource(file: UploadFile, chatbot_id: int = TRAINED_CHATBOT_ID, db: Session = Depends(get_db)):
+    """
+    Create a new datasource from a PDF file
+    Its pages are ingested in the background, follow the ingestion with GET /datasource/{data_id}
+    """
+
+    return DataSourceService.create_pdf_datasource(file.file, chatbot_id, db)
+
+@datasource_router.get("/{data_id}", response_model=DataSourceGet)
+def get_datasource(data_id: int, db: Session = Depends(get_db)):
+    """
+    Get a datasource by id, with the status and progress of its ingestion
+    """
+    return DataSourceService.get_datasource(data_id, db)
 
 @datasource_router.delete("/{data_id}", response_model=DataSourceGet)
 def delete_datasource(data_id: int, db: Session = Depends(get_db)):
@@ -0,0 +1,88 @@
+# /metrics
+from fastapi import APIRouter, Depends
+from api.services.answer_cache import ExactCacheService, SemanticCacheService
+from api.services.message_buffer import get_message_buffer
+from api.services.password import PasswordService
+from api.services.utils.db import engine
+from api.services.vectorstore import VectorStoreService
+from api.services.ingestion import IngestionService
+from api.services.jwt import JwtService
+
+
+# The counters describe the capacity of the node, they are not public
+metrics_router = APIRouter(dependencies=[Depends(JwtService.get_current_user)])
+
+@metrics_router.get("/embedding-cache")
+def get_embedding_cache_metrics():
+    """
+    Internal endpoint
+    Get the hit and miss counters of the embedding cache of this process
+    """
+    from api.services.embedding import CachedEmbeddings
+    return CachedEmbeddings.stats()
+
+@metrics_router.get("/embedding-scheduler")
+def get_embedding_scheduler_metrics():
+    """
+    Internal endpoint
+    Get the batching counters of the embedding scheduler of this process
+    """
+    from api.services.embedding import get_scheduler
+    return get_scheduler().stats()
+
+@metrics_router.get("/semantic-cache")
+def get_semantic_cache_metrics():
+    """
+    Internal endpoint
+    Get the hit and miss counters of the semantic answer cache of this process
+    """
+    return SemanticCacheService.stats()
+
+@metrics_router.get("/answer-cache")
+def get_answer_cache_metrics():
+    """
+    Internal endpoint
+    Get the size and hit rate of the exact answer cache
+    """
+    return ExactCacheService.stats()
+
+
+@metrics_router.get("/message-buffer")
+def get_message_buffer_metrics():
+    """
+    Internal endpoint
+    Get the queue depth and flush counters of the message write-behind buffer of this process
+    """
+    return get_message_buffer().stats()
+
+@metrics_router.get("/password-hashing")
+def get_password_hashing_metrics():
+    """
+    Internal endpoint
+    Get the hashes in flight and the requests rejected by the password executor of this process
+    """
+    return PasswordService.stats()
+
+@metrics_router.get("/db-pool")
+def get_db_pool_metrics():
+    """
+    Internal endpoint
+    Get the connections, wait and connect times of the database pool of this process
+    """
+    return engine.pool.stats()
+
+@metrics_router.get("/vector-indexes")
+def get_vector_index_metrics():
+    """
+    Internal endpoint
+    Get the memory taken by the vector indexes loaded by this process, per chatbot
+    """
+    return VectorStoreService.stats()
+
+@metrics_router.get("/ingestion")
+def get_ingestion_metrics():
+    """
+    Internal endpoint
+    Get the ingestion jobs submitted, completed, failed and pending in this process
+    """
+    return IngestionService.stats()
\ No newline at end of file
@@ -25,11 +25,11 @@ class MessageGet(MessageBase):
     """
     Pydantic model for retrieving a message
     """
-    message_id: int = Field(..., description="ID of the Message")
+    message_id: int = Field(..., description="ID of the Message", validation_alias="id")
     chatbot_content: str = Field(..., description="Message of the bot")
     user_id: int = Field(..., description="ID of the User")
     chatbot_id: int = Field(..., description="ID of the ChatBot")
-    created_at: datetime = Field(..., description="Creation timestamp of the message")
+    created_at: datetime = Field(..., description="Creation timestamp of the message", validation_alias="timestamp")
 
     class Config:
         orm_mode = True
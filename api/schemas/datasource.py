@@ -25,10 +25,12 @@ class DataSourceGet(DataSourceBase):
     Pydantic model for retrieving a datasource
     """
     id: int = Field(..., description="ID of the datasource")
-    data_type: str = Field(..., description="Document type")
+    data_type: str = Field(..., description="Document type: text or pdf")
     chatbot_id: int = Field(..., description="ID of the ChatBot")
     created_at: datetime = Field(..., description="Creation timestamp of the datasource")
-    status: int = Field(..., description="Status of the datasource")
+    status: int = Field(..., description="Status of the datasource: 0 deleted, 1 ready, 2 queued, 3 processing, 4 failed")
+    progress: int = Field(0, description="Percentage of the content ingested")
+    error: str | None = Field(None, description="Error of a failed ingestion")
     
     class Config:
         from_attributes = True
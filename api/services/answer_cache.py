@@ -0,0 +1,364 @@
+# services/answer_cache.py
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from typing import List
+import numpy as np
+from starlette.concurrency import run_in_threadpool
+from api.services.utils.cache import LRUCache
+from api.config import (
+    ANSWER_CACHE_BACKEND, ANSWER_CACHE_MAX_ENTRIES, ANSWER_CACHE_PATH, ANSWER_CACHE_TTL_SECONDS,
+    SEMANTIC_CACHE_ENABLED, SEMANTIC_CACHE_MAX_CHATBOTS, SEMANTIC_CACHE_MAX_ENTRIES, SEMANTIC_CACHE_THRESHOLD, SEMANTIC_CACHE_TTL_SECONDS,
+)
+
+class MemoryAnswerBackend:
+    """
+    Exact answer cache backend kept in the memory of the process
+    """
+
+    def __init__(self, max_size: int, ttl: float):
+        self._cache = LRUCache(max_size=max_size, ttl=ttl)
+
+    def get(self, key: str) -> str | None:
+        return self._cache.get(key)
+
+    def set(self, key: str, answer: str):
+        self._cache.set(key, answer)
+
+    def __len__(self) -> int:
+        return len(self._cache)
+
+
+class SQLiteAnswerBackend:
+    """
+    Exact answer cache backend stored in a local SQLite file, shared by the workers of a node
+
+    A hit only refreshes the last use of an answer when it is older than a fraction of the TTL,
+    so most hits are plain reads and the workers don't serialize on the write lock of the database.
+    """
+
+    # Share of the TTL after which a hit records the last use of an answer again
+    TOUCH_FRACTION = 0.1
+
+    def __init__(self, path: str, max_size: int, ttl: float):
+        self.path = path
+        self.max_size = max_size
+        self.ttl = ttl
+        self._local = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connection() as connection:
+            connection.execute("CREATE TABLE IF NOT EXISTS answer (key TEXT PRIMARY KEY, answer TEXT NOT NULL, expires_at REAL NOT NULL, used_at REAL NOT NULL)")
+            connection.execute("CREATE INDEX IF NOT EXISTS answer_used_at ON answer (used_at)")
+
+    def _connection(self) -> sqlite3.Connection:
+        """
+        Get the connection of the current thread, sqlite connections can't be shared between threads
+        """
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5)
+            # Readers don't block the writer of another worker
+            connection.execute("PRAGMA journal_mode=WAL")
+            self._local.connection = connection
+        return connection
+
+    def get(self, key: str) -> str | None:
+        now = time.time()
+        with self._connection() as connection:
+            row = connection.execute("SELECT answer, used_at FROM answer WHERE key = ? AND expires_at > ?", (key, now)).fetchone()
+            if row is None:
+                return None
+            # The order of the least recently used answers only needs to be approximate
+            if now - row[1] > self.ttl * SQLiteAnswerBackend.TOUCH_FRACTION:
+                connection.execute("UPDATE answer SET used_at = ? WHERE key = ?", (now, key))
+        return row[0]
+
+    def set(self, key: str, answer: str):
+        now = time.time()
+        with self._connection() as connection:
+            connection.execute("INSERT OR REPLACE INTO answer (key, answer, expires_at, used_at) VALUES (?, ?, ?, ?)", (key, answer, now + self.ttl, now))
+            # Drop the expired answers, then the least recently used ones over the maximum size
+            connection.execute("DELETE FROM answer WHERE expires_at <= ?", (now,))
+            connection.execute("DELETE FROM answer WHERE key IN (SELECT key FROM answer ORDER BY used_at DESC LIMIT -1 OFFSET ?)", (self.max_size,))
+
+    def __len__(self) -> int:
+        return self._connection().execute("SELECT COUNT(*) FROM answer").fetchone()[0]
+
+
+class ExactCacheService:
+    """
+    Service class for the exact answer cache of chatbots
+
+    Answers are keyed by chatbot, normalized question and version of the chatbot data,
+    so a repeated question is answered without retrieval nor LLM call, and answers from older data are never served.
+    The async paths use aget and aset, which keep the I/O of the sqlite backend off the event loop.
+    """
+
+    _backend = None
+    _backend_lock = threading.Lock()
+    hits = 0
+    misses = 0
+
+    @staticmethod
+    def get_backend():
+        """
+        Get the backend selected by ANSWER_CACHE_BACKEND, created on first use
+        """
+        if ExactCacheService._backend is None:
+            # The backend can be created from several threads of the threadpool at once
+            with ExactCacheService._backend_lock:
+                if ExactCacheService._backend is None:
+                    if ANSWER_CACHE_BACKEND == "sqlite":
+                        ExactCacheService._backend = SQLiteAnswerBackend(ANSWER_CACHE_PATH, ANSWER_CACHE_MAX_ENTRIES, ANSWER_CACHE_TTL_SECONDS)
+                    else:
+                        ExactCacheService._backend = MemoryAnswerBackend(ANSWER_CACHE_MAX_ENTRIES, ANSWER_CACHE_TTL_SECONDS)
+        return ExactCacheService._backend
+
+    @staticmethod
+    def normalize(question: str) -> str:
+        """
+        Normalize a question so that differences of case, spacing and surrounding punctuation share an answer
+        """
+        question = " ".join(unicodedata.normalize("NFKC", question).casefold().split())
+        return question.strip(" ?!.,;:¿¡")
+
+    @staticmethod
+    def _key(chatbot_id: int, question: str, version: int) -> str:
+        """
+        Get the cache key of a question
+        """
+        digest = hashlib.sha256(ExactCacheService.normalize(question).encode("utf-8")).hexdigest()
+        return f"{chatbot_id}:{version}:{digest}"
+
+    @staticmethod
+    def get(chatbot_id: int, question: str, version: int) -> str | None:
+        """
+        Get the cached answer of a question
+
+        Parameters
+        ----------
+        chatbot_id : int
+            ID of the chatbot
+        question : str
+            Question of the user
+        version : int
+            Version of the chatbot data
+
+        Returns
+        -------
+        str, optional
+            Cached answer, None if the question was not answered for this version of the data
+        """
+        if ANSWER_CACHE_BACKEND == "none":
+            return None
+        answer = ExactCacheService.get_backend().get(ExactCacheService._key(chatbot_id, question, version))
+        if answer is None:
+            ExactCacheService.misses += 1
+        else:
+            ExactCacheService.hits += 1
+        return answer
+
+    @staticmethod
+    def set(chatbot_id: int, question: str, version: int, answer: str):
+        """
+        Cache the answer to a question
+
+        Parameters
+        ----------
+        chatbot_id : int
+            ID of the chatbot
+        question : str
+            Question of the user
+        version : int
+            Version of the chatbot data the answer was generated from
+        answer : str
+            Answer of the chatbot
+        """
+        if ANSWER_CACHE_BACKEND == "none":
+            return
+        ExactCacheService.get_backend().set(ExactCacheService._key(chatbot_id, question, version), answer)
+
+    @staticmethod
+    async def aget(chatbot_id: int, question: str, version: int) -> str | None:
+        """
+        Get the cached answer of a question without blocking the event loop, see get
+        """
+        if ANSWER_CACHE_BACKEND != "sqlite":
+            # The memory backend never blocks, a thread would only add latency
+            return ExactCacheService.get(chatbot_id, question, version)
+        return await run_in_threadpool(ExactCacheService.get, chatbot_id, question, version)
+
+    @staticmethod
+    async def aset(chatbot_id: int, question: str, version: int, answer: str):
+        """
+        Cache the answer to a question without blocking the event loop, see set
+        """
+        if ANSWER_CACHE_BACKEND != "sqlite":
+            ExactCacheService.set(chatbot_id, question, version, answer)
+            return
+        await run_in_threadpool(ExactCacheService.set, chatbot_id, question, version, answer)
+
+    @staticmethod
+    def stats() -> dict:
+        """
+        Get the counters of the exact answer cache
+
+        Returns
+        -------
+        dict
+            Backend, cached answers, hits, misses and hit rate since the process started
+        """
+        total = ExactCacheService.hits + ExactCacheService.misses
+        return {
+            "backend": ANSWER_CACHE_BACKEND,
+            "size": len(ExactCacheService.get_backend()) if ANSWER_CACHE_BACKEND != "none" else 0,
+            "hits": ExactCacheService.hits,
+            "misses": ExactCacheService.misses,
+            "hit_rate": ExactCacheService.hits / total if total else 0.0,
+        }
+
+
+class _SemanticEntries:
+    """
+    Answers cached for one version of the data of a chatbot, with the normalized embedding of their question
+    """
+
+    def __init__(self, version: int):
+        self.version = version
+        self.embeddings: np.ndarray | None = None
+        self.answers: List[str] = []
+        self.expires_at: List[float] = []
+        self.lock = threading.Lock()
+
+
+class SemanticCacheService:
+    """
+    Service class for the semantic answer cache of trained chatbots
+
+    A question whose embedding is within SEMANTIC_CACHE_THRESHOLD cosine similarity of a cached question
+    of the same chatbot gets the cached answer, without retrieval nor LLM call.
+    Entries are scoped to the version of the chatbot data, so they are dropped as soon as the data changes.
+    """
+
+    # Cached answers of each chatbot, the least recently used chatbots are evicted
+    _chatbots = LRUCache(max_size=SEMANTIC_CACHE_MAX_CHATBOTS)
+    hits = 0
+    misses = 0
+
+    @staticmethod
+    def _normalize(embedding: List[float]) -> np.ndarray:
+        """
+        Normalize an embedding so the dot product of two of them is their cosine similarity
+        """
+        vector = np.asarray(embedding, dtype=np.float32)
+        return vector / (np.linalg.norm(vector) or 1.0)
+
+    @staticmethod
+    def _entries(chatbot_id: int, version: int) -> _SemanticEntries:
+        """
+        Get the cached answers of a chatbot for a version of its data, dropping the answers of older versions
+        """
+        entries = SemanticCacheService._chatbots.get(chatbot_id)
+        if entries is None or entries.version != version:
+            entries = _SemanticEntries(version)
+            SemanticCacheService._chatbots.set(chatbot_id, entries)
+        return entries
+
+    @staticmethod
+    def get(chatbot_id: int, version: int, embedding: List[float] | None) -> str | None:
+        """
+        Get the cached answer of the closest question of a chatbot, if it is similar enough
+
+        Parameters
+        ----------
+        chatbot_id : int
+            ID of the chatbot
+        version : int
+            Version of the chatbot data
+        embedding : List[float], optional
+            Embedding of the question, None for a question retrieved without embedding
+
+        Returns
+        -------
+        str, optional
+            Cached answer, None if no cached question is similar enough
+        """
+        if not SEMANTIC_CACHE_ENABLED or embedding is None:
+            return None
+        entries = SemanticCacheService._entries(chatbot_id, version)
+        with entries.lock:
+            answer = None
+            if entries.embeddings is not None:
+                # Cosine similarity with every cached question at once
+                similarities = entries.embeddings @ SemanticCacheService._normalize(embedding)
+                # Expired answers never match
+                similarities[np.asarray(entries.expires_at) < time.monotonic()] = -1.0
+                best = int(np.argmax(similarities))
+                if similarities[best] >= SEMANTIC_CACHE_THRESHOLD:
+                    answer = entries.answers[best]
+        if answer is None:
+            SemanticCacheService.misses += 1
+        else:
+            SemanticCacheService.hits += 1
+        return answer
+
+    @staticmethod
+    def set(chatbot_id: int, version: int, embedding: List[float] | None, answer: str):
+        """
+        Cache the answer to a question of a chatbot
+
+        Expired answers are dropped first, then the oldest ones while the chatbot has more than SEMANTIC_CACHE_MAX_ENTRIES.
+
+        Parameters
+        ----------
+        chatbot_id : int
+            ID of the chatbot
+        version : int
+            Version of the chatbot data the answer was generated from
+        embedding : List[float], optional
+            Embedding of the question, answers to questions retrieved without embedding are not cached
+        answer : str
+            Answer of the chatbot
+        """
+        if not SEMANTIC_CACHE_ENABLED or embedding is None:
+            return
+        entries = SemanticCacheService._entries(chatbot_id, version)
+        vector = SemanticCacheService._normalize(embedding)[np.newaxis, :]
+        with entries.lock:
+            now = time.monotonic()
+            keep = [i for i, expires_at in enumerate(entries.expires_at) if expires_at >= now]
+            keep = keep[-(SEMANTIC_CACHE_MAX_ENTRIES - 1):] if SEMANTIC_CACHE_MAX_ENTRIES > 1 else []
+            embeddings = entries.embeddings[keep] if entries.embeddings is not None and keep else None
+            entries.embeddings = vector if embeddings is None else np.vstack([embeddings, vector])
+            entries.answers = [entries.answers[i] for i in keep] + [answer]
+            entries.expires_at = [entries.expires_at[i] for i in keep] + [now + SEMANTIC_CACHE_TTL_SECONDS]
+
+    @staticmethod
+    def invalidate(chatbot_id: int):
+        """
+        Drop every cached answer of a chatbot
+        """
+        SemanticCacheService._chatbots.pop(chatbot_id)
+
+    @staticmethod
+    def stats() -> dict:
+        """
+        Get the counters of the semantic cache
+
+        Returns
+        -------
+        dict
+            Cached chatbots, hits, misses and hit rate since the process started
+        """
+        total = SemanticCacheService.hits + SemanticCacheService.misses
+        return {
+            "chatbots": len(SemanticCacheService._chatbots),
+            "hits": SemanticCacheService.hits,
+            "misses": SemanticCacheService.misses,
+            "hit_rate": SemanticCacheService.hits / total if total else 0.0,
+        }
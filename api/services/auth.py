@@ -1,5 +1,6 @@
 # services/auth.py
 from sqlalchemy.orm import Session
+from sqlalchemy.exc import SQLAlchemyError
 from api.models.user import UserModel
 from fastapi import HTTPException
 
@@ -35,5 +36,15 @@ class AuthService:
         # If the user is not found, raise an HTTPException
         if not user or not user.verify_password(password):
             raise HTTPException(status_code=404, detail="Incorrect email or password.")
+
+        # Hashes made with an older cost factor are upgraded while the password is known
+        if user.needs_rehash():
+            try:
+                user.password = password
+                db.commit()
+            except SQLAlchemyError:
+                # The login doesn't depend on the rehash, it is retried on the next one
+                db.rollback()
+
         # Return the user
         return user
\ No newline at end of file
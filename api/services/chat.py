@@ -4,8 +4,16 @@ from fastapi import HTTPException
 from api.models.chat import MessageModel #,ChatModel
 from api.schemas.chat import MessageCreate, MessageGet #ChatCreate, ChatGet
 from api.services.chatbot import ChatbotService
-from typing import List
+from api.services.conversation import ConversationContext, ConversationService
+from api.services.answer_cache import ExactCacheService
+from api.services.vectorstore import VectorStoreService
+from api.services.message_buffer import get_message_buffer
+from api.config import MESSAGE_WRITE_BEHIND
+from starlette.concurrency import run_in_threadpool
+from sqlalchemy import tuple_
+from typing import AsyncIterator, List, Tuple
 from datetime import datetime
+import base64
 
 # El ChatService llama al ChatbotModel y este retorna una respuesta  que es la que se da al usuario
 class ChatService:
@@ -13,8 +21,12 @@ class ChatService:
     Service class for chat related operations
     """
 
+    # Default and maximum messages of a page of the chat history
+    HISTORY_PAGE_SIZE = 50
+    HISTORY_MAX_PAGE_SIZE = 200
+
     @staticmethod
-    def send_message(message: str, db: Session) -> str:
+    async def send_message(message: str, user_id: int, chatbot_id: int, db: Session, stateless: bool = False) -> str:
         """
         Send a message to a specific chatbot and receive a response
 
@@ -22,8 +34,14 @@ class ChatService:
         ----------
         message : MessageCreate
             Pydantic model for creating a message
+        user_id : int
+            ID of the User
+        chatbot_id : int
+            ID of the ChatBot
         db : Session
             Database Session
+        stateless : bool
+            Answer the message without the context of the conversation, the answer can then be cached
 
         Returns
         -------
@@ -35,34 +53,33 @@ class ChatService:
             # This part is not implemented, depends on chatbot service implementation
             # Call chatbot service here and add the response as a new message in the chat
             # For example:
-            bot_response = ChatbotService.get_response(message)
-
-            # Create a new message instance with the user and chatbot messages
-            messageObject = MessageModel(
-                user_content=message,
-                chatbot_content=bot_response,
-                user_id=1,
-                chatbot_id=1,
-                timestamp=datetime.utcnow()
-            )
-
-            # Add the message to the database session
-            db.add(messageObject)
-            db.commit()
-            db.refresh(messageObject)
+            if stateless:
+                # Without context the same question gets the same answer, check the exact answer cache first
+                version = VectorStoreService.get_version(chatbot_id)
+                bot_response = await ExactCacheService.aget(chatbot_id, message, version)
+                if bot_response is None:
+                    bot_response = await ChatbotService.aget_response(message)
+                    await ExactCacheService.aset(chatbot_id, message, version, bot_response)
+            else:
+                # The context of the conversation is loaded once and kept by the conversation service
+                context = await ChatService.load_context(user_id, chatbot_id, db)
+                bot_response = await ChatbotService.aget_response(message, context)
+
+            # Save the user and chatbot messages
+            await ChatService.asave_message(message, bot_response, user_id, chatbot_id, db)
 
             return bot_response
 
         except SQLAlchemyError as e:
             # Rollback the changes if there is an error
-            db.rollback()
+            await run_in_threadpool(db.rollback)
             # Format the error message
             error_message = f"Database error: {e.orig}"
             # Raise an HTTPException with the error message
             raise HTTPException(status_code=500, detail=error_message)
 
     @staticmethod
-    def send_trained_message(message: str, db: Session) -> str:
+    async def send_trained_message(message: str, chatbot_id: int, db: Session) -> str:
         """
         Send a message to a specific trained chatbot and receive a response
 
@@ -70,6 +87,8 @@ class ChatService:
         ----------
         message : MessageCreate
             Pydantic model for creating a message
+        chatbot_id : int
+            ID of the trained ChatBot
         db : Session
             Database Session
 
@@ -83,36 +102,317 @@ class ChatService:
             # This part is not implemented, depends on chatbot service implementation
             # Call chatbot service here and add the response as a new message in the chat
             # For example:
-            bot_response = ChatbotService.get_trained_response(message)
-
-            # Create a new message instance with the user and chatbot messages
-            messageObject = MessageModel(
-                user_content=message,
-                chatbot_content=bot_response,
-                user_id=1,
-                chatbot_id=2,
-                timestamp=datetime.utcnow()
-            )
+            # Repeated questions on the same data are answered from the exact answer cache
+            version = VectorStoreService.get_version(chatbot_id)
+            bot_response = await ExactCacheService.aget(chatbot_id, message, version)
+            if bot_response is None:
+                bot_response = await ChatbotService.aget_trained_response(message, chatbot_id)
+                await ExactCacheService.aset(chatbot_id, message, version, bot_response)
 
-            # Add the message to the database session
-            db.add(messageObject)
-            db.commit()
-            db.refresh(messageObject)
+            # Save the user and chatbot messages
+            await ChatService.asave_message(message, bot_response, 1, chatbot_id, db)
 
             return bot_response
 
         except SQLAlchemyError as e:
             # Rollback the changes if there is an error
-            db.rollback()
+            await run_in_threadpool(db.rollback)
+            # Format the error message
+            error_message = f"Database error: {e.orig}"
+            # Raise an HTTPException with the error message
+            raise HTTPException(status_code=500, detail=error_message)
+
+    @staticmethod
+    async def load_context(user_id: int, chatbot_id: int, db: Session) -> ConversationContext:
+        """
+        Load the context of a conversation, folding its older turns into the running summary when it grew too long
+
+        Parameters
+        ----------
+        user_id : int
+            ID of the User
+        chatbot_id : int
+            ID of the ChatBot
+        db : Session
+            Database Session
+
+        Returns
+        -------
+        ConversationContext
+            Summary and recent turns of the conversation
+        """
+        context = await run_in_threadpool(ConversationService.get_context, user_id, chatbot_id, db)
+
+        compacted = ConversationService.turns_to_compact(context)
+        if compacted:
+            summary = await ChatbotService.asummarize(context.summary, compacted)
+            await run_in_threadpool(ConversationService.save_summary, user_id, chatbot_id, summary, compacted, db)
+
+        return context
+
+    @staticmethod
+    def save_message(user_content: str, chatbot_content: str, user_id: int, chatbot_id: int, db: Session) -> MessageModel:
+        """
+        Save a user message and the chatbot response in the PostgreSQL database
+
+        Parameters
+        ----------
+        user_content : str
+            Message of the user
+        chatbot_content : str
+            Response of the chatbot
+        user_id : int
+            ID of the User
+        chatbot_id : int
+            ID of the ChatBot
+        db : Session
+            Database Session
+
+        Returns
+        -------
+        MessageModel
+            Saved message
+        """
+        # Create a new message instance with the user and chatbot messages
+        messageObject = MessageModel(
+            user_content=user_content,
+            chatbot_content=chatbot_content,
+            user_id=user_id,
+            chatbot_id=chatbot_id,
+            timestamp=datetime.utcnow()
+        )
+
+        # Add the message to the database session
+        db.add(messageObject)
+        db.commit()
+        db.refresh(messageObject)
+
+        # Keep the context of the conversation in sync with the message table
+        ConversationService.add_turn(user_id, chatbot_id, messageObject.timestamp, user_content, chatbot_content)
+
+        return messageObject
+
+    @staticmethod
+    async def asave_message(user_content: str, chatbot_content: str, user_id: int, chatbot_id: int, db: Session):
+        """
+        Save a user message and the chatbot response without blocking the event loop
+
+        With MESSAGE_WRITE_BEHIND the message is queued in the write-behind buffer and saved in the background,
+        it shows in the chat history once the buffer is flushed. When the buffer is full, the message is saved right away.
+
+        Parameters
+        ----------
+        user_content : str
+            Message of the user
+        chatbot_content : str
+            Response of the chatbot
+        user_id : int
+            ID of the User
+        chatbot_id : int
+            ID of the ChatBot
+        db : Session
+            Database Session
+        """
+        if not MESSAGE_WRITE_BEHIND:
+            # The database session is blocking
+            await run_in_threadpool(ChatService.save_message, user_content, chatbot_content, user_id, chatbot_id, db)
+            return
+
+        timestamp = datetime.utcnow()
+        buffered = get_message_buffer().add({
+            "user_content": user_content,
+            "chatbot_content": chatbot_content,
+            "user_id": user_id,
+            "chatbot_id": chatbot_id,
+            "timestamp": timestamp,
+            "created_at": timestamp,
+            "status": 1,
+        })
+        if not buffered:
+            # The buffer is full, the database is down or slow, the request waits for the insert instead
+            await run_in_threadpool(ChatService.save_message, user_content, chatbot_content, user_id, chatbot_id, db)
+            return
+        # The context of the conversation is updated right away, before the message is flushed
+        ConversationService.add_turn(user_id, chatbot_id, timestamp, user_content, chatbot_content)
+
+    @staticmethod
+    def format_event(data: str, event: str | None = None) -> str:
+        """
+        Format a server-sent event
+
+        Parameters
+        ----------
+        data : str
+            Data of the event, every line is sent in its own data field
+        event : str, optional
+            Name of the event
+
+        Returns
+        -------
+        str
+            Event ready to be written to the stream
+        """
+        lines = [f"event: {event}"] if event else []
+        lines += [f"data: {line}" for line in data.split("\n")]
+        return "\n".join(lines) + "\n\n"
+
+    @staticmethod
+    async def stream_events(tokens: AsyncIterator[str], user_content: str, user_id: int, chatbot_id: int, db: Session) -> AsyncIterator[str]:
+        """
+        Forward the tokens of a response as server-sent events and save the full response once the stream ends
+
+        Parameters
+        ----------
+        tokens : AsyncIterator[str]
+            Tokens of the chatbot response
+        user_content : str
+            Message of the user
+        user_id : int
+            ID of the User
+        chatbot_id : int
+            ID of the ChatBot
+        db : Session
+            Database Session
+
+        Returns
+        -------
+        AsyncIterator[str]
+            Server-sent events, a message event per token followed by an end event
+        """
+        bot_response = ""
+        try:
+            async for token in tokens:
+                bot_response += token
+                yield ChatService.format_event(token)
+            # Save the user and chatbot messages once the whole response was sent
+            await ChatService.asave_message(user_content, bot_response, user_id, chatbot_id, db)
+        except SQLAlchemyError as e:
+            # Rollback the changes if there is an error
+            await run_in_threadpool(db.rollback)
+            # The response status was already sent, report the error as an event
+            yield ChatService.format_event(f"Database error: {e.orig}", "error")
+            return
+        except Exception as e:
+            yield ChatService.format_event(str(e), "error")
+            return
+        yield ChatService.format_event("", "end")
+
+    @staticmethod
+    async def stream_message(message: str, user_id: int, chatbot_id: int, db: Session, stateless: bool = False) -> AsyncIterator[str]:
+        """
+        Send a message to a specific chatbot and stream its response as server-sent events
+
+        Parameters
+        ----------
+        message : str
+            Message of the user
+        user_id : int
+            ID of the User
+        chatbot_id : int
+            ID of the ChatBot
+        db : Session
+            Database Session
+        stateless : bool
+            Answer the message without the context of the conversation, the answer can then be cached
+
+        Returns
+        -------
+        AsyncIterator[str]
+            Server-sent events with the tokens of the response
+        """
+        if stateless:
+            # Without context the same question gets the same answer, check the exact answer cache first
+            version = VectorStoreService.get_version(chatbot_id)
+            cached = await ExactCacheService.aget(chatbot_id, message, version)
+            if cached is not None:
+                tokens = ChatService.cached_tokens(cached)
+            else:
+                tokens = ChatService.caching_tokens(ChatbotService.astream_response(message), chatbot_id, message, version)
+            return ChatService.stream_events(tokens, message, user_id, chatbot_id, db)
+
+        try:
+            # Load the conversation before the stream starts, so errors are still sent as a status code
+            context = await ChatService.load_context(user_id, chatbot_id, db)
+        except SQLAlchemyError as e:
+            # Rollback the changes if there is an error
+            await run_in_threadpool(db.rollback)
             # Format the error message
             error_message = f"Database error: {e.orig}"
             # Raise an HTTPException with the error message
             raise HTTPException(status_code=500, detail=error_message)
+        return ChatService.stream_events(ChatbotService.astream_response(message, context), message, user_id, chatbot_id, db)
+
+    @staticmethod
+    async def stream_trained_message(message: str, chatbot_id: int, db: Session) -> AsyncIterator[str]:
+        """
+        Send a message to a specific trained chatbot and stream its response as server-sent events
+
+        Parameters
+        ----------
+        message : str
+            Message of the user
+        chatbot_id : int
+            ID of the trained ChatBot
+        db : Session
+            Database Session
+
+        Returns
+        -------
+        AsyncIterator[str]
+            Server-sent events with the tokens of the response
+        """
+        # Repeated questions on the same data are answered from the exact answer cache
+        version = VectorStoreService.get_version(chatbot_id)
+        cached = await ExactCacheService.aget(chatbot_id, message, version)
+        if cached is not None:
+            tokens = ChatService.cached_tokens(cached)
+        else:
+            tokens = ChatService.caching_tokens(ChatbotService.astream_trained_response(message, chatbot_id), chatbot_id, message, version)
+        return ChatService.stream_events(tokens, message, 1, chatbot_id, db)
+
+    @staticmethod
+    async def cached_tokens(answer: str) -> AsyncIterator[str]:
+        """
+        Send a cached answer as a single token
+        """
+        yield answer
+
+    @staticmethod
+    async def caching_tokens(tokens: AsyncIterator[str], chatbot_id: int, message: str, version: int) -> AsyncIterator[str]:
+        """
+        Forward the tokens of a response and cache the full response once it is complete
+        """
+        response = ""
+        async for token in tokens:
+            response += token
+            yield token
+        await ExactCacheService.aset(chatbot_id, message, version, response)
 
     @staticmethod
-    def get_chat_history(user_id: int, chatbot_id: int, db: Session) -> List[MessageGet]:
+    def encode_cursor(message: MessageModel) -> str:
         """
-        Retrieve chat history by user and chatbot IDs
+        Encode the position of a message in the chat history as an opaque cursor
+        """
+        return base64.urlsafe_b64encode(f"{message.timestamp.isoformat()}|{message.id}".encode("utf-8")).decode("ascii")
+
+    @staticmethod
+    def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+        """
+        Decode a cursor of the chat history into the timestamp and id of the message it points to
+        """
+        try:
+            timestamp, message_id = base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8").split("|")
+            return datetime.fromisoformat(timestamp), int(message_id)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    @staticmethod
+    def get_chat_history(user_id: int, chatbot_id: int, db: Session, limit: int = HISTORY_PAGE_SIZE, cursor: str | None = None, newest_first: bool = False) -> Tuple[List[MessageModel], str | None]:
+        """
+        Retrieve a page of the chat history by user and chatbot IDs
+
+        Pages are read with keyset pagination on (timestamp, id),
+        so every page costs the same however long the history is.
 
         Parameters
         ----------
@@ -122,22 +422,40 @@ class ChatService:
             ID of the ChatBot
         db : Session
             Database Session
+        limit : int
+            Maximum messages of the page
+        cursor : str, optional
+            Cursor returned with the previous page, None for the first page
+        newest_first : bool
+            Return the most recent messages first
 
         Returns
         -------
-        List[MessageGet]
-            List of Pydantic models for retrieving messages
+        Tuple[List[MessageModel], str | None]
+            Messages of the page and cursor of the next page, None if it is the last page
         """
 
         try:
             # Get chat history for the given user_id and chatbot_id
-            history = db.query(MessageModel).filter(
+            query = db.query(MessageModel).filter(
                 MessageModel.user_id == user_id,
                 MessageModel.chatbot_id == chatbot_id
-            ).all()
-
-            # Return the chat history
-            return history
+            )
+            # Continue right after the last message of the previous page
+            if cursor is not None:
+                position = tuple_(MessageModel.timestamp, MessageModel.id)
+                query = query.filter(position < ChatService.decode_cursor(cursor) if newest_first else position > ChatService.decode_cursor(cursor))
+            if newest_first:
+                query = query.order_by(MessageModel.timestamp.desc(), MessageModel.id.desc())
+            else:
+                query = query.order_by(MessageModel.timestamp.asc(), MessageModel.id.asc())
+
+            # One extra message tells if there is a next page
+            history = query.limit(limit + 1).all()
+            next_cursor = ChatService.encode_cursor(history[limit - 1]) if len(history) > limit else None
+
+            # Return the page of the chat history
+            return history[:limit], next_cursor
 
         except SQLAlchemyError as e:
             # Format the error message
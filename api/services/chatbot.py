@@ -1,21 +1,23 @@
 from api.schemas.chatbot import ChatbotCreate, ChatbotGet, ChatbotUpdate
+from typing import TYPE_CHECKING, AsyncIterator, List, Tuple
 from sqlalchemy.orm import Session
 from sqlalchemy.exc import SQLAlchemyError
 from fastapi import HTTPException
 from api.models.chatbot import ChatBotModel
+from api.services.vectorstore import VectorStoreService
+from api.services.answer_cache import SemanticCacheService
+from api.services.context import ContextService
+from api.services.conversation import ConversationContext, ConversationService, Turn
+from api.config import LLM_MAX_CONNECTIONS, LLM_TIMEOUT_SECONDS
+from starlette.concurrency import run_in_threadpool
 import os
 from dotenv import load_dotenv
+import aiohttp
 import openai
-import pandas as pd
-import matplotlib.pyplot as plt
-from transformers import GPT2TokenizerFast
-from langchain.document_loaders import PyPDFLoader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain.embeddings import OpenAIEmbeddings
-from langchain.vectorstores import FAISS
-from langchain.chains.question_answering import load_qa_chain
-from langchain.llms import OpenAI
-from langchain.chains import ConversationalRetrievalChain
+
+# langchain takes seconds to import, it is only loaded by the trained chatbots on first use
+if TYPE_CHECKING:
+    from langchain.vectorstores import FAISS
 
 # Load environment variables
 load_dotenv()
@@ -27,7 +29,10 @@ class ChatbotService:
 
     openai.api_key = os.getenv("OPENAI_API_KEY")
 
-    messages = [{"role": "system", "content": "You are a intelligent assistant."}]
+    qa_chain = None
+
+    # HTTP session shared by the async OpenAI calls
+    aiosession = None
 
     @staticmethod
     def create_chatbot(chatbot: ChatbotCreate, db: Session) -> ChatbotGet:
@@ -190,37 +195,279 @@ class ChatbotService:
             raise HTTPException(status_code=500, detail=error_message)
 
     @staticmethod
-    def get_response(userMessage: str) -> str:
-        message = userMessage
-        if message:
-            ChatbotService.messages.append(
-                {"role": "user", "content": message},
-            )
-            chat = openai.ChatCompletion.create(
-                model="gpt-3.5-turbo", messages=ChatbotService.messages, temperature=0.5
-            )
+    def get_response(userMessage: str, context: ConversationContext | None = None) -> str:
+        """
+        Get the response of the chatbot
 
-            response = chat.choices[0].message.content
-            ChatbotService.messages.append({"role":"assistant", "content":response})
-        return response
+        Parameters
+        ----------
+        userMessage : str
+            Message of the user
+        context : ConversationContext, optional
+            Summary and recent turns of the conversation, trimmed to the prompt token budget
+
+        Returns
+        -------
+        str
+            Response of the chatbot
+        """
+        chat = openai.ChatCompletion.create(
+            model="gpt-3.5-turbo", messages=ConversationService.build_prompt(context, userMessage), temperature=0.5
+        )
+
+        return chat.choices[0].message.content
+
+    @staticmethod
+    async def aget_response(userMessage: str, context: ConversationContext | None = None) -> str:
+        """
+        Get the response of the chatbot without blocking the event loop
+
+        Parameters
+        ----------
+        userMessage : str
+            Message of the user
+        context : ConversationContext, optional
+            Summary and recent turns of the conversation, trimmed to the prompt token budget
+
+        Returns
+        -------
+        str
+            Response of the chatbot
+        """
+        ChatbotService.use_aiosession()
+        chat = await openai.ChatCompletion.acreate(
+            model="gpt-3.5-turbo", messages=ConversationService.build_prompt(context, userMessage), temperature=0.5
+        )
+
+        return chat.choices[0].message.content
+
+    @staticmethod
+    async def astream_response(userMessage: str, context: ConversationContext | None = None) -> AsyncIterator[str]:
+        """
+        Get the response of the chatbot token by token, as the completion is generated
+
+        Parameters
+        ----------
+        userMessage : str
+            Message of the user
+        context : ConversationContext, optional
+            Summary and recent turns of the conversation, trimmed to the prompt token budget
+
+        Returns
+        -------
+        AsyncIterator[str]
+            Tokens of the response
+        """
+        ChatbotService.use_aiosession()
+        chat = await openai.ChatCompletion.acreate(
+            model="gpt-3.5-turbo", messages=ConversationService.build_prompt(context, userMessage), temperature=0.5, stream=True
+        )
+
+        async for chunk in chat:
+            token = chunk.choices[0].delta.get("content")
+            if token:
+                yield token
+
+    @staticmethod
+    async def asummarize(summary: str | None, turns: List[Turn]) -> str:
+        """
+        Fold turns of a conversation into its running summary without blocking the event loop
+
+        Parameters
+        ----------
+        summary : str, optional
+            Current summary of the conversation
+        turns : List[Turn]
+            Turns to fold into the summary
+
+        Returns
+        -------
+        str
+            Updated summary
+        """
+        ChatbotService.use_aiosession()
+        chat = await openai.ChatCompletion.acreate(
+            model="gpt-3.5-turbo", messages=ConversationService.build_summary_prompt(summary, turns), temperature=0
+        )
+
+        return chat.choices[0].message.content
 
     @staticmethod
-    def get_trained_response(userMessage: str) -> str:
-        # Train chatbot
-        loader = PyPDFLoader("TrainingData.pdf")
-        pages = loader.load_and_split()
-        chunks = pages
+    def get_qa_chain():
+        """
+        Get the QA chain that answers a query from the documents retrieved from a chatbot index
 
-        # Get embedding model
-        embeddings = OpenAIEmbeddings()
+        The chain is created once and shared by every request
+        """
+        if ChatbotService.qa_chain is None:
+            from langchain.chains.question_answering import load_qa_chain
+            from langchain.llms import OpenAI
+            # Create QA chain to integrate similarity search with user queries (answer query from knowledge base)
+            ChatbotService.qa_chain = load_qa_chain(OpenAI(temperature=0), chain_type="stuff")
+        return ChatbotService.qa_chain
 
-        # Create vector database
-        VectorDB = FAISS.from_documents(chunks, embeddings)
+    @staticmethod
+    def get_trained_response(userMessage: str, chatbot_id: int) -> str:
+        """
+        Answer a message using the knowledge base of a trained chatbot
 
-        # Create QA chain to integrate similarity search with user queries (answer query from knowledge base)
-        chain = load_qa_chain(OpenAI(temperature=0), chain_type="stuff")
+        Parameters
+        ----------
+        userMessage : str
+            Message of the user
+        chatbot_id : int
+            ID of the trained chatbot
+
+        Returns
+        -------
+        str
+            Response of the chatbot
+        """
+        # The vector database is built at ingest time and kept loaded, only the query is embedded here
+        version = VectorStoreService.get_version(chatbot_id)
+        VectorDB = VectorStoreService.get_index(chatbot_id)
 
         query = userMessage
-        docs = VectorDB.similarity_search(query)
+        # A question retrieved lexically is not embedded, it needs no call to the embedding provider
+        mode = ContextService.resolve_mode(VectorDB, query)
+        embedding = None
+        if mode != "lexical":
+            from api.services.embedding import get_embeddings
+            embedding = get_embeddings().embed_query(query)
+        # A similar question already answered from the same data is served from the cache
+        cached = SemanticCacheService.get(chatbot_id, version, embedding)
+        if cached is not None:
+            return cached
+
+        # The closest chunks, packed into the context token budget
+        docs = ContextService.retrieve(VectorDB, query, embedding, mode)
+
+        response = ChatbotService.get_qa_chain().run(input_documents=docs, question=query)
+        SemanticCacheService.set(chatbot_id, version, embedding, response)
+        return response
+
+    @staticmethod
+    async def aprepare(userMessage: str, chatbot_id: int) -> Tuple["FAISS", int, str, List[float] | None]:
+        """
+        Load the index of a trained chatbot and embed a message without blocking the event loop
+
+        A message retrieved lexically is not embedded.
+
+        Parameters
+        ----------
+        userMessage : str
+            Message of the user
+        chatbot_id : int
+            ID of the trained chatbot
+
+        Returns
+        -------
+        Tuple[FAISS, int, str, List[float] | None]
+            Index of the chatbot, version of its data, retrieval mode and embedding of the message
+        """
+        def load():
+            return VectorStoreService.get_version(chatbot_id), VectorStoreService.get_index(chatbot_id)
+
+        # Loading the index reads from disk the first time, keep it off the event loop
+        version, VectorDB = await run_in_threadpool(load)
+
+        # The answer of a lexical retrieval is still an async OpenAI call, the session is set up in every mode
+        ChatbotService.use_aiosession()
+        mode = ContextService.resolve_mode(VectorDB, userMessage)
+        if mode == "lexical":
+            return VectorDB, version, mode, None
+
+        from api.services.embedding import get_embeddings
+        embedding = await get_embeddings().aembed_query(userMessage)
+        return VectorDB, version, mode, embedding
+
+    @staticmethod
+    async def aget_trained_response(userMessage: str, chatbot_id: int) -> str:
+        """
+        Answer a message using the knowledge base of a trained chatbot without blocking the event loop
 
-        return chain.run(input_documents=docs, question=query)
\ No newline at end of file
+        Parameters
+        ----------
+        userMessage : str
+            Message of the user
+        chatbot_id : int
+            ID of the trained chatbot
+
+        Returns
+        -------
+        str
+            Response of the chatbot
+        """
+        VectorDB, version, mode, embedding = await ChatbotService.aprepare(userMessage, chatbot_id)
+        # A similar question already answered from the same data is served from the cache
+        cached = SemanticCacheService.get(chatbot_id, version, embedding)
+        if cached is not None:
+            return cached
+
+        # The closest chunks, packed into the context token budget, the search reads the mapped vectors and blocks
+        docs = await run_in_threadpool(ContextService.retrieve, VectorDB, userMessage, embedding, mode)
+
+        response = await ChatbotService.get_qa_chain().arun(input_documents=docs, question=userMessage)
+        SemanticCacheService.set(chatbot_id, version, embedding, response)
+        return response
+
+    @staticmethod
+    async def astream_trained_response(userMessage: str, chatbot_id: int) -> AsyncIterator[str]:
+        """
+        Answer a message using the knowledge base of a trained chatbot, token by token
+
+        Parameters
+        ----------
+        userMessage : str
+            Message of the user
+        chatbot_id : int
+            ID of the trained chatbot
+
+        Returns
+        -------
+        AsyncIterator[str]
+            Tokens of the response
+        """
+        VectorDB, version, mode, embedding = await ChatbotService.aprepare(userMessage, chatbot_id)
+        # A cached answer is sent at once
+        cached = SemanticCacheService.get(chatbot_id, version, embedding)
+        if cached is not None:
+            yield cached
+            return
+
+        # The closest chunks, packed into the context token budget, the search reads the mapped vectors and blocks
+        docs = await run_in_threadpool(ContextService.retrieve, VectorDB, userMessage, embedding, mode)
+
+        # Build the same prompt as the QA chain and stream the completion of its LLM
+        chain = ChatbotService.get_qa_chain()
+        context = chain.document_separator.join(doc.page_content for doc in docs)
+        prompt = chain.llm_chain.prompt.format(context=context, question=userMessage)
+        response = ""
+        async for token in chain.llm_chain.llm.astream(prompt):
+            response += token
+            yield token
+        SemanticCacheService.set(chatbot_id, version, embedding, response)
+
+    @staticmethod
+    def use_aiosession():
+        """
+        Make the OpenAI calls of the current task use the shared HTTP session
+
+        The session is created on first use and keeps a pool of connections open,
+        so concurrent LLM calls don't pay a new connection each.
+        """
+        if ChatbotService.aiosession is None or ChatbotService.aiosession.closed:
+            ChatbotService.aiosession = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=LLM_MAX_CONNECTIONS),
+                timeout=aiohttp.ClientTimeout(total=LLM_TIMEOUT_SECONDS),
+            )
+        openai.aiosession.set(ChatbotService.aiosession)
+
+    @staticmethod
+    async def close_aiosession():
+        """
+        Close the shared HTTP session of the OpenAI calls
+        """
+        if ChatbotService.aiosession is not None:
+            await ChatbotService.aiosession.close()
+            ChatbotService.aiosession = None
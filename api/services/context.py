@@ -0,0 +1,265 @@
+# services/context.py
+from typing import TYPE_CHECKING, List, Sequence, Tuple
+import numpy as np
+from api.services.utils.bm25 import tokenize
+from api.services.utils.tokens import count_tokens, get_encoding
+from api.config import (
+    CONTEXT_FETCH_K, CONTEXT_SCORE_MARGIN, CONTEXT_TOKEN_BUDGET,
+    RETRIEVAL_LEXICAL_MAX_TERMS, RETRIEVAL_MMR_FETCH_K, RETRIEVAL_MMR_LAMBDA, RETRIEVAL_MODE, RETRIEVAL_RRF_K,
+)
+
+if TYPE_CHECKING:
+    from langchain.schema import Document
+    from langchain.vectorstores import FAISS
+
+class ContextService:
+    """
+    Service class for the context of the answers of trained chatbots
+
+    The chunks retrieved for a question are packed into a fixed token budget: chunks much less similar
+    than the best one are dropped, text shared with a chunk already packed is removed,
+    and chunks are added from the most similar while they fit, so every prompt has a bounded size.
+    Chunks are retrieved by embedding, by BM25 over the lexical index of the chatbot without embedding the question,
+    or by both rankings fused, as set by RETRIEVAL_MODE.
+    Chunks retrieved by embedding are selected by maximal marginal relevance among more candidates,
+    so near duplicates don't fill the context.
+    """
+
+    # Shortest text shared by two chunks that is removed as an overlap, in characters
+    MIN_OVERLAP_CHARS = 32
+    # Tokens of the separator the QA chain puts between chunks
+    SEPARATOR_TOKENS = 2
+
+    @staticmethod
+    def similarity(distance: float) -> float:
+        """
+        Get the cosine similarity of a squared L2 distance returned by the index, the embeddings have unit length
+        """
+        return 1.0 - distance / 2.0
+
+    @staticmethod
+    def _overlap(before: str, after: str) -> int:
+        """
+        Get the length of the longest end of before that starts after
+        """
+        probe = after[:ContextService.MIN_OVERLAP_CHARS]
+        if len(probe) < ContextService.MIN_OVERLAP_CHARS:
+            return 0
+        start = before.find(probe)
+        while start != -1:
+            if after.startswith(before[start:]):
+                return len(before) - start
+            start = before.find(probe, start + 1)
+        return 0
+
+    @staticmethod
+    def _deduplicate(text: str, packed: List[str]) -> str:
+        """
+        Remove from a chunk the text it shares with the chunks already packed
+
+        Consecutive chunks of a document share their overlap, a chunk found whole in a packed one is emptied.
+        """
+        for other in packed:
+            if text in other:
+                return ""
+            # The chunk follows a packed one
+            text = text[ContextService._overlap(other, text):]
+            # The chunk precedes a packed one
+            overlap = ContextService._overlap(text, other)
+            if overlap:
+                text = text[:-overlap]
+        return text.strip()
+
+    @staticmethod
+    def pack(docs_and_scores: List[Tuple["Document", float | None]], token_budget: int = CONTEXT_TOKEN_BUDGET, score_margin: float = CONTEXT_SCORE_MARGIN) -> List["Document"]:
+        """
+        Pack retrieved chunks into a token budget
+
+        Parameters
+        ----------
+        docs_and_scores : List[Tuple[Document, float | None]]
+            Retrieved chunks with their squared L2 distance to the question, best first,
+            None for chunks ranked without a distance, which are never dropped by the score margin
+        token_budget : int
+            Maximum tokens of the packed chunks, separators included
+        score_margin : float
+            Chunks whose similarity is more than this under the similarity of the best chunk are dropped
+
+        Returns
+        -------
+        List[Document]
+            Chunks to send to the LLM in the order they were retrieved, with the text shared with a previous chunk removed
+        """
+        from langchain.schema import Document
+
+        if not docs_and_scores:
+            return []
+        best = ContextService.similarity(docs_and_scores[0][1]) if docs_and_scores[0][1] is not None else None
+
+        packed: List[Document] = []
+        remaining = token_budget
+        for doc, distance in docs_and_scores:
+            # The tail of weak matches only makes the prompt longer
+            if best is not None and distance is not None and ContextService.similarity(distance) < best - score_margin:
+                continue
+            text = ContextService._deduplicate(doc.page_content, [other.page_content for other in packed])
+            if not text:
+                continue
+            tokens = count_tokens(text) + (ContextService.SEPARATOR_TOKENS if packed else 0)
+            if tokens > remaining:
+                if packed:
+                    # A smaller chunk further down may still fit
+                    continue
+                # The best chunk alone is over the budget, it is cut to fit
+                text = get_encoding().decode(get_encoding().encode(text, disallowed_special=())[:remaining])
+                tokens = remaining
+            packed.append(Document(page_content=text, metadata=doc.metadata))
+            remaining -= tokens
+        return packed
+
+    @staticmethod
+    def mmr(query: np.ndarray, candidates: np.ndarray, k: int, lambda_mult: float = RETRIEVAL_MMR_LAMBDA) -> np.ndarray:
+        """
+        Select candidates by maximal marginal relevance
+
+        Every step picks the candidate with the best lambda_mult * similarity to the query
+        - (1 - lambda_mult) * highest similarity to a selected candidate.
+        The similarities between candidates are computed once as a matrix, a step is a vectorized update.
+
+        Parameters
+        ----------
+        query : np.ndarray
+            Embedding of the question
+        candidates : np.ndarray
+            Embeddings of the candidates, one per row, most similar first
+        k : int
+            Number of candidates to select
+        lambda_mult : float
+            Weight of the relevance, between 0 for the most diversity and 1 for the plain nearest candidates
+
+        Returns
+        -------
+        np.ndarray
+            Rows of the selected candidates, in the order they were selected
+        """
+        n_candidates = candidates.shape[0]
+        k = min(k, n_candidates)
+        if k == 0:
+            return np.zeros(0, dtype=np.int64)
+
+        # Cosine similarities to the query and between candidates
+        candidates = candidates / np.maximum(np.linalg.norm(candidates, axis=1, keepdims=True), 1e-12)
+        query = np.asarray(query, dtype=np.float32)
+        relevance = candidates @ (query / max(float(np.linalg.norm(query)), 1e-12))
+        similarities = candidates @ candidates.T
+
+        # The most relevant candidate comes first
+        selected = np.zeros(k, dtype=np.int64)
+        selected[0] = int(np.argmax(relevance))
+        available = np.ones(n_candidates, dtype=bool)
+        available[selected[0]] = False
+        # Highest similarity of each candidate to a selected one
+        redundancy = similarities[:, selected[0]].copy()
+        for step in range(1, k):
+            scores = lambda_mult * relevance - (1 - lambda_mult) * redundancy
+            scores[~available] = -np.inf
+            pick = int(np.argmax(scores))
+            selected[step] = pick
+            available[pick] = False
+            np.maximum(redundancy, similarities[:, pick], out=redundancy)
+        return selected
+
+    @staticmethod
+    def resolve_mode(VectorDB: "FAISS", question: str) -> str:
+        """
+        Get the retrieval mode of a question
+
+        In auto mode, a question of at most RETRIEVAL_LEXICAL_MAX_TERMS terms that all appear in the chunks
+        is retrieved lexically, without embedding it, the other questions use both rankings.
+
+        Parameters
+        ----------
+        VectorDB : FAISS
+            Index of the chatbot
+        question : str
+            Question of the user
+
+        Returns
+        -------
+        str
+            "vector", "lexical" or "hybrid"
+        """
+        if RETRIEVAL_MODE != "auto":
+            return RETRIEVAL_MODE
+        terms = tokenize(question)
+        if 0 < len(terms) <= RETRIEVAL_LEXICAL_MAX_TERMS and all(term in VectorDB.lexical for term in terms):
+            return "lexical"
+        return "hybrid"
+
+    @staticmethod
+    def fuse(rankings: Sequence[Sequence[int]], k: int) -> List[int]:
+        """
+        Fuse rankings of positions in the index with reciprocal rank fusion
+
+        Parameters
+        ----------
+        rankings : Sequence[Sequence[int]]
+            Positions ranked by each retrieval, best first
+        k : int
+            Maximum number of positions
+
+        Returns
+        -------
+        List[int]
+            Positions ranked by the sum of 1 / (RETRIEVAL_RRF_K + rank) over the rankings
+        """
+        scores = {}
+        for ranking in rankings:
+            for rank, position in enumerate(ranking, start=1):
+                scores[position] = scores.get(position, 0.0) + 1.0 / (RETRIEVAL_RRF_K + rank)
+        return sorted(scores, key=scores.get, reverse=True)[:k]
+
+    @staticmethod
+    def retrieve(VectorDB: "FAISS", question: str, embedding: List[float] | None, mode: str = "vector", k: int = CONTEXT_FETCH_K) -> List["Document"]:
+        """
+        Retrieve the chunks of a question and pack them into the token budget
+
+        Parameters
+        ----------
+        VectorDB : FAISS
+            Index of the chatbot
+        question : str
+            Question of the user
+        embedding : List[float], optional
+            Embedding of the question, not needed by the lexical mode
+        mode : str
+            Retrieval mode from resolve_mode
+        k : int
+            Chunks fetched from the index before packing
+
+        Returns
+        -------
+        List[Document]
+            Chunks to send to the LLM
+        """
+        def document(position: int) -> "Document":
+            return VectorDB.docstore.search(VectorDB.index_to_docstore_id[position])
+
+        if mode == "vector":
+            # Over fetch when the selection is by maximal marginal relevance
+            fetch_k = max(RETRIEVAL_MMR_FETCH_K, k) if RETRIEVAL_MMR_LAMBDA < 1 else k
+            distances, positions = VectorDB.index.search(np.array([embedding], dtype=np.float32), fetch_k)
+            found = positions[0] >= 0
+            distances, positions = distances[0][found], positions[0][found]
+            if RETRIEVAL_MMR_LAMBDA < 1:
+                selected = ContextService.mmr(np.asarray(embedding), VectorDB.index.reconstruct_batch(positions), k)
+                distances, positions = distances[selected], positions[selected]
+            return ContextService.pack([(document(position), distance) for position, distance in zip(positions.tolist(), distances.tolist())])
+
+        _, lexical_positions = VectorDB.lexical.search(question, k)
+        if mode == "lexical":
+            positions = lexical_positions.tolist()
+        else:
+            _, vector_positions = VectorDB.index.search(np.array([embedding], dtype=np.float32), k)
+            positions = ContextService.fuse([[position for position in vector_positions[0].tolist() if position >= 0], lexical_positions.tolist()], k)
+        return ContextService.pack([(document(position), None) for position in positions])
@@ -0,0 +1,252 @@
+# services/conversation.py
+from collections import deque
+from datetime import datetime
+from typing import Deque, Dict, List, Tuple
+from sqlalchemy.orm import Session
+from api.models.chat import ConversationSummaryModel, MessageModel
+from api.services.utils.cache import LRUCache
+from api.services.utils.tokens import count_message_tokens
+from api.config import (
+    CONVERSATION_CACHE_SIZE, CONVERSATION_CACHE_TTL_SECONDS, CONVERSATION_HISTORY_TURNS, CONVERSATION_TOKEN_BUDGET,
+    CONVERSATION_SUMMARY_ENABLED, CONVERSATION_SUMMARY_THRESHOLD, CONVERSATION_SUMMARY_KEEP_TURNS,
+)
+
+# A finished turn of a conversation: timestamp, message of the user, response of the chatbot
+Turn = Tuple[datetime, str, str]
+
+class ConversationContext:
+    """
+    Context of a conversation: the running summary of its older turns and its recent turns
+    """
+
+    def __init__(self, summary: str | None = None, summarized_until: datetime | None = None):
+        self.summary = summary
+        self.summarized_until = summarized_until
+        # With summaries, turns are only dropped once folded into the summary, never evicted unsummarized
+        self.turns: Deque[Turn] = deque(maxlen=None if CONVERSATION_SUMMARY_ENABLED else CONVERSATION_HISTORY_TURNS)
+
+    @staticmethod
+    def turn_messages(turns) -> List[Dict[str, str]]:
+        """
+        Get the chat messages of a list of turns
+        """
+        messages = []
+        for _, user_content, chatbot_content in turns:
+            messages.append({"role": "user", "content": user_content})
+            messages.append({"role": "assistant", "content": chatbot_content})
+        return messages
+
+
+class ConversationService:
+    """
+    Service class for the context of each conversation between a user and a chatbot
+
+    The recent turns of a conversation are loaded lazily from the message table
+    and kept in a bounded LRU cache, so the prompt and the memory of the process
+    stay bounded however long the server runs.
+    Older turns can be folded into a running summary stored in the conversation_summary table.
+    """
+
+    SYSTEM_PROMPT = "You are a intelligent assistant."
+
+    # Context of each conversation, keyed by (user_id, chatbot_id)
+    _contexts = LRUCache(max_size=CONVERSATION_CACHE_SIZE, ttl=CONVERSATION_CACHE_TTL_SECONDS)
+
+    @staticmethod
+    def get_context(user_id: int, chatbot_id: int, db: Session) -> ConversationContext:
+        """
+        Get the context of a conversation, loading it from the database the first time
+
+        Parameters
+        ----------
+        user_id : int
+            ID of the User
+        chatbot_id : int
+            ID of the ChatBot
+        db : Session
+            Database Session
+
+        Returns
+        -------
+        ConversationContext
+            Summary and recent turns of the conversation
+        """
+        context = ConversationService._contexts.get((user_id, chatbot_id))
+        if context is not None:
+            return context
+
+        summary = db.query(ConversationSummaryModel).filter(
+            ConversationSummaryModel.user_id == user_id,
+            ConversationSummaryModel.chatbot_id == chatbot_id
+        ).first()
+        context = ConversationContext(summary.summary, summary.summarized_until) if summary else ConversationContext()
+
+        # Only the turns after the summary are loaded, all of them with summaries so the older ones get folded,
+        # otherwise only those that can still make it to a prompt
+        query = db.query(MessageModel).filter(
+            MessageModel.user_id == user_id,
+            MessageModel.chatbot_id == chatbot_id
+        )
+        if context.summarized_until is not None:
+            query = query.filter(MessageModel.timestamp > context.summarized_until)
+        query = query.order_by(MessageModel.timestamp.desc())
+        if not CONVERSATION_SUMMARY_ENABLED:
+            query = query.limit(CONVERSATION_HISTORY_TURNS)
+        rows = query.all()
+
+        for row in reversed(rows):
+            context.turns.append((row.timestamp, row.user_content, row.chatbot_content))
+        ConversationService._contexts.set((user_id, chatbot_id), context)
+        return context
+
+    @staticmethod
+    def add_turn(user_id: int, chatbot_id: int, timestamp: datetime, user_content: str, chatbot_content: str):
+        """
+        Add a finished turn to the conversation context, if it is loaded
+
+        Parameters
+        ----------
+        user_id : int
+            ID of the User
+        chatbot_id : int
+            ID of the ChatBot
+        timestamp : datetime
+            Timestamp of the saved message
+        user_content : str
+            Message of the user
+        chatbot_content : str
+            Response of the chatbot
+        """
+        context = ConversationService._contexts.get((user_id, chatbot_id))
+        if context is not None:
+            context.turns.append((timestamp, user_content, chatbot_content))
+
+    @staticmethod
+    def turns_to_compact(context: ConversationContext) -> List[Turn]:
+        """
+        Get the turns of a conversation that should be folded into its summary
+
+        Compaction is optional, it happens once the recent turns pass CONVERSATION_SUMMARY_THRESHOLD tokens
+        or CONVERSATION_HISTORY_TURNS turns, and the last CONVERSATION_SUMMARY_KEEP_TURNS turns are always kept as they are.
+        At most CONVERSATION_HISTORY_TURNS turns are folded at once, so a long backlog of turns is folded over several calls.
+
+        Parameters
+        ----------
+        context : ConversationContext
+            Context of the conversation
+
+        Returns
+        -------
+        List[Turn]
+            Oldest turns to fold, empty if the conversation doesn't need compaction
+        """
+        if not CONVERSATION_SUMMARY_ENABLED:
+            return []
+        turns = list(context.turns)
+        if len(turns) <= CONVERSATION_HISTORY_TURNS and count_message_tokens(ConversationContext.turn_messages(turns)) <= CONVERSATION_SUMMARY_THRESHOLD:
+            return []
+        return turns[:max(len(turns) - CONVERSATION_SUMMARY_KEEP_TURNS, 0)][:CONVERSATION_HISTORY_TURNS]
+
+    @staticmethod
+    def save_summary(user_id: int, chatbot_id: int, summary: str, compacted: List[Turn], db: Session):
+        """
+        Save the new summary of a conversation and drop the folded turns from its context
+
+        Parameters
+        ----------
+        user_id : int
+            ID of the User
+        chatbot_id : int
+            ID of the ChatBot
+        summary : str
+            Summary of the conversation up to the last compacted turn
+        compacted : List[Turn]
+            Turns folded into the summary
+        db : Session
+            Database Session
+        """
+        summarized_until = compacted[-1][0]
+        row = db.query(ConversationSummaryModel).filter(
+            ConversationSummaryModel.user_id == user_id,
+            ConversationSummaryModel.chatbot_id == chatbot_id
+        ).first()
+        if row is None:
+            db.add(ConversationSummaryModel(user_id=user_id, chatbot_id=chatbot_id, summary=summary, summarized_until=summarized_until))
+        elif row.summarized_until < summarized_until:
+            # Another process may already have saved a more recent summary
+            row.summary = summary
+            row.summarized_until = summarized_until
+        db.commit()
+
+        context = ConversationService._contexts.get((user_id, chatbot_id))
+        if context is not None:
+            context.summary = summary
+            context.summarized_until = summarized_until
+            while context.turns and context.turns[0][0] <= summarized_until:
+                context.turns.popleft()
+
+    @staticmethod
+    def build_summary_prompt(summary: str | None, turns: List[Turn]) -> List[Dict[str, str]]:
+        """
+        Build the messages that ask the chat completion to fold turns into the running summary
+
+        Parameters
+        ----------
+        summary : str, optional
+            Current summary of the conversation
+        turns : List[Turn]
+            Turns to fold into the summary
+
+        Returns
+        -------
+        List[Dict[str, str]]
+            Messages for the chat completion
+        """
+        transcript = "\n".join(
+            f"User: {user_content}\nAssistant: {chatbot_content}" for _, user_content, chatbot_content in turns
+        )
+        return [
+            {"role": "system", "content": "You summarize conversations. Keep every fact, name, preference and open question the assistant needs to continue the conversation, in the language of the conversation."},
+            {"role": "user", "content": f"Current summary:\n{summary or '(empty)'}\n\nNew turns:\n{transcript}\n\nWrite the updated summary."},
+        ]
+
+    @staticmethod
+    def build_prompt(context: ConversationContext | None, userMessage: str, token_budget: int = CONVERSATION_TOKEN_BUDGET) -> List[Dict[str, str]]:
+        """
+        Build the messages sent to the chat completion, trimmed to a token budget
+
+        The summary of the conversation goes right after the system prompt,
+        then the recent turns that fit, the oldest are dropped first.
+
+        Parameters
+        ----------
+        context : ConversationContext, optional
+            Context of the conversation, None for a message without history
+        userMessage : str
+            New message of the user
+        token_budget : int
+            Maximum tokens of the prompt
+
+        Returns
+        -------
+        List[Dict[str, str]]
+            Messages for the chat completion
+        """
+        prompt = [{"role": "system", "content": ConversationService.SYSTEM_PROMPT}]
+        if context is not None and context.summary:
+            prompt.append({"role": "system", "content": f"Summary of the earlier conversation: {context.summary}"})
+        user = {"role": "user", "content": userMessage}
+        remaining = token_budget - count_message_tokens(prompt + [user])
+
+        # Walk the turns from the newest and keep them while they fit
+        kept: List[Dict[str, str]] = []
+        turns = list(context.turns) if context is not None else []
+        for turn in reversed(turns):
+            messages = ConversationContext.turn_messages([turn])
+            tokens = count_message_tokens(messages)
+            if tokens > remaining:
+                break
+            remaining -= tokens
+            kept = messages + kept
+
+        return prompt + kept + [user]
@@ -1,12 +1,17 @@
+import os
+import shutil
+import uuid
+from typing import BinaryIO
 from sqlalchemy.orm import Session
 from sqlalchemy.exc import SQLAlchemyError
 from fastapi import HTTPException
 from api.models.datasource import DataSourceModel
 from api.schemas.datasource import DataSourceCreate, DataSourceGet
+from api.services.answer_cache import SemanticCacheService
+from api.services.ingestion import IngestionService
+from api.services.vectorstore import VectorStoreService
+from api.config import INGEST_UPLOAD_DIR
 from typing import List
-from PyPDF2 import PdfWriter
-from fpdf import FPDF
-from os import path
 
 class DataSourceService:
     """
@@ -14,14 +19,68 @@ class DataSourceService:
     """
 
     @staticmethod
-    def create_datasource(dataContent: str, db: Session):
+    def create_datasource(dataContent: str, chatbot_id: int, db: Session) -> DataSourceGet:
         """
-        Create a new datasource in the PostgreSQL database
+        Create a new datasource in the PostgreSQL database and queue the ingestion of its content
+
+        The content is chunked, embedded and indexed in the background,
+        the status and progress of the datasource track the ingestion.
+
+        Parameters
+        ----------
+        dataContent : str
+            Content of the datasource
+        chatbot_id : int
+            ID of the chatbot trained with the datasource
+        db : Session
+            Database Session
+
+        Returns
+        -------
+        DataSourceGet
+            Pydantic model for retrieving a datasource
+        """
+
+        try:
+            # Store the content with the queued status, any worker can then ingest it
+            datasource = DataSourceModel(
+                data_type="text",
+                chatbot_id=chatbot_id,
+                content=dataContent,
+                status=DataSourceModel.STATUS_QUEUED,
+                progress=0
+            )
+            db.add(datasource)
+            db.commit()
+            db.refresh(datasource)
+
+            # The request returns right away, the ingestion runs on the ingestion workers
+            IngestionService.enqueue(datasource.id)
+
+            return datasource
+
+        except SQLAlchemyError as e:
+            # Rollback the changes if there is an error
+            db.rollback()
+            # Format the error message
+            error_message = f"Database error: {e.orig}"
+            # Raise an HTTPException with the error message
+            raise HTTPException(status_code=500, detail=error_message)
+
+    @staticmethod
+    def create_pdf_datasource(file: BinaryIO, chatbot_id: int, db: Session) -> DataSourceGet:
+        """
+        Create a new datasource from an uploaded PDF and queue its ingestion
+
+        The file is copied to INGEST_UPLOAD_DIR in blocks and read page by page by the ingestion,
+        it is removed once its content is indexed.
 
         Parameters
         ----------
-        datasource : DataSourceCreate
-            Pydantic model for creating a datasource
+        file : BinaryIO
+            Uploaded PDF
+        chatbot_id : int
+            ID of the chatbot trained with the datasource
         db : Session
             Database Session
 
@@ -31,28 +90,81 @@ class DataSourceService:
             Pydantic model for retrieving a datasource
         """
 
+        # Check the signature of the file before storing it
+        if file.read(5) != b"%PDF-":
+            raise HTTPException(status_code=400, detail="File is not a PDF")
+        file.seek(0)
+
+        # Copy the upload in blocks, the whole file is never in memory
+        os.makedirs(INGEST_UPLOAD_DIR, exist_ok=True)
+        path = os.path.join(INGEST_UPLOAD_DIR, f"{uuid.uuid4().hex}.pdf")
+        with open(path, "wb") as f:
+            shutil.copyfileobj(file, f)
+
         try:
-            pdf = FPDF()
-            pdf.add_page()
-            pdf.set_font('helvetica', '', 12)
-            #pdf.cell(text=dataContent)
-            pdf.multi_cell(0, 10, dataContent)
-            pdf.output('ParcialData.pdf')
-
-            pdf_merger = PdfWriter()
-            pdf_merger.append("TrainingData.pdf")
-            pdf_merger.append("ParcialData.pdf")
-            pdf_merger.write("TrainingData.pdf")
-            pdf_merger.close()
+            # Store the path of the file with the queued status, any worker of the node can then ingest it
+            datasource = DataSourceModel(
+                data_type="pdf",
+                chatbot_id=chatbot_id,
+                content=path,
+                status=DataSourceModel.STATUS_QUEUED,
+                progress=0
+            )
+            db.add(datasource)
+            db.commit()
+            db.refresh(datasource)
+
+            # The request returns right away, the ingestion runs on the ingestion workers
+            IngestionService.enqueue(datasource.id)
+
+            return datasource
 
         except SQLAlchemyError as e:
             # Rollback the changes if there is an error
             db.rollback()
+            os.remove(path)
+            # Format the error message
+            error_message = f"Database error: {e.orig}"
+            # Raise an HTTPException with the error message
+            raise HTTPException(status_code=500, detail=error_message)
+
+    @staticmethod
+    def get_datasource(id: int, db: Session) -> DataSourceGet:
+        """
+        Get a datasource with the status and progress of its ingestion
+
+        Parameters
+        ----------
+        id : int
+            ID of the datasource
+        db : Session
+            Database Session
+
+        Returns
+        -------
+        DataSourceGet
+            Pydantic model for retrieving a datasource
+        """
+
+        try:
+            # Get datasource with id, deleted datasources are not found
+            datasource = db.query(DataSourceModel).filter(
+                DataSourceModel.id == id,
+                DataSourceModel.status != DataSourceModel.STATUS_DELETED
+            ).first()
+            # Check if datasource exists
+            if datasource is None:
+                # Raise an HTTPException with the not found error message
+                raise HTTPException(status_code=404, detail="datasource not found")
+            # Return the datasource
+            return datasource
+
+        except SQLAlchemyError as e:
             # Format the error message
             error_message = f"Database error: {e.orig}"
             # Raise an HTTPException with the error message
             raise HTTPException(status_code=500, detail=error_message)
-        
+
     @staticmethod
     def delete_datasource(id: int, db: Session):
         """
@@ -79,11 +191,23 @@ class DataSourceService:
                 # Raise an HTTPException with the not found error message
                 raise HTTPException(status_code=404, detail="datasource not found")
             
-            # Change the status of the datasource to 0
-            datasource.status = 0
+            # Change the status of the datasource to 0, a queued ingestion won't run and a running one stops
+            datasource.status = DataSourceModel.STATUS_DELETED
             # Commit the changes to the database
             db.commit()
 
+            # Remove the uploaded file if it was not ingested yet
+            if datasource.data_type == "pdf" and datasource.content and os.path.exists(datasource.content):
+                os.remove(datasource.content)
+
+            # Answers cached for the previous data of the chatbot must not be served anymore, the version is bumped
+            # right away without waiting for the write lock of the index
+            VectorStoreService.bump_version(datasource.chatbot_id)
+            SemanticCacheService.invalidate(datasource.chatbot_id)
+            # Its chunks are dropped from the index in the background, the index is rebuilt from the remaining chunk rows,
+            # which bumps the version again once it is done, dropping the answers generated from the index in the meantime
+            IngestionService.enqueue_reindex(datasource.chatbot_id)
+
             # Refresh the datasource
             db.refresh(datasource)
 
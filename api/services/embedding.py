@@ -0,0 +1,377 @@
+# services/embedding.py
+import hashlib
+import os
+import tempfile
+import threading
+import time
+import unicodedata
+from collections import deque
+from concurrent.futures import Future
+from typing import Deque, Dict, List, Tuple
+import numpy as np
+from langchain.embeddings import OpenAIEmbeddings
+from langchain.embeddings.base import Embeddings
+from api.config import EMBEDDING_BATCH_SIZE, EMBEDDING_BATCH_WAIT_MS, EMBEDDING_CACHE_DIR, EMBEDDING_REQUEST_MAX_TOKENS, EMBEDDING_TOKENS_PER_MINUTE
+
+class CachedEmbeddings(Embeddings):
+    """
+    Embeddings backed by a content-addressed cache on local disk
+
+    Each vector is stored under the hash of the embedding model and the normalized chunk text,
+    so a chunk is only sent to the provider the first time it is seen,
+    whatever chatbot or ingest it comes from.
+    """
+
+    # Hit and miss counters shared by every instance of this process
+    hits = 0
+    misses = 0
+    _counters_lock = threading.Lock()
+
+    def __init__(self, underlying: Embeddings, model: str, cache_dir: str = EMBEDDING_CACHE_DIR):
+        """
+        Parameters
+        ----------
+        underlying : Embeddings
+            Embeddings provider used for the chunks that are not cached
+        model : str
+            Name of the embedding model, part of the cache key
+        cache_dir : str
+            Folder where the vectors are stored
+        """
+        self.underlying = underlying
+        self.model = model
+        self.cache_dir = cache_dir
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        """
+        Normalize a chunk so that chunks differing only by unicode form or whitespace share a cache entry
+        """
+        return " ".join(unicodedata.normalize("NFC", text).split())
+
+    def _key(self, text: str) -> str:
+        """
+        Get the cache key of a chunk
+        """
+        return hashlib.sha256(f"{self.model}\n{CachedEmbeddings.normalize(text)}".encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> str:
+        """
+        Get the file of a cache entry, entries are spread in subfolders by the first characters of the key
+        """
+        return os.path.join(self.cache_dir, self.model, key[:2], f"{key}.npy")
+
+    def _get(self, key: str) -> List[float] | None:
+        """
+        Read a vector from the cache, or None if it is not cached
+        """
+        try:
+            with open(self._path(key), "rb") as f:
+                return np.frombuffer(f.read(), dtype=np.float32).tolist()
+        except FileNotFoundError:
+            return None
+
+    def _set(self, key: str, vector: List[float]):
+        """
+        Write a vector to the cache
+        """
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a temporary file first so concurrent readers never see a partial vector
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, "wb") as f:
+            f.write(np.asarray(vector, dtype=np.float32).tobytes())
+        os.replace(tmp_path, path)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """
+        Embed chunks, only sending to the provider the chunks that are not cached
+
+        Parameters
+        ----------
+        texts : List[str]
+            Chunks to embed
+
+        Returns
+        -------
+        List[List[float]]
+            Vector of each chunk
+        """
+        keys = [self._key(text) for text in texts]
+        vectors: Dict[str, List[float]] = {}
+        missing: Dict[str, str] = {}
+        for key, text in zip(keys, texts):
+            if key in vectors or key in missing:
+                continue
+            vector = self._get(key)
+            if vector is None:
+                missing[key] = text
+            else:
+                vectors[key] = vector
+
+        if missing:
+            # Identical chunks are only embedded once
+            for key, vector in zip(missing, self.underlying.embed_documents(list(missing.values()))):
+                self._set(key, vector)
+                vectors[key] = vector
+
+        with CachedEmbeddings._counters_lock:
+            CachedEmbeddings.hits += len(texts) - len(missing)
+            CachedEmbeddings.misses += len(missing)
+
+        return [vectors[key] for key in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        """
+        Embed a query, queries are not cached
+        """
+        return self.underlying.embed_query(text)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        """
+        Embed a query without blocking the event loop, queries are not cached
+        """
+        return await self.underlying.aembed_query(text)
+
+    @staticmethod
+    def stats() -> dict:
+        """
+        Get the hit and miss counters of the cache
+
+        Returns
+        -------
+        dict
+            Hits, misses and hit rate since the process started
+        """
+        total = CachedEmbeddings.hits + CachedEmbeddings.misses
+        return {
+            "hits": CachedEmbeddings.hits,
+            "misses": CachedEmbeddings.misses,
+            "hit_rate": CachedEmbeddings.hits / total if total else 0.0,
+        }
+
+
+class _EmbeddingJob:
+    """
+    Chunks submitted by one caller of the scheduler, and the future that receives their vectors
+    """
+
+    def __init__(self, texts: List[str]):
+        self.vectors: List[List[float] | None] = [None] * len(texts)
+        self.remaining = len(texts)
+        self.future: Future = Future()
+
+
+class EmbeddingScheduler(Embeddings):
+    """
+    Embeddings that coalesce the chunks of concurrent callers into batched provider requests
+
+    Callers block until their own vectors are ready, while a single worker thread packs the pending
+    chunks of every job into batches of at most batch_size chunks and max_tokens tokens, and keeps under the token per minute limit.
+    """
+
+    def __init__(self, provider: Embeddings, batch_size: int = EMBEDDING_BATCH_SIZE, batch_wait_ms: int = EMBEDDING_BATCH_WAIT_MS, tokens_per_minute: int = EMBEDDING_TOKENS_PER_MINUTE, max_tokens: int = EMBEDDING_REQUEST_MAX_TOKENS):
+        """
+        Parameters
+        ----------
+        provider : Embeddings
+            Embeddings provider that receives the batches
+        batch_size : int
+            Maximum number of chunks sent in one provider request
+        batch_wait_ms : int
+            Time a partial batch waits for chunks of other callers before it is sent
+        tokens_per_minute : int
+            Token per minute limit of the provider, 0 disables the limit
+        max_tokens : int
+            Maximum estimated tokens sent in one provider request, a single chunk over it is sent alone
+        """
+        self.provider = provider
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait_ms / 1000
+        self.tokens_per_minute = tokens_per_minute
+        self.max_tokens = max_tokens
+        # Available tokens of the rate limit bucket, refilled continuously up to tokens_per_minute
+        self._tokens = float(tokens_per_minute)
+        self._refilled_at = time.monotonic()
+        # Chunks waiting to be embedded: job, position of the chunk in the job, text
+        self._pending: Deque[Tuple[_EmbeddingJob, int, str]] = deque()
+        self._condition = threading.Condition()
+        self._worker: threading.Thread | None = None
+        self.batches = 0
+        self.embedded = 0
+
+    @staticmethod
+    def estimate_tokens(text: str) -> int:
+        """
+        Estimate the tokens of a chunk for the rate limit, about four characters per token
+        """
+        return len(text) // 4 + 1
+
+    def _start(self):
+        """
+        Start the worker thread the first time chunks are submitted
+        """
+        if self._worker is None:
+            self._worker = threading.Thread(target=self._run, name="embedding-scheduler", daemon=True)
+            self._worker.start()
+
+    def _next_batch(self) -> List[Tuple[_EmbeddingJob, int, str]]:
+        """
+        Wait for pending chunks and take the next batch, letting a partial batch fill for batch_wait
+
+        The batch stops before the chunk that would take it over max_tokens, that chunk starts the next batch.
+        """
+        with self._condition:
+            while not self._pending:
+                self._condition.wait()
+            deadline = time.monotonic() + self.batch_wait
+            while len(self._pending) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+            batch = []
+            tokens = 0
+            while self._pending and len(batch) < self.batch_size:
+                item = self._pending[0]
+                # Chunks of a job that already failed are not sent
+                if item[0].future.done():
+                    self._pending.popleft()
+                    continue
+                item_tokens = EmbeddingScheduler.estimate_tokens(item[2])
+                if batch and tokens + item_tokens > self.max_tokens:
+                    break
+                self._pending.popleft()
+                batch.append(item)
+                tokens += item_tokens
+            return batch
+
+    def _acquire_tokens(self, tokens: int):
+        """
+        Block until the rate limit bucket holds the tokens of a batch
+        """
+        if not self.tokens_per_minute:
+            return
+        # A batch bigger than the whole bucket is sent as soon as the bucket is full
+        tokens = min(tokens, self.tokens_per_minute)
+        while True:
+            now = time.monotonic()
+            self._tokens = min(self.tokens_per_minute, self._tokens + (now - self._refilled_at) * self.tokens_per_minute / 60)
+            self._refilled_at = now
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return
+            time.sleep((tokens - self._tokens) * 60 / self.tokens_per_minute)
+
+    def _run(self):
+        """
+        Worker loop sending the batches and handing each vector back to its job
+        """
+        while True:
+            batch = []
+            # Any error fails the jobs of the batch instead of the worker, so callers never wait on a dead thread
+            try:
+                batch = self._next_batch()
+                if not batch:
+                    continue
+                texts = [text for _, _, text in batch]
+                self._acquire_tokens(sum(EmbeddingScheduler.estimate_tokens(text) for text in texts))
+                vectors = self.provider.embed_documents(texts)
+                # A short response would leave the jobs of the missing vectors waiting forever, the batch fails instead
+                if len(vectors) != len(texts):
+                    raise ValueError(f"Embedding provider returned {len(vectors)} vectors for {len(texts)} chunks")
+                self.batches += 1
+                self.embedded += len(texts)
+                for (job, position, _), vector in zip(batch, vectors):
+                    if job.future.done():
+                        continue
+                    job.vectors[position] = vector
+                    job.remaining -= 1
+                    if job.remaining == 0:
+                        job.future.set_result(job.vectors)
+            except Exception as e:
+                # Fail every job with chunks in the batch, their other chunks are skipped
+                for job, _, _ in batch:
+                    if not job.future.done():
+                        job.future.set_exception(e)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """
+        Embed chunks through the shared batches, blocking until all of them are embedded
+
+        Parameters
+        ----------
+        texts : List[str]
+            Chunks to embed
+
+        Returns
+        -------
+        List[List[float]]
+            Vector of each chunk
+        """
+        if not texts:
+            return []
+        job = _EmbeddingJob(texts)
+        with self._condition:
+            self._start()
+            self._pending.extend((job, position, text) for position, text in enumerate(texts))
+            self._condition.notify()
+        return job.future.result()
+
+    def embed_query(self, text: str) -> List[float]:
+        """
+        Embed a query directly, queries are on the request path and never wait for a batch
+        """
+        return self.provider.embed_query(text)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        """
+        Embed a query directly without blocking the event loop
+        """
+        return await self.provider.aembed_query(text)
+
+    def stats(self) -> dict:
+        """
+        Get the counters of the scheduler
+
+        Returns
+        -------
+        dict
+            Chunks waiting, batches sent and chunks embedded since the process started
+        """
+        return {
+            "pending": len(self._pending),
+            "batches": self.batches,
+            "embedded": self.embedded,
+            "mean_batch_size": self.embedded / self.batches if self.batches else 0.0,
+        }
+
+
+_scheduler: EmbeddingScheduler | None = None
+_embeddings: Embeddings | None = None
+# Ingestion workers and request threads get the embeddings at the same time, only one scheduler must be created
+_singletons_lock = threading.Lock()
+
+def get_scheduler() -> EmbeddingScheduler:
+    """
+    Get the scheduler that batches the chunks sent to the OpenAI embeddings
+    """
+    global _scheduler
+    if _scheduler is None:
+        with _singletons_lock:
+            if _scheduler is None:
+                provider = OpenAIEmbeddings(chunk_size=EMBEDDING_BATCH_SIZE)
+                _scheduler = EmbeddingScheduler(provider)
+    return _scheduler
+
+def get_embeddings() -> Embeddings:
+    """
+    Get the embeddings shared by the vector indexes, the chunk cache in front of the batching scheduler
+    """
+    global _embeddings
+    if _embeddings is None:
+        scheduler = get_scheduler()
+        with _singletons_lock:
+            if _embeddings is None:
+                _embeddings = CachedEmbeddings(scheduler, scheduler.provider.model)
+    return _embeddings
@@ -0,0 +1,314 @@
+# services/ingestion.py
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import List, Tuple
+from sqlalchemy import and_, func, insert, or_
+from sqlalchemy.exc import SQLAlchemyError
+from api.models.datasource import DataSourceChunkModel, DataSourceModel
+from api.services.utils import pdf
+from api.services.utils.db import SessionLocal
+from api.services.utils.stream import prefetch
+from api.services.utils.tokens import count_tokens
+from api.services.vectorstore import VectorStoreService
+from api.services.answer_cache import SemanticCacheService
+from api.config import INGEST_PREFETCH_PAGES, INGEST_STALE_SECONDS, INGEST_WORKERS
+
+logger = logging.getLogger(__name__)
+
+class IngestionCancelled(Exception):
+    """
+    Raised when the data source being ingested was deleted
+    """
+
+class IngestionService:
+    """
+    Service class for the background ingestion of data sources
+
+    Creating a data source only stores its content with the queued status and submits a job,
+    INGEST_WORKERS threads of each process chunk, embed and index the content.
+    A job is claimed in the database before it runs, so a data source is only ingested once,
+    whatever process picks it up.
+    Content is stored as chunk rows and indexed one window of pages at a time, a job abandoned by a process
+    that stopped is resumed after INGEST_STALE_SECONDS from the first page not stored yet.
+    """
+
+    _executor = ThreadPoolExecutor(max_workers=INGEST_WORKERS, thread_name_prefix="ingestion")
+    _counters_lock = threading.Lock()
+    submitted = 0
+    completed = 0
+    failed = 0
+    # Jobs submitted by this process that did not finish yet
+    pending = 0
+
+    @staticmethod
+    def enqueue(datasource_id: int):
+        """
+        Submit the ingestion of a queued data source to the workers
+
+        Parameters
+        ----------
+        datasource_id : int
+            ID of the data source
+        """
+        with IngestionService._counters_lock:
+            IngestionService.submitted += 1
+            IngestionService.pending += 1
+        IngestionService._executor.submit(IngestionService.run, datasource_id)
+
+    @staticmethod
+    def _claimable():
+        """
+        Filter of the data sources a worker can claim: queued, or processing without progress for INGEST_STALE_SECONDS
+        """
+        stale = datetime.utcnow() - timedelta(seconds=INGEST_STALE_SECONDS)
+        return or_(
+            DataSourceModel.status == DataSourceModel.STATUS_QUEUED,
+            and_(
+                DataSourceModel.status == DataSourceModel.STATUS_PROCESSING,
+                or_(DataSourceModel.updated_at < stale, DataSourceModel.updated_at.is_(None))
+            )
+        )
+
+    @staticmethod
+    def resume():
+        """
+        Submit the data sources still queued or abandoned, called on startup for the jobs left by a previous process
+        """
+        db = SessionLocal()
+        try:
+            claimable = db.query(DataSourceModel.id).filter(IngestionService._claimable()).order_by(DataSourceModel.id).all()
+        finally:
+            db.close()
+        for (datasource_id,) in claimable:
+            IngestionService.enqueue(datasource_id)
+
+    @staticmethod
+    def _claim(datasource_id: int, db) -> DataSourceModel | None:
+        """
+        Move a data source to processing, or None if it is not claimable anymore
+        """
+        claimed = db.query(DataSourceModel).filter(
+            DataSourceModel.id == datasource_id,
+            IngestionService._claimable()
+        ).update({DataSourceModel.status: DataSourceModel.STATUS_PROCESSING, DataSourceModel.error: None}, synchronize_session=False)
+        db.commit()
+        if not claimed:
+            return None
+        return db.query(DataSourceModel).filter(DataSourceModel.id == datasource_id).first()
+
+    @staticmethod
+    def _update(datasource_id: int, db, values: dict) -> bool:
+        """
+        Update a data source being ingested, unless it was deleted in the meantime
+
+        Returns
+        -------
+        bool
+            True if the data source is still processing
+        """
+        updated = db.query(DataSourceModel).filter(
+            DataSourceModel.id == datasource_id,
+            DataSourceModel.status == DataSourceModel.STATUS_PROCESSING
+        ).update(values, synchronize_session=False)
+        db.commit()
+        return bool(updated)
+
+    @staticmethod
+    def _resume_point(datasource_id: int, db) -> Tuple[int, int]:
+        """
+        Get the first page and chunk ordinal of a data source not stored yet
+
+        Chunks are stored one window of whole pages at a time, so an interrupted ingestion resumes from the next page.
+        """
+        last_page, last_ordinal = db.query(
+            func.max(DataSourceChunkModel.page), func.max(DataSourceChunkModel.ordinal)
+        ).filter(DataSourceChunkModel.datasource_id == datasource_id).one()
+        if last_ordinal is None:
+            return 0, 0
+        return last_page + 1, last_ordinal + 1
+
+    @staticmethod
+    def _pages(datasource: DataSourceModel, start_page: int):
+        """
+        Get the pages of a data source from start_page, and its total pages
+
+        A text data source is a single page, a PDF is read page by page.
+        """
+        from langchain.schema import Document
+
+        if datasource.data_type == "pdf":
+            return pdf.iter_pages(datasource.content, start_page), pdf.page_count(datasource.content)
+        pages = [Document(page_content=datasource.content or "", metadata={"page": 0})]
+        return pages[start_page:], 1
+
+    @staticmethod
+    def _store_chunks(datasource: DataSourceModel, texts: List[str], page_numbers: List[int], first_ordinal: int, progress: int, db):
+        """
+        Insert the chunk rows of a window with its progress in one transaction, the job stops if the data source was deleted
+        """
+        db.execute(insert(DataSourceChunkModel), [
+            {
+                "datasource_id": datasource.id,
+                "chatbot_id": datasource.chatbot_id,
+                "ordinal": first_ordinal + i,
+                "page": page_number,
+                "text": text,
+                "token_count": count_tokens(text),
+            }
+            for i, (text, page_number) in enumerate(zip(texts, page_numbers))
+        ])
+        # Saving the progress also marks the job as alive
+        updated = db.query(DataSourceModel).filter(
+            DataSourceModel.id == datasource.id,
+            DataSourceModel.status == DataSourceModel.STATUS_PROCESSING
+        ).update({DataSourceModel.progress: progress}, synchronize_session=False)
+        if not updated:
+            db.rollback()
+            raise IngestionCancelled()
+        db.commit()
+
+    @staticmethod
+    def _ingest(datasource: DataSourceModel, db):
+        """
+        Store the content of a data source as chunk rows and append them to the index of its chatbot, one window at a time
+
+        The rows of a window are committed before the window is appended to the index,
+        chunks are appended with their ID so appending them again after an interruption never duplicates them.
+        """
+        chatbot_id = datasource.chatbot_id
+        start_page, ordinal = IngestionService._resume_point(datasource.id, db)
+
+        # Chunks stored by an interrupted job that did not make it to the index
+        for texts, metadatas, ids in VectorStoreService.stored_chunks(chatbot_id, datasource.id):
+            VectorStoreService.append(chatbot_id, texts, metadatas, ids)
+
+        pages, total_pages = IngestionService._pages(datasource, start_page)
+        # Pages are read ahead of the embedding by a background thread, at most INGEST_PREFETCH_PAGES of them
+        windows = VectorStoreService.chunk_windows(prefetch(pages, INGEST_PREFETCH_PAGES), VectorStoreService.text_splitter())
+        for texts, page_numbers, pages_read in windows:
+            # The last percent is left for the end of the job
+            IngestionService._store_chunks(datasource, texts, page_numbers, ordinal, min(99, pages_read * 100 // max(total_pages, 1)), db)
+            VectorStoreService.append(
+                chatbot_id, texts,
+                [VectorStoreService.chunk_metadata(chatbot_id, datasource.id, page_number) for page_number in page_numbers],
+                [VectorStoreService.chunk_id(datasource.id, ordinal + i) for i in range(len(texts))]
+            )
+            ordinal += len(texts)
+
+    @staticmethod
+    def run(datasource_id: int):
+        """
+        Ingest a data source into the index of its chatbot, tracking its progress and status
+
+        Parameters
+        ----------
+        datasource_id : int
+            ID of the data source
+        """
+        db = SessionLocal()
+        try:
+            datasource = IngestionService._claim(datasource_id, db)
+            if datasource is None:
+                # Deleted, or already claimed by another worker
+                return
+            chatbot_id, data_type, content = datasource.chatbot_id, datasource.data_type, datasource.content
+
+            try:
+                IngestionService._ingest(datasource, db)
+            except IngestionCancelled:
+                logger.info("Ingestion of data source %d stopped, it was deleted", datasource_id)
+                # A window appended while the data source was deleted is dropped from the index
+                IngestionService.enqueue_reindex(chatbot_id)
+                return
+            except Exception as e:
+                db.rollback()
+                logger.exception("Ingestion of data source %d failed", datasource_id)
+                IngestionService._update(datasource_id, db, {DataSourceModel.status: DataSourceModel.STATUS_FAILED, DataSourceModel.error: str(e) or type(e).__name__})
+                # The windows already appended are dropped from the index, the chatbot never answers from part of a failed source
+                IngestionService.enqueue_reindex(chatbot_id)
+                with IngestionService._counters_lock:
+                    IngestionService.failed += 1
+                return
+
+            # The content now lives in the chunk rows
+            ready = IngestionService._update(datasource_id, db, {
+                DataSourceModel.status: DataSourceModel.STATUS_READY,
+                DataSourceModel.progress: 100,
+                DataSourceModel.error: None,
+                DataSourceModel.content: None
+            })
+            # The uploaded file is not needed once its content is stored
+            if data_type == "pdf" and content and os.path.exists(content):
+                os.remove(content)
+            if not ready:
+                # Deleted after its last window was appended
+                IngestionService.enqueue_reindex(chatbot_id)
+            # Answers cached for the previous data must not be served anymore
+            SemanticCacheService.invalidate(chatbot_id)
+            with IngestionService._counters_lock:
+                IngestionService.completed += 1
+
+        except SQLAlchemyError:
+            db.rollback()
+            logger.exception("Database error while ingesting data source %d", datasource_id)
+        finally:
+            db.close()
+            with IngestionService._counters_lock:
+                IngestionService.pending -= 1
+
+    @staticmethod
+    def enqueue_reindex(chatbot_id: int):
+        """
+        Submit the rebuild of the index of a chatbot from its stored chunks to the workers, dropping the chunks of deleted and failed data sources
+
+        Parameters
+        ----------
+        chatbot_id : int
+            ID of the chatbot
+        """
+        IngestionService._executor.submit(IngestionService.reindex, chatbot_id)
+
+    @staticmethod
+    def reindex(chatbot_id: int):
+        """
+        Rebuild the index of a chatbot from its stored chunks
+
+        Parameters
+        ----------
+        chatbot_id : int
+            ID of the chatbot
+        """
+        try:
+            VectorStoreService.reindex(chatbot_id)
+        except Exception:
+            logger.exception("Reindex of chatbot %d failed", chatbot_id)
+            return
+        SemanticCacheService.invalidate(chatbot_id)
+
+    @staticmethod
+    def shutdown():
+        """
+        Stop the workers on shutdown, jobs that did not start stay queued for the next process
+        """
+        IngestionService._executor.shutdown(wait=False, cancel_futures=True)
+
+    @staticmethod
+    def stats() -> dict:
+        """
+        Get the counters of the ingestion workers
+
+        Returns
+        -------
+        dict
+            Jobs submitted, completed and failed since the process started, and jobs not finished yet
+        """
+        return {
+            "workers": INGEST_WORKERS,
+            "submitted": IngestionService.submitted,
+            "completed": IngestionService.completed,
+            "failed": IngestionService.failed,
+            "pending": IngestionService.pending,
+        }
@@ -5,6 +5,8 @@ from fastapi import HTTPException, Depends, status
 from fastapi.security import OAuth2PasswordBearer
 from api.models.user import UserModel
 from api.services.utils.db import get_db
+from api.services.utils.cache import LRUCache
+from api.config import AUTH_USER_CACHE_SIZE, AUTH_USER_CACHE_TTL_SECONDS
 from sqlalchemy.orm import Session
 import os
 from dotenv import load_dotenv
@@ -25,6 +27,10 @@ class JwtService:
     # access token expire minutes is the number of minutes the access token is valid for
     ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES"))
 
+    # Active users authenticated by this process, keyed by user id
+    # Other processes only see a deleted user or a new password once the entry expires
+    _users = LRUCache(max_size=AUTH_USER_CACHE_SIZE, ttl=AUTH_USER_CACHE_TTL_SECONDS)
+
     @staticmethod
     def create_access_token(*, user_id: int) -> str:
         """
@@ -83,11 +89,31 @@ class JwtService:
         except jwt.PyJWTError:
             raise HTTPException(status_code=401, detail="Invalid credentials")
 
-        # Query the database for the user with the provided user id
-        user = db.query(UserModel).filter(UserModel.id == user_id).first()
+        # Recently authenticated users are served from the cache without a query
+        user = JwtService._users.get(user_id)
+        if user is not None:
+            return user
+
+        # Query the database for the active user with the provided user id
+        user = db.query(UserModel).filter(UserModel.id == user_id, UserModel.status == 1).first()
 
         # If the user is not found, raise an HTTPException
         if user is None:
             raise HTTPException(status_code=401, detail="Invalid credentials")
-            
+
+        # Detach the user from the session so it can be shared by the next requests
+        db.expunge(user)
+        JwtService._users.set(user_id, user)
         return user
+
+    @staticmethod
+    def invalidate_user(user_id: int):
+        """
+        Drop a user from the authentication cache, called when the user is deleted or changes its password
+
+        Parameters
+        ----------
+        user_id : int
+            Id of the user
+        """
+        JwtService._users.pop(user_id)
@@ -0,0 +1,221 @@
+# services/message_buffer.py
+import logging
+import threading
+import time
+from collections import deque
+from typing import Deque, List
+from sqlalchemy import insert
+from api.models.chat import MessageModel
+from api.services.utils.db import SessionLocal
+from api.config import MESSAGE_BUFFER_MAX_ROWS, MESSAGE_FLUSH_INTERVAL_MS, MESSAGE_FLUSH_RETRIES, MESSAGE_FLUSH_ROWS
+
+logger = logging.getLogger(__name__)
+
+class MessageBuffer:
+    """
+    Write-behind buffer of the chat messages
+
+    Messages are queued in memory and a single worker thread saves them with one bulk insert
+    every flush_interval_ms, or as soon as flush_rows messages are waiting,
+    so answering a message never waits for the database.
+    Messages of a failed flush are put back at the front of the queue and retried on the next one,
+    a batch that fails flush_retries times in a row is dropped and counted.
+    The buffer holds at most max_rows messages, past that add refuses new ones so the caller saves them itself,
+    and a database outage slows the requests down instead of filling the memory of the process.
+    An unexpected error never stops the worker, and a worker that died anyway is restarted by the next add
+    and reported by stats.
+    """
+
+    def __init__(self, flush_interval_ms: int = MESSAGE_FLUSH_INTERVAL_MS, flush_rows: int = MESSAGE_FLUSH_ROWS, max_rows: int = MESSAGE_BUFFER_MAX_ROWS, flush_retries: int = MESSAGE_FLUSH_RETRIES):
+        """
+        Parameters
+        ----------
+        flush_interval_ms : int
+            Maximum time a message waits in the buffer before it is flushed
+        flush_rows : int
+            Maximum messages saved by one bulk insert, a full batch is flushed right away
+        max_rows : int
+            Maximum messages waiting in the buffer
+        flush_retries : int
+            Failed flushes in a row after which the batch is dropped
+        """
+        self.flush_interval = flush_interval_ms / 1000
+        self.flush_rows = flush_rows
+        self.max_rows = max_rows
+        self.flush_retries = flush_retries
+        # Rows of the message table waiting to be inserted
+        self._pending: Deque[dict] = deque()
+        self._condition = threading.Condition()
+        self._worker: threading.Thread | None = None
+        self._closed = False
+        self.flushes = 0
+        self.flushed = 0
+        self.failed = 0
+        self.dropped = 0
+        self.rejected = 0
+        self.restarts = 0
+        # Failed flushes in a row, of the batch at the front of the queue
+        self._failures = 0
+
+    def _start(self):
+        """
+        Start the worker thread the first time a message is buffered, or again if it died
+        """
+        if self._worker is None or not self._worker.is_alive():
+            if self._worker is not None:
+                logger.error("Message buffer worker died, restarting it with %d messages waiting", len(self._pending))
+                self.restarts += 1
+            self._worker = threading.Thread(target=self._run, name="message-buffer", daemon=True)
+            self._worker.start()
+
+    def add(self, row: dict) -> bool:
+        """
+        Queue a row of the message table
+
+        Parameters
+        ----------
+        row : dict
+            Columns of the message to insert
+
+        Returns
+        -------
+        bool
+            False if the buffer is full, the caller saves the message itself
+        """
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("Message buffer is closed")
+            if len(self._pending) >= self.max_rows:
+                self.rejected += 1
+                return False
+            self._start()
+            self._pending.append(row)
+            # Wake the worker on the first message of a batch and when the batch is full
+            if len(self._pending) == 1 or len(self._pending) >= self.flush_rows:
+                self._condition.notify()
+            return True
+
+    def _next_batch(self) -> List[dict]:
+        """
+        Wait for a message, then until the batch is full, the flush interval passed or the buffer is closed, and take the batch
+        """
+        with self._condition:
+            while not self._pending and not self._closed:
+                self._condition.wait()
+            deadline = time.monotonic() + self.flush_interval
+            while len(self._pending) < self.flush_rows and not self._closed:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+            batch = []
+            while self._pending and len(batch) < self.flush_rows:
+                batch.append(self._pending.popleft())
+            return batch
+
+    def _flush(self, batch: List[dict]) -> bool:
+        """
+        Save a batch of messages with one bulk insert, putting them back in the queue if it fails,
+        unless the batch failed flush_retries times in a row
+        """
+        db = SessionLocal()
+        try:
+            db.execute(insert(MessageModel), batch)
+            db.commit()
+        except Exception as e:
+            # Any error counts as a failed flush, not only the database ones, the batch is never lost silently
+            try:
+                db.rollback()
+            except Exception:
+                logger.exception("Failed to roll back a failed flush of buffered messages")
+            self.failed += 1
+            self._failures += 1
+            if self._failures >= self.flush_retries:
+                logger.error("Dropped %d buffered messages after %d failed flushes: %s", len(batch), self._failures, e)
+                self.dropped += len(batch)
+                self._failures = 0
+            else:
+                logger.error("Failed to save %d buffered messages: %s", len(batch), e)
+                with self._condition:
+                    self._pending.extendleft(reversed(batch))
+            return False
+        finally:
+            db.close()
+        self._failures = 0
+        self.flushes += 1
+        self.flushed += len(batch)
+        return True
+
+    def _run(self):
+        """
+        Worker loop flushing the buffer until it is closed and empty
+        """
+        while True:
+            try:
+                batch = self._next_batch()
+                if batch:
+                    if not self._flush(batch):
+                        # Give the database some time before the retry, a closed buffer retries until close times out
+                        time.sleep(self.flush_interval)
+                elif self._closed:
+                    return
+            except Exception:
+                # The worker must outlive any error, or the buffer would fill up without anything saving it
+                logger.exception("Unexpected error in the message buffer worker")
+                time.sleep(self.flush_interval)
+
+    def close(self, timeout: float = 10):
+        """
+        Flush the messages still in the buffer and stop the worker, called on shutdown
+
+        Parameters
+        ----------
+        timeout : float
+            Maximum seconds to wait for the last flushes
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        if self._worker is not None:
+            self._worker.join(timeout)
+        with self._condition:
+            if self._pending:
+                logger.error("%d buffered messages were not saved on shutdown", len(self._pending))
+                self.dropped += len(self._pending)
+                self._pending.clear()
+
+    def stats(self) -> dict:
+        """
+        Get the counters of the buffer
+
+        Returns
+        -------
+        dict
+            Messages waiting and the maximum, whether the worker is running, flushes done, messages saved, failed flushes,
+            messages dropped, messages refused by a full buffer and restarts of a dead worker since the process started
+        """
+        return {
+            "pending": len(self._pending),
+            # Messages waiting without a running worker are not being saved
+            "worker_alive": self._worker is not None and self._worker.is_alive(),
+            "max_rows": self.max_rows,
+            "flushes": self.flushes,
+            "flushed": self.flushed,
+            "failed": self.failed,
+            "dropped": self.dropped,
+            "rejected": self.rejected,
+            "restarts": self.restarts,
+            "mean_flush_size": self.flushed / self.flushes if self.flushes else 0.0,
+        }
+
+
+_buffer: MessageBuffer | None = None
+
+def get_message_buffer() -> MessageBuffer:
+    """
+    Get the write-behind buffer of the chat messages of this process
+    """
+    global _buffer
+    if _buffer is None:
+        _buffer = MessageBuffer()
+    return _buffer
@@ -0,0 +1,100 @@
+# services/password.py
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import HTTPException
+import bcrypt
+from api.config import PASSWORD_BCRYPT_ROUNDS, PASSWORD_HASH_QUEUE, PASSWORD_HASH_WORKERS
+
+class PasswordService:
+    """
+    Service class for password hashing
+
+    bcrypt runs on a dedicated executor of PASSWORD_HASH_WORKERS threads, so a burst of logins
+    uses at most that many cores and leaves the rest to the other endpoints.
+    At most PASSWORD_HASH_QUEUE hashes wait for a thread, past that requests are rejected with a 503.
+    """
+
+    _executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash")
+    # Hashes running or waiting on the executor
+    _slots = threading.BoundedSemaphore(PASSWORD_HASH_WORKERS + PASSWORD_HASH_QUEUE)
+    rejected = 0
+
+    @staticmethod
+    def _run(function, *args):
+        """
+        Run a bcrypt function on the executor and wait for its result, rejecting the request if the queue is full
+        """
+        if not PasswordService._slots.acquire(blocking=False):
+            PasswordService.rejected += 1
+            raise HTTPException(status_code=503, detail="Too many authentication requests, try again later", headers={"Retry-After": "1"})
+        try:
+            future = PasswordService._executor.submit(function, *args)
+        except Exception:
+            PasswordService._slots.release()
+            raise
+        future.add_done_callback(lambda _: PasswordService._slots.release())
+        return future.result()
+
+    @staticmethod
+    def hash(password: str) -> str:
+        """
+        Hash a password with the configured cost factor
+
+        Parameters
+        ----------
+        password : str
+            Password to hash
+
+        Returns
+        -------
+        str
+            bcrypt hash of the password
+        """
+        return PasswordService._run(bcrypt.hashpw, password.encode("utf-8"), bcrypt.gensalt(rounds=PASSWORD_BCRYPT_ROUNDS)).decode("utf-8")
+
+    @staticmethod
+    def verify(password: str, hashed: str) -> bool:
+        """
+        Verify a password against its hash
+
+        Parameters
+        ----------
+        password : str
+            Password to verify
+        hashed : str
+            bcrypt hash of the password
+
+        Returns
+        -------
+        bool
+            True if the password matches the hash
+        """
+        return PasswordService._run(bcrypt.checkpw, password.encode("utf-8"), hashed.encode("utf-8"))
+
+    @staticmethod
+    def needs_rehash(hashed: str) -> bool:
+        """
+        Check if a hash was made with another cost factor than PASSWORD_BCRYPT_ROUNDS
+        """
+        try:
+            # bcrypt hashes look like $2b$<cost>$<salt and hash>
+            return int(hashed.split("$")[2]) != PASSWORD_BCRYPT_ROUNDS
+        except (IndexError, ValueError):
+            return True
+
+    @staticmethod
+    def stats() -> dict:
+        """
+        Get the counters of the password hashing executor
+
+        Returns
+        -------
+        dict
+            Hashes running or waiting, capacity and requests rejected since the process started
+        """
+        capacity = PASSWORD_HASH_WORKERS + PASSWORD_HASH_QUEUE
+        return {
+            "in_flight": capacity - PasswordService._slots._value,
+            "capacity": capacity,
+            "rejected": PasswordService.rejected,
+        }
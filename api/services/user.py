@@ -3,8 +3,8 @@ from sqlalchemy.orm import Session
 from sqlalchemy.exc import SQLAlchemyError
 from fastapi import HTTPException
 from api.models.user import UserModel
+from api.services.jwt import JwtService
 from typing import List
-import bcrypt
 
 class UserService:
     """
@@ -118,6 +118,8 @@ class UserService:
             user.status = 0
             # Commit the changes to the database
             db.commit()
+            # The deleted user can't authenticate anymore
+            JwtService.invalidate_user(user.id)
 
             # Refresh the user
             db.refresh(user)
@@ -153,23 +155,19 @@ class UserService:
             # If the user is not found, raise an HTTPException
             if not db_user:
                 raise HTTPException(status_code=404, detail="User not found")
+            # Compare the passwords first, it is free unlike a hash
+            if user.old_password == user.new_password:
+                raise HTTPException(status_code=400, detail="New password cannot be the same as old password")
             # If the user is found, verify the password
-            print('user.old_password', user.old_password)
             if not db_user.verify_password(user.old_password):
                 raise HTTPException(status_code=400, detail="Invalid password")
-            print('user.new_password', user.new_password)
-            if user.old_password == user.new_password:
-                raise HTTPException(status_code=400, detail="New password cannot be the same as old password")
-            # If the password is verified, update the user
-            for key, value in user.dict().items():
-                setattr(db_user, key, value)
-            # If the new password is provided, hash the new password
+            # If the new password is provided, the password setter hashes it once
             if user.new_password:
-                new_password_hash = bcrypt.hashpw(user.new_password.encode("utf-8"), bcrypt.gensalt())
-                setattr(db_user, "_password", new_password_hash)  # Set the hashed password
                 db_user.password = user.new_password
             # Commit the changes
             db.commit()
+            # The cached user still holds the old password hash
+            JwtService.invalidate_user(db_user.id)
             return {"success": True, "message": "Password updated successfully"}
             
         except SQLAlchemyError as e:
@@ -0,0 +1,122 @@
+import math
+import re
+import unicodedata
+from collections import Counter
+from typing import Dict, Iterable, List, Tuple
+import numpy as np
+
+_WORD = re.compile(r"\w+")
+
+def tokenize(text: str) -> List[str]:
+    """
+    Split a text into lowercase terms without accents, single characters are dropped
+    """
+    text = unicodedata.normalize("NFKD", text.casefold())
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    return [word for word in _WORD.findall(text) if len(word) > 1]
+
+class BM25Index:
+    """
+    Okapi BM25 inverted index over the chunks of a vector index
+
+    Documents are numbered in the order they are added, the same positions as the vectors of the index,
+    and every term keeps the positions of the documents it appears in with its frequency in each.
+    A search only touches the postings of the query terms, it needs no embedding.
+    """
+
+    # Saturation of the term frequency, and normalization by the document length
+    K1 = 1.5
+    B = 0.75
+
+    def __init__(self):
+        # Positions of the documents of each term, and the frequency of the term in each of them
+        self.postings: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+        # Terms of each document
+        self.lengths = np.zeros(0, dtype=np.int32)
+
+    @classmethod
+    def build(cls, texts: Iterable[str]) -> "BM25Index":
+        """
+        Build the index of a list of documents
+        """
+        index = cls()
+        index.add(texts)
+        return index
+
+    def copy(self) -> "BM25Index":
+        """
+        Get a copy of the index that can be appended to without changing this one, the postings are shared until they change
+        """
+        index = BM25Index()
+        index.postings = dict(self.postings)
+        index.lengths = self.lengths
+        return index
+
+    @property
+    def n_docs(self) -> int:
+        return self.lengths.shape[0]
+
+    def add(self, texts: Iterable[str]):
+        """
+        Append documents to the index, numbered after the documents already indexed
+        """
+        new_postings: Dict[str, Tuple[List[int], List[int]]] = {}
+        lengths: List[int] = []
+        for position, text in enumerate(texts, start=self.n_docs):
+            terms = tokenize(text)
+            lengths.append(len(terms))
+            for term, frequency in Counter(terms).items():
+                positions, frequencies = new_postings.setdefault(term, ([], []))
+                positions.append(position)
+                frequencies.append(frequency)
+
+        for term, (positions, frequencies) in new_postings.items():
+            positions = np.asarray(positions, dtype=np.int32)
+            frequencies = np.asarray(frequencies, dtype=np.int32)
+            previous = self.postings.get(term)
+            if previous is not None:
+                positions = np.concatenate([previous[0], positions])
+                frequencies = np.concatenate([previous[1], frequencies])
+            self.postings[term] = (positions, frequencies)
+        self.lengths = np.concatenate([self.lengths, np.asarray(lengths, dtype=np.int32)])
+
+    def __contains__(self, term: str) -> bool:
+        return term in self.postings
+
+    def search(self, query: str, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Find the k documents with the best BM25 score for a query
+
+        Parameters
+        ----------
+        query : str
+            Text of the query
+        k : int
+            Maximum number of documents
+
+        Returns
+        -------
+        Tuple[np.ndarray, np.ndarray]
+            Scores and positions of the documents, best first, only documents with a query term are returned
+        """
+        positions: List[np.ndarray] = []
+        scores: List[np.ndarray] = []
+        average_length = float(self.lengths.mean()) if self.n_docs else 0.0
+        for term in set(tokenize(query)):
+            posting = self.postings.get(term)
+            if posting is None:
+                continue
+            term_positions, frequencies = posting
+            idf = math.log(1 + (self.n_docs - len(term_positions) + 0.5) / (len(term_positions) + 0.5))
+            frequencies = frequencies.astype(np.float32)
+            norm = 1 - BM25Index.B + BM25Index.B * self.lengths[term_positions] / (average_length or 1.0)
+            positions.append(term_positions)
+            scores.append(idf * frequencies * (BM25Index.K1 + 1) / (frequencies + BM25Index.K1 * norm))
+
+        if not positions:
+            return np.zeros(0, dtype=np.float32), np.zeros(0, dtype=np.int64)
+        # Sum the scores of the terms of each document
+        documents, inverse = np.unique(np.concatenate(positions), return_inverse=True)
+        totals = np.bincount(inverse, weights=np.concatenate(scores))
+        best = np.argsort(-totals, kind="stable")[:k]
+        return totals[best].astype(np.float32), documents[best].astype(np.int64)
@@ -0,0 +1,90 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable
+
+class LRUCache:
+    """
+    Thread-safe in-process cache bounded by a number of entries, with an optional time to live
+
+    When the cache is full the least recently used entry is evicted.
+    """
+
+    def __init__(self, max_size: int, ttl: float | None = None):
+        """
+        Parameters
+        ----------
+        max_size : int
+            Maximum number of entries kept in the cache
+        ttl : float, optional
+            Seconds an entry is kept after it was set, None keeps entries until they are evicted
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        # Entries in least recently used order, with the time they expire at
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """
+        Get the value of a key, or default if it is not cached or expired
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or (entry[1] is not None and entry[1] < time.monotonic()):
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key: Hashable, value: Any):
+        """
+        Set the value of a key, evicting the least recently used entries if the cache is full
+        """
+        expires_at = time.monotonic() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        """
+        Remove a key from the cache and return its value
+        """
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            return default if entry is None else entry[0]
+
+    def clear(self):
+        """
+        Remove every entry of the cache
+        """
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> dict:
+        """
+        Get the size and the hit and miss counters of the cache
+
+        Returns
+        -------
+        dict
+            Entries, maximum size, hits, misses and hit rate since the cache was created
+        """
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
@@ -2,6 +2,8 @@ from sqlalchemy import create_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, Session
 from dotenv import load_dotenv
+from api.services.utils.pool import InstrumentedQueuePool
+from api.config import DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT_SECONDS, DB_POOL_RECYCLE_SECONDS, DB_POOL_PRE_PING
 import os
 
 # Load environment variables
@@ -18,7 +20,14 @@ engine = create_engine(
         "keepalives_interval": 10,
         "keepalives_count": 5,
         "password":os.getenv("DATABASE_PASSWORD")
-    }
+    },
+    # Every new connection pays a TLS handshake with the remote database, they are kept in a sized pool
+    poolclass=InstrumentedQueuePool,
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_timeout=DB_POOL_TIMEOUT_SECONDS,
+    pool_recycle=DB_POOL_RECYCLE_SECONDS,
+    pool_pre_ping=DB_POOL_PRE_PING,
 )
 
 # Create a session 
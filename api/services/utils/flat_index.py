@@ -0,0 +1,344 @@
+import struct
+from typing import Tuple
+import numpy as np
+from api.services.utils.quantization import ScalarQuantizer, load_quantizer
+
+class FlatIndex:
+    """
+    Exact L2 vector index over a NumPy array, a drop-in for the faiss flat index used by the langchain FAISS store
+
+    The vectors can be a read-only memory map of a .npy file, so an index only takes the memory
+    of the pages the searches touch, and the OS can drop them under memory pressure.
+    Searches scan the vectors in blocks, so a search never copies the whole index to memory.
+    A compressed index also keeps codes of its vectors from a scalar or product quantizer: searches scan the codes,
+    4 times smaller than the vectors with int8 and 20 to 30 times with product quantization,
+    and only the best candidates are re-scored exactly against the vectors.
+    Vectors can be appended in place to a saved file, so growing a saved index only writes the new vectors.
+    """
+
+    # Rows scanned at once by a search, and rows of codes decoded at once by a compressed search
+    BLOCK_ROWS = 16384
+    CODE_BLOCK_ROWS = 4096
+    # Bytes of the header of a saved .npy file, with room for the shape of the vectors appended later
+    HEADER_BYTES = 128
+
+    def __init__(self, vectors: np.ndarray, quantizer=None, codes: np.ndarray | None = None, rescore_factor: int = 8):
+        """
+        Parameters
+        ----------
+        vectors : np.ndarray
+            float32 vectors of the index, one per row
+        quantizer : ScalarQuantizer | ProductQuantizer, optional
+            Quantizer of the codes
+        codes : np.ndarray, optional
+            Codes of the vectors, one per row
+        rescore_factor : int
+            Candidates found in the codes and re-scored exactly per neighbor of a compressed search
+        """
+        self.vectors = vectors
+        self.quantizer = quantizer
+        self.codes = codes
+        self.rescore_factor = rescore_factor
+        # Buffer the codes are a view of, with room for the codes of the vectors appended later
+        self._codes_buffer: np.ndarray | None = None
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True, rows: int | None = None) -> "FlatIndex":
+        """
+        Load an index saved with save
+
+        Parameters
+        ----------
+        path : str
+            .npy file of the vectors
+        mmap : bool
+            Map the file read-only instead of reading it to memory
+        rows : int, optional
+            Only load the first rows of the file, by default all of them
+
+        Returns
+        -------
+        FlatIndex
+            Loaded index
+        """
+        vectors = np.load(path, mmap_mode="r" if mmap else None)
+        return cls(vectors if rows is None else vectors[:rows])
+
+    @classmethod
+    def from_faiss(cls, index) -> "FlatIndex":
+        """
+        Copy the vectors of a faiss flat index
+        """
+        return cls(index.reconstruct_n(0, index.ntotal).astype(np.float32))
+
+    def save(self, path: str):
+        """
+        Save the vectors to a .npy file
+        """
+        vectors = np.ascontiguousarray(self.vectors, dtype=np.float32)
+        with open(path, "wb") as f:
+            f.write(FlatIndex._header(vectors.shape, FlatIndex.HEADER_BYTES))
+            vectors.tofile(f)
+
+    @staticmethod
+    def _header(shape: Tuple[int, int], size: int) -> bytes | None:
+        """
+        Get the .npy header of float32 vectors of a shape, padded to a size in bytes, or None if it does not fit
+        """
+        header = repr({"descr": "<f4", "fortran_order": False, "shape": tuple(shape)}).ljust(size - 11) + "\n"
+        if len(header) != size - 10:
+            return None
+        return b"\x93NUMPY\x01\x00" + struct.pack("<H", len(header)) + header.encode("latin1")
+
+    @staticmethod
+    def append_saved(path: str, rows: int, vectors: np.ndarray) -> bool:
+        """
+        Append vectors in place to a .npy file saved with save, after its first rows
+
+        Only the new vectors are written, and the shape in the header is updated after them.
+        Rows of the file past the first rows, left by an append that did not complete, are overwritten.
+        The rows already saved are never written, so the indexes mapping the file keep serving them.
+
+        Parameters
+        ----------
+        path : str
+            .npy file of the vectors
+        rows : int
+            Rows of the file the vectors are appended after
+        vectors : np.ndarray
+            Vectors to append, one per row
+
+        Returns
+        -------
+        bool
+            Whether the vectors were appended, False if the file is not a float32 matrix with room in its header for the new shape
+        """
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        with open(path, "r+b") as f:
+            version = np.lib.format.read_magic(f)
+            if version != (1, 0):
+                return False
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+            offset = f.tell()
+            header = FlatIndex._header((rows + vectors.shape[0], vectors.shape[1]), offset)
+            if header is None or fortran_order or dtype != np.float32 or len(shape) != 2 or shape[1] != vectors.shape[1] or shape[0] < rows:
+                return False
+            f.seek(offset + rows * vectors.shape[1] * vectors.itemsize)
+            vectors.tofile(f)
+            end = f.tell()
+            # The header is only updated once the vectors are written, and before the file is cut,
+            # so the file always holds the rows its header claims
+            f.seek(0)
+            f.write(header)
+            f.truncate(end)
+        return True
+
+    def compress(self, quantizer):
+        """
+        Encode all the vectors with a trained quantizer, searches then scan the codes
+        """
+        self.quantizer = quantizer
+        if isinstance(quantizer, ScalarQuantizer):
+            # Every vector is encoded again, the values clipped are counted again too
+            quantizer.clipped = 0
+        self.codes = quantizer.encode(self.vectors) if self.ntotal else np.zeros((0, 0), dtype=np.uint8)
+        self._codes_buffer = None
+
+    def extended(self, vectors: np.ndarray, codes: np.ndarray | None = None) -> "FlatIndex":
+        """
+        Get a new index over vectors that start with the vectors of this index, this index is left as it is
+
+        The codes of the index are extended with the codes of the new vectors in a buffer with room to grow,
+        shared by the indexes extended one after the other, so extending an index only copies the new codes.
+        The rows of the buffer past the codes of this index are not read by its searches.
+
+        Parameters
+        ----------
+        vectors : np.ndarray
+            Vectors of this index followed by the new vectors
+        codes : np.ndarray, optional
+            Codes of the new vectors, needed when this index is compressed
+
+        Returns
+        -------
+        FlatIndex
+            Index of all the vectors, with the quantizer of this index
+        """
+        index = FlatIndex(vectors, self.quantizer, rescore_factor=self.rescore_factor)
+        if self.codes is None:
+            return index
+        rows = self.codes.shape[0] + codes.shape[0]
+        buffer = self._codes_buffer
+        if buffer is None or self.codes.base is not buffer or buffer.shape[0] < rows or buffer.shape[1] != codes.shape[1]:
+            # The buffer doubles, the codes are copied once every time the index doubles
+            buffer = np.empty((max(rows, 2 * self.codes.shape[0]), codes.shape[1]), dtype=np.uint8)
+            buffer[:self.codes.shape[0]] = self.codes
+        buffer[self.codes.shape[0]:rows] = codes
+        index.codes = buffer[:rows]
+        index._codes_buffer = buffer
+        return index
+
+    def save_codes(self, path: str):
+        """
+        Save the codes and the quantizer to a .npz file
+        """
+        with open(path, "wb") as f:
+            np.savez(f, kind=np.array(self.quantizer.kind), codes=self.codes, **self.quantizer.state())
+
+    def load_codes(self, path: str, kind: str, appended: Tuple[np.ndarray, ...] = ()) -> bool:
+        """
+        Attach the codes saved with save_codes, if they are of a kind and encode the current vectors
+
+        Parameters
+        ----------
+        path : str
+            .npz file of the codes
+        kind : str
+            Kind of the quantizer of the codes
+        appended : Tuple[np.ndarray, ...]
+            Codes of the vectors appended to the index since the codes were saved, encoded with the same quantizer
+
+        Returns
+        -------
+        bool
+            Whether the codes were attached
+        """
+        try:
+            with np.load(path) as saved:
+                arrays = {name: saved[name] for name in saved.files}
+        except FileNotFoundError:
+            return False
+        codes = arrays.pop("codes")
+        # Codes saved before the quantizers kept their training size count as trained on all of them
+        arrays.setdefault("trained_rows", np.array(codes.shape[0]))
+        if appended:
+            codes = np.concatenate([codes, *appended])
+        if arrays.pop("kind").item() != kind or codes.shape[0] != self.ntotal:
+            return False
+        self.quantizer = load_quantizer(kind, arrays)
+        self.codes = codes
+        self._codes_buffer = None
+        return True
+
+    @property
+    def ntotal(self) -> int:
+        return self.vectors.shape[0]
+
+    @property
+    def d(self) -> int:
+        return self.vectors.shape[1]
+
+    @property
+    def nbytes(self) -> int:
+        if self.codes is None:
+            return self.vectors.nbytes
+        # Mapped vectors of a compressed index are only read for the few candidates re-scored
+        vectors = 0 if isinstance(self.vectors, np.memmap) else self.vectors.nbytes
+        return vectors + self.codes.nbytes + self.quantizer.nbytes
+
+    def add(self, vectors: np.ndarray):
+        """
+        Append vectors to the index, a mapped index is copied to memory first
+
+        The vectors appended to a compressed index are encoded with its quantizer, which is not trained again.
+        """
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if self.codes is not None:
+            codes = self.quantizer.encode(vectors)
+            self.codes = codes if self.ntotal == 0 else np.concatenate([self.codes, codes])
+            self._codes_buffer = None
+        self.vectors = vectors if self.ntotal == 0 else np.concatenate([self.vectors, vectors])
+
+    def reconstruct(self, i: int) -> np.ndarray:
+        """
+        Get the vector at a position of the index
+        """
+        return np.array(self.vectors[i], dtype=np.float32)
+
+    def reconstruct_batch(self, positions: np.ndarray) -> np.ndarray:
+        """
+        Get the vectors at several positions of the index, one per row
+        """
+        return np.asarray(self.vectors[np.asarray(positions, dtype=np.int64)], dtype=np.float32)
+
+    def search(self, queries: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Find the k nearest vectors of each query, with the same results as faiss.IndexFlatL2.search
+
+        Parameters
+        ----------
+        queries : np.ndarray
+            Query vectors, one per row
+        k : int
+            Number of neighbors of each query
+
+        Returns
+        -------
+        Tuple[np.ndarray, np.ndarray]
+            Squared L2 distances and positions of the neighbors, closest first, padded with -1 when the index holds less than k vectors
+        """
+        queries = np.asarray(queries, dtype=np.float32)
+        if self.codes is not None:
+            return self._search_codes(queries, k)
+
+        n_queries = queries.shape[0]
+        distances = np.full((n_queries, k), np.inf, dtype=np.float32)
+        positions = np.full((n_queries, k), -1, dtype=np.int64)
+        for start in range(0, self.ntotal, FlatIndex.BLOCK_ROWS):
+            block = np.asarray(self.vectors[start:start + FlatIndex.BLOCK_ROWS])
+            distances, positions = FlatIndex._merge(distances, positions, FlatIndex._distances(queries, block), start, k)
+        return FlatIndex._sort(distances, positions)
+
+    def _search_codes(self, queries: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Find the k nearest vectors of each query among the best candidates of the codes, re-scored with the exact vectors
+        """
+        n_queries = queries.shape[0]
+        n_candidates = min(max(k * self.rescore_factor, k), self.ntotal) or 1
+        distances = np.full((n_queries, n_candidates), np.inf, dtype=np.float32)
+        candidates = np.full((n_queries, n_candidates), -1, dtype=np.int64)
+        # The distance tables of a product quantizer are computed once, not for every block
+        prepared = self.quantizer.prepare(queries)
+        for start in range(0, self.ntotal, FlatIndex.CODE_BLOCK_ROWS):
+            block_distances = self.quantizer.distances(prepared, self.codes[start:start + FlatIndex.CODE_BLOCK_ROWS])
+            distances, candidates = FlatIndex._merge(distances, candidates, block_distances, start, n_candidates)
+
+        # Exact distances of the candidates, only their rows of the vectors are read
+        distances = np.full((n_queries, k), np.inf, dtype=np.float32)
+        positions = np.full((n_queries, k), -1, dtype=np.int64)
+        for i in range(n_queries):
+            found = np.sort(candidates[i][candidates[i] >= 0])
+            exact = FlatIndex._distances(queries[i:i + 1], self.reconstruct_batch(found))
+            best, best_positions = FlatIndex._merge(distances[i:i + 1], positions[i:i + 1], exact, 0, k, found)
+            distances[i], positions[i] = best[0], best_positions[0]
+        return FlatIndex._sort(distances, positions)
+
+    @staticmethod
+    def _distances(queries: np.ndarray, vectors: np.ndarray) -> np.ndarray:
+        """
+        Get the squared L2 distances between queries and vectors, one row per query
+        """
+        # ||x - q||^2 = ||x||^2 - 2 x.q + ||q||^2
+        distances = np.einsum("ij,ij->i", vectors, vectors)[np.newaxis, :] - 2 * queries @ vectors.T + np.einsum("ij,ij->i", queries, queries)[:, np.newaxis]
+        return np.maximum(distances, 0, out=distances)
+
+    @staticmethod
+    def _merge(distances: np.ndarray, positions: np.ndarray, block_distances: np.ndarray, start: int, k: int, block_positions: np.ndarray | None = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Keep the k best of each query among the previous best and a block, whose rows start at a position or are at given positions
+        """
+        if block_positions is None:
+            block_positions = np.arange(start, start + block_distances.shape[1])
+        block_positions = np.broadcast_to(block_positions, block_distances.shape)
+        candidates = np.concatenate([distances, block_distances.astype(np.float32, copy=False)], axis=1)
+        candidate_positions = np.concatenate([positions, block_positions], axis=1)
+        best = np.argpartition(candidates, k - 1, axis=1)[:, :k]
+        return np.take_along_axis(candidates, best, axis=1), np.take_along_axis(candidate_positions, best, axis=1)
+
+    @staticmethod
+    def _sort(distances: np.ndarray, positions: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Sort the neighbors of each query, closest first
+        """
+        order = np.argsort(distances, axis=1, kind="stable")
+        return np.take_along_axis(distances, order, axis=1), np.take_along_axis(positions, order, axis=1)
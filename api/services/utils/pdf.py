@@ -0,0 +1,41 @@
+from typing import TYPE_CHECKING, Iterator
+
+# pypdf and langchain are only imported when a PDF is read
+if TYPE_CHECKING:
+    from langchain.schema import Document
+
+def page_count(path: str) -> int:
+    """
+    Get the number of pages of a PDF, without extracting their text
+    """
+    import pypdf
+
+    with open(path, "rb") as f:
+        return len(pypdf.PdfReader(f).pages)
+
+def iter_pages(path: str, start_page: int = 0) -> Iterator["Document"]:
+    """
+    Extract the text of the pages of a PDF one at a time
+
+    Only the page being read is extracted, so the memory taken does not grow with the size of the document,
+    and pages before start_page are skipped without extracting their text.
+
+    Parameters
+    ----------
+    path : str
+        Path of the PDF
+    start_page : int
+        First page to extract, counted from 0
+
+    Returns
+    -------
+    Iterator[Document]
+        Text of each page, with its source and page number in the metadata like the langchain PyPDFLoader
+    """
+    import pypdf
+    from langchain.schema import Document
+
+    with open(path, "rb") as f:
+        reader = pypdf.PdfReader(f)
+        for page_number in range(start_page, len(reader.pages)):
+            yield Document(page_content=reader.pages[page_number].extract_text(), metadata={"source": path, "page": page_number})
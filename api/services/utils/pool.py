@@ -0,0 +1,74 @@
+import threading
+import time
+from sqlalchemy.exc import TimeoutError
+from sqlalchemy.pool import QueuePool
+
+class InstrumentedQueuePool(QueuePool):
+    """
+    Queue pool that measures the time requests wait for a connection and the time new connections take to open
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._stats_lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self.connects = 0
+        self.connect_seconds = 0.0
+        self.max_connect_seconds = 0.0
+
+    def _do_get(self):
+        """
+        Get a connection from the pool, measuring the wait, which includes opening a new connection when needed
+        """
+        start = time.perf_counter()
+        try:
+            record = super()._do_get()
+        except TimeoutError:
+            with self._stats_lock:
+                self.timeouts += 1
+            raise
+        elapsed = time.perf_counter() - start
+        with self._stats_lock:
+            self.checkouts += 1
+            self.wait_seconds += elapsed
+            self.max_wait_seconds = max(self.max_wait_seconds, elapsed)
+        return record
+
+    def _create_connection(self):
+        """
+        Open a new connection, measuring how long the connect and TLS handshake take
+        """
+        start = time.perf_counter()
+        record = super()._create_connection()
+        elapsed = time.perf_counter() - start
+        with self._stats_lock:
+            self.connects += 1
+            self.connect_seconds += elapsed
+            self.max_connect_seconds = max(self.max_connect_seconds, elapsed)
+        return record
+
+    def stats(self) -> dict:
+        """
+        Get the state and counters of the pool
+
+        Returns
+        -------
+        dict
+            Connections of the pool, checkouts, timeouts, wait and connect times in milliseconds since the pool was created
+        """
+        return {
+            "size": self.size(),
+            "checked_out": self.checkedout(),
+            "checked_in": self.checkedin(),
+            "overflow": self.overflow(),
+            "checkouts": self.checkouts,
+            "timeouts": self.timeouts,
+            "mean_wait_ms": self.wait_seconds / self.checkouts * 1000 if self.checkouts else 0.0,
+            "max_wait_ms": self.max_wait_seconds * 1000,
+            "connects": self.connects,
+            "mean_connect_ms": self.connect_seconds / self.connects * 1000 if self.connects else 0.0,
+            "max_connect_ms": self.max_connect_seconds * 1000,
+        }
@@ -0,0 +1,253 @@
+from typing import Dict
+import numpy as np
+
+class ScalarQuantizer:
+    """
+    8 bit scalar quantization: every dimension is mapped to 256 levels between its minimum and maximum
+
+    A vector takes one byte per dimension instead of four.
+    Values of vectors encoded after the training that fall outside the trained range are clipped and counted,
+    a quantizer that clips too many of them is trained again.
+    """
+
+    kind = "int8"
+    # Share of the values encoded after the training that can be clipped before the quantizer is trained again
+    MAX_CLIPPED_SHARE = 0.01
+
+    def __init__(self, low: np.ndarray, scale: np.ndarray, trained_rows: int = 0, clipped: int = 0):
+        """
+        Parameters
+        ----------
+        low : np.ndarray
+            Minimum of every dimension
+        scale : np.ndarray
+            Width of a level of every dimension
+        trained_rows : int
+            Vectors the quantizer was trained on
+        clipped : int
+            Values clipped by the encodings since the training
+        """
+        self.low = low
+        self.scale = scale
+        self.trained_rows = trained_rows
+        self.clipped = clipped
+
+    @classmethod
+    def train(cls, vectors: np.ndarray) -> "ScalarQuantizer":
+        """
+        Fit the range of every dimension of a set of vectors
+        """
+        low = vectors.min(axis=0).astype(np.float32)
+        scale = ((vectors.max(axis=0) - low) / 255).astype(np.float32)
+        # A constant dimension is encoded as its only value
+        scale[scale == 0] = 1.0
+        return cls(low, scale, trained_rows=vectors.shape[0])
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        """
+        Get the codes of vectors, one row of bytes per vector
+        """
+        levels = np.rint((vectors - self.low) / self.scale)
+        self.clipped += int(np.count_nonzero((levels < 0) | (levels > 255)))
+        return np.clip(levels, 0, 255).astype(np.uint8)
+
+    def clipped_share(self, n_vectors: int) -> float:
+        """
+        Get the share of the values clipped among the values of the vectors added after the training to an index of n_vectors
+        """
+        return self.clipped / max((n_vectors - self.trained_rows) * self.low.shape[0], 1)
+
+    def prepare(self, queries: np.ndarray) -> np.ndarray:
+        """
+        Get what distances needs of queries, once per search, the queries themselves
+        """
+        return queries
+
+    def distances(self, queries: np.ndarray, codes: np.ndarray) -> np.ndarray:
+        """
+        Get the approximate squared L2 distances between prepared queries and encoded vectors, one row per query
+        """
+        vectors = codes * self.scale + self.low
+        distances = np.einsum("ij,ij->i", vectors, vectors)[np.newaxis, :] - 2 * queries @ vectors.T + np.einsum("ij,ij->i", queries, queries)[:, np.newaxis]
+        return np.maximum(distances, 0)
+
+    @property
+    def nbytes(self) -> int:
+        return self.low.nbytes + self.scale.nbytes
+
+    def state(self) -> Dict[str, np.ndarray]:
+        return {"low": self.low, "scale": self.scale, "trained_rows": np.array(self.trained_rows), "clipped": np.array(self.clipped)}
+
+
+class ProductQuantizer:
+    """
+    Product quantization: vectors are cut in sub vectors, each replaced by the nearest of 256 centroids learned by k-means
+
+    A vector takes one byte per sub vector, distances to a query are sums of a table computed once per query.
+    """
+
+    kind = "pq"
+    # Centroids of each sub vector, so a code fits in a byte
+    MAX_CENTROIDS = 256
+
+    # Vectors sampled to train the centroids, per centroid, and maximum k-means iterations
+    TRAIN_SAMPLES_PER_CENTROID = 16
+    TRAIN_ITERATIONS = 10
+    # Vectors encoded at once, bounds the memory of the distances to the centroids
+    ENCODE_BLOCK_ROWS = 16384
+
+    def __init__(self, centroids: np.ndarray, trained_rows: int = 0):
+        """
+        Parameters
+        ----------
+        centroids : np.ndarray
+            Centroids of every sub vector, of shape (sub vectors, centroids, dimensions of a sub vector)
+        trained_rows : int
+            Vectors of the index the quantizer was trained on
+        """
+        self.centroids = centroids
+        self.trained_rows = trained_rows
+
+    @staticmethod
+    def _kmeans(vectors: np.ndarray, n_centroids: int, rng: np.random.Generator) -> np.ndarray:
+        """
+        Cluster vectors with Lloyd's k-means, empty clusters keep their previous centroid
+        """
+        centroids = vectors[rng.choice(len(vectors), n_centroids, replace=False)].copy()
+        assignment = None
+        for _ in range(ProductQuantizer.TRAIN_ITERATIONS):
+            distances = np.einsum("ij,ij->i", centroids, centroids)[np.newaxis, :] - 2 * vectors @ centroids.T
+            previous, assignment = assignment, distances.argmin(axis=1)
+            # The clusters are stable
+            if previous is not None and np.array_equal(previous, assignment):
+                break
+            counts = np.bincount(assignment, minlength=n_centroids)
+            sums = np.stack([np.bincount(assignment, weights=vectors[:, j], minlength=n_centroids) for j in range(vectors.shape[1])], axis=1)
+            filled = counts > 0
+            centroids[filled] = sums[filled] / counts[filled, np.newaxis]
+        return centroids
+
+    @classmethod
+    def train(cls, vectors: np.ndarray, sub_vectors: int, seed: int = 0) -> "ProductQuantizer":
+        """
+        Learn the centroids of the sub vectors of a set of vectors
+
+        Parameters
+        ----------
+        vectors : np.ndarray
+            Training vectors, one per row
+        sub_vectors : int
+            Number of sub vectors, lowered to the nearest divisor of the dimensions
+        seed : int
+            Seed of the sampling, the same vectors always give the same centroids
+
+        Returns
+        -------
+        ProductQuantizer
+            Trained quantizer
+        """
+        n_vectors, dimensions = vectors.shape
+        sub_vectors = max(m for m in range(1, min(sub_vectors, dimensions) + 1) if dimensions % m == 0)
+        n_centroids = min(ProductQuantizer.MAX_CENTROIDS, n_vectors)
+        rng = np.random.default_rng(seed)
+        sample_size = min(n_vectors, n_centroids * ProductQuantizer.TRAIN_SAMPLES_PER_CENTROID)
+        sample = np.asarray(vectors[np.sort(rng.choice(n_vectors, sample_size, replace=False))], dtype=np.float32)
+
+        width = dimensions // sub_vectors
+        centroids = np.stack([
+            ProductQuantizer._kmeans(sample[:, j * width:(j + 1) * width], n_centroids, rng) for j in range(sub_vectors)
+        ])
+        return cls(centroids, trained_rows=n_vectors)
+
+    @property
+    def n_centroids(self) -> int:
+        return self.centroids.shape[1]
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        """
+        Get the codes of vectors, one byte per sub vector
+        """
+        sub_vectors, _, width = self.centroids.shape
+        codes = np.empty((vectors.shape[0], sub_vectors), dtype=np.uint8)
+        for start in range(0, vectors.shape[0], ProductQuantizer.ENCODE_BLOCK_ROWS):
+            block = np.asarray(vectors[start:start + ProductQuantizer.ENCODE_BLOCK_ROWS], dtype=np.float32)
+            for j in range(sub_vectors):
+                centroids = self.centroids[j]
+                distances = np.einsum("ij,ij->i", centroids, centroids)[np.newaxis, :] - 2 * block[:, j * width:(j + 1) * width] @ centroids.T
+                codes[start:start + block.shape[0], j] = distances.argmin(axis=1)
+        return codes
+
+    def prepare(self, queries: np.ndarray) -> np.ndarray:
+        """
+        Get the distance tables of queries, once per search: the squared distance of every sub vector of each query
+        to every centroid of that sub vector, one flattened row of (sub vectors, centroids) per query
+        """
+        sub_vectors, n_centroids, width = self.centroids.shape
+        sub_queries = queries.reshape(queries.shape[0], sub_vectors, width).transpose(1, 0, 2)
+        # ||q - c||^2 = ||q||^2 - 2 q.c + ||c||^2, with one matrix product per sub vector
+        tables = (
+            np.einsum("jkw,jkw->jk", self.centroids, self.centroids)[:, np.newaxis, :]
+            - 2 * np.matmul(sub_queries, self.centroids.transpose(0, 2, 1))
+            + np.einsum("jqw,jqw->jq", sub_queries, sub_queries)[:, :, np.newaxis]
+        )
+        return np.ascontiguousarray(tables.transpose(1, 0, 2), dtype=np.float32).reshape(queries.shape[0], sub_vectors * n_centroids)
+
+    def distances(self, tables: np.ndarray, codes: np.ndarray) -> np.ndarray:
+        """
+        Get the approximate squared L2 distances between prepared queries and encoded vectors, one row per query
+        """
+        sub_vectors, n_centroids, _ = self.centroids.shape
+        # Entry of every code of every vector in the flattened table of a query, built in 32 bits, which halves the memory
+        # written for them, and converted once to the index type of NumPy when several queries gather them
+        entries = codes.astype(np.int32)
+        entries += np.arange(0, sub_vectors * n_centroids, n_centroids, dtype=np.int32)
+        if tables.shape[0] > 1:
+            entries = entries.astype(np.intp)
+        ones = np.ones(sub_vectors, dtype=np.float32)
+        distances = np.empty((tables.shape[0], codes.shape[0]), dtype=np.float32)
+        for i in range(tables.shape[0]):
+            # One gather of the entries of all the codes, summed over the sub vectors by a matrix product
+            distances[i] = tables[i][entries] @ ones
+        return np.maximum(distances, 0, out=distances)
+
+    @property
+    def nbytes(self) -> int:
+        return self.centroids.nbytes
+
+    def state(self) -> Dict[str, np.ndarray]:
+        return {"centroids": self.centroids, "trained_rows": np.array(self.trained_rows)}
+
+
+def train_quantizer(kind: str, vectors: np.ndarray, pq_sub_vectors: int):
+    """
+    Train a quantizer of a kind on a set of vectors
+
+    Parameters
+    ----------
+    kind : str
+        "int8" or "pq"
+    vectors : np.ndarray
+        Training vectors, one per row
+    pq_sub_vectors : int
+        Sub vectors of a product quantizer
+
+    Returns
+    -------
+    ScalarQuantizer | ProductQuantizer
+        Trained quantizer
+    """
+    if kind == ScalarQuantizer.kind:
+        return ScalarQuantizer.train(vectors)
+    if kind == ProductQuantizer.kind:
+        return ProductQuantizer.train(vectors, pq_sub_vectors)
+    raise ValueError(f"Unknown vector compression: {kind}")
+
+def load_quantizer(kind: str, state: Dict[str, np.ndarray]):
+    """
+    Rebuild a quantizer from the arrays of its state
+    """
+    if kind == ScalarQuantizer.kind:
+        return ScalarQuantizer(state["low"], state["scale"], int(state["trained_rows"]), int(state.get("clipped", 0)))
+    if kind == ProductQuantizer.kind:
+        return ProductQuantizer(state["centroids"], int(state["trained_rows"]))
+    raise ValueError(f"Unknown vector compression: {kind}")
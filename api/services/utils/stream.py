@@ -0,0 +1,66 @@
+import queue
+import threading
+from typing import Iterable, Iterator, TypeVar
+
+T = TypeVar("T")
+
+# Marks the end of the items produced by the background thread
+_END = object()
+
+def prefetch(items: Iterable[T], size: int) -> Iterator[T]:
+    """
+    Iterate over items produced ahead by a background thread
+
+    At most size items wait for the consumer, the producer blocks until the consumer catches up,
+    so a fast producer never holds more than size items in memory.
+    An error of the producer is raised to the consumer, and the producer stops when the consumer does.
+
+    Parameters
+    ----------
+    items : Iterable[T]
+        Items to produce, iterated by the background thread
+    size : int
+        Maximum items produced ahead of the consumer
+
+    Returns
+    -------
+    Iterator[T]
+        The items, in order
+    """
+    buffer: queue.Queue = queue.Queue(maxsize=max(size, 1))
+    stopped = threading.Event()
+
+    def put(entry) -> bool:
+        # Wait for room in the buffer, unless the consumer stopped
+        while not stopped.is_set():
+            try:
+                buffer.put(entry, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for item in items:
+                if not put((item, None)):
+                    return
+            put((_END, None))
+        except BaseException as e:
+            put((_END, e))
+        finally:
+            close = getattr(items, "close", None)
+            if close is not None:
+                close()
+
+    threading.Thread(target=produce, name="prefetch", daemon=True).start()
+    try:
+        while True:
+            item, error = buffer.get()
+            if item is _END:
+                if error is not None:
+                    raise error
+                return
+            yield item
+    finally:
+        stopped.set()
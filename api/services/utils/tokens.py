@@ -0,0 +1,28 @@
+from functools import lru_cache
+from typing import Dict, List
+import tiktoken
+
+# Tokens added by the chat format to every message, on top of its content
+TOKENS_PER_MESSAGE = 4
+
+@lru_cache(maxsize=None)
+def get_encoding(model: str = "gpt-3.5-turbo") -> tiktoken.Encoding:
+    """
+    Get the tokenizer of a model, loaded once per process
+    """
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+
+def count_tokens(text: str, model: str = "gpt-3.5-turbo") -> int:
+    """
+    Count the tokens of a text for a model, special tokens written in the text count as plain text
+    """
+    return len(get_encoding(model).encode(text, disallowed_special=()))
+
+def count_message_tokens(messages: List[Dict[str, str]], model: str = "gpt-3.5-turbo") -> int:
+    """
+    Count the tokens of a list of chat messages for a model
+    """
+    return sum(TOKENS_PER_MESSAGE + count_tokens(message["content"], model) for message in messages)
@@ -0,0 +1,802 @@
+# services/vectorstore.py
+import fcntl
+import json
+import os
+import pickle
+import tempfile
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Dict, Iterable, Iterator, List, Tuple
+import numpy as np
+from fastapi import HTTPException
+from sqlalchemy import select
+from api.models.datasource import DataSourceChunkModel, DataSourceModel
+from api.services.utils import pdf
+from api.services.utils.bm25 import BM25Index
+from api.services.utils.db import SessionLocal
+from api.services.utils.flat_index import FlatIndex
+from api.services.utils.quantization import ProductQuantizer, ScalarQuantizer, train_quantizer
+from api.services.utils.tokens import count_tokens
+from api.config import (
+    INGEST_CHUNK_OVERLAP_TOKENS, INGEST_CHUNK_TOKENS, INGEST_WINDOW_CHUNKS, TRAINING_DATA_PATH, VECTOR_INDEX_COMPRESSION, VECTOR_INDEX_DIR,
+    VECTOR_INDEX_MEMORY_BUDGET_MB, VECTOR_INDEX_MMAP, VECTOR_INDEX_PQ_SUBVECTORS, VECTOR_INDEX_RESCORE_FACTOR, VECTOR_INDEX_RETRAIN_GROWTH,
+)
+
+# langchain and the embeddings take seconds to import, they are only loaded when an index is built or read,
+# reading the version of a chatbot doesn't need them
+if TYPE_CHECKING:
+    from langchain.schema import Document
+    from langchain.vectorstores import FAISS
+
+class VectorStoreService:
+    """
+    Service class for the vector index of each trained chatbot
+
+    Every chatbot has its own index saved under VECTOR_INDEX_DIR: its vectors in a .npy file
+    and its chunks in a pickle, served through the langchain FAISS store.
+    The vectors are memory mapped, and the loaded indexes are kept in an LRU bounded by
+    VECTOR_INDEX_MEMORY_BUDGET_MB, so the chatbots a node can host are bounded by its disk, not its memory.
+    The chunks of the data sources are stored in the data_source_chunk table, an index is only derived from them
+    and can be rebuilt from the rows on any node.
+    Every index also has a BM25 inverted index of its chunks, saved with it and kept as its lexical attribute,
+    for the retrievals that need no embedding.
+    With VECTOR_INDEX_COMPRESSION, the searches scan int8 or product quantized codes saved next to the vectors,
+    and only re-score their best candidates against the mapped vectors, so an index takes a fraction of its memory.
+    Ingested chunks are appended in place: their vectors after the saved ones, their chunks, texts and codes to a log,
+    and a manifest saved last holds the rows and log bytes of the complete appends.
+    An index is saved whole again once the rows appended since its last save pass the rows of that save.
+    """
+
+    # Name of the index files inside the folder of each chatbot
+    INDEX_NAME = "index"
+    VECTORS_NAME = "vectors.npy"
+    LEXICAL_NAME = "lexical.pkl"
+    CODES_NAME = "codes.npz"
+    LOG_NAME = "appended.pkl"
+    MANIFEST_NAME = "manifest.json"
+    # Indexes loaded by this process in least recently used order, keyed by chatbot id,
+    # with the modification time of the saved index and the bytes it can take in memory
+    _indexes: "OrderedDict[int, Tuple[int, FAISS, int]]" = OrderedDict()
+    _indexes_lock = threading.Lock()
+    _resident_bytes = 0
+    evictions = 0
+    # Lock of each chatbot index, and the lock that guards their creation
+    _locks: Dict[int, threading.Lock] = {}
+    _lock = threading.Lock()
+
+    @staticmethod
+    def _index_path(chatbot_id: int) -> str:
+        """
+        Get the folder where the index of a chatbot is saved
+
+        Parameters
+        ----------
+        chatbot_id : int
+            ID of the chatbot
+
+        Returns
+        -------
+        str
+            Folder of the chatbot index
+        """
+        return os.path.join(VECTOR_INDEX_DIR, f"chatbot_{chatbot_id}")
+
+    @staticmethod
+    def _saved_mtime(chatbot_id: int) -> int | None:
+        """
+        Get the modification time of the saved index of a chatbot, or None if it was never saved
+
+        The manifest is replaced by every save and append, an index saved before the manifests has only its vectors.
+        """
+        path = VectorStoreService._index_path(chatbot_id)
+        for file_name in (VectorStoreService.MANIFEST_NAME, VectorStoreService.VECTORS_NAME):
+            try:
+                return os.stat(os.path.join(path, file_name)).st_mtime_ns
+            except FileNotFoundError:
+                continue
+        return None
+
+    @staticmethod
+    def _read_manifest(path: str) -> dict | None:
+        """
+        Read the manifest of a saved index: its rows, the rows of its last full save and the bytes of its append log
+
+        Returns None for an index saved before the manifests, which has no appended rows.
+        """
+        try:
+            with open(os.path.join(path, VectorStoreService.MANIFEST_NAME)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    @staticmethod
+    def _write_manifest(path: str, rows: int, base_rows: int, log_bytes: int):
+        """
+        Replace the manifest of a saved index, this commits a save or an append
+        """
+        fd, tmp_path = tempfile.mkstemp(dir=path)
+        with os.fdopen(fd, "w") as f:
+            json.dump({"rows": rows, "base_rows": base_rows, "log_bytes": log_bytes}, f)
+        os.replace(tmp_path, os.path.join(path, VectorStoreService.MANIFEST_NAME))
+
+    @staticmethod
+    def _read_log(path: str, log_bytes: int) -> List[dict]:
+        """
+        Read the windows appended to a saved index since its last full save, up to the bytes committed by its manifest
+        """
+        records = []
+        if not log_bytes:
+            return records
+        with open(os.path.join(path, VectorStoreService.LOG_NAME), "rb") as f:
+            while f.tell() < log_bytes:
+                records.append(pickle.load(f))
+        return records
+
+    @staticmethod
+    def _get_resident(chatbot_id: int, saved_mtime: int | None) -> "FAISS | None":
+        """
+        Get the loaded index of a chatbot if it is the latest saved one, marking it as recently used
+        """
+        with VectorStoreService._indexes_lock:
+            cached = VectorStoreService._indexes.get(chatbot_id)
+            if cached is None or cached[0] != saved_mtime:
+                return None
+            VectorStoreService._indexes.move_to_end(chatbot_id)
+            return cached[1]
+
+    @staticmethod
+    def _set_resident(chatbot_id: int, saved_mtime: int, index: "FAISS"):
+        """
+        Keep a loaded index of a chatbot, evicting the least recently used ones over the memory budget
+        """
+        path = VectorStoreService._index_path(chatbot_id)
+        # An index saved before the lexical indexes has none on disk until its next save,
+        # the codes of a compressed index are counted by its vectors
+        size = index.index.nbytes + sum(
+            os.path.getsize(os.path.join(path, file_name))
+            for file_name in (f"{VectorStoreService.INDEX_NAME}.pkl", VectorStoreService.LEXICAL_NAME, VectorStoreService.LOG_NAME)
+            if os.path.exists(os.path.join(path, file_name))
+        )
+        budget = VECTOR_INDEX_MEMORY_BUDGET_MB * 1024 * 1024
+        with VectorStoreService._indexes_lock:
+            previous = VectorStoreService._indexes.pop(chatbot_id, None)
+            if previous is not None:
+                VectorStoreService._resident_bytes -= previous[2]
+            VectorStoreService._indexes[chatbot_id] = (saved_mtime, index, size)
+            VectorStoreService._resident_bytes += size
+            # The index just loaded stays even if it is bigger than the whole budget
+            while VectorStoreService._resident_bytes > budget and len(VectorStoreService._indexes) > 1:
+                # Queries still running on an evicted index keep it alive until they finish
+                _, (_, _, evicted_size) = VectorStoreService._indexes.popitem(last=False)
+                VectorStoreService._resident_bytes -= evicted_size
+                VectorStoreService.evictions += 1
+
+    @staticmethod
+    def _load(chatbot_id: int, mmap: bool = VECTOR_INDEX_MMAP) -> "FAISS":
+        """
+        Read the saved index of a chatbot
+
+        Parameters
+        ----------
+        chatbot_id : int
+            ID of the chatbot
+        mmap : bool
+            Map the vectors read-only instead of reading them to memory, an index that will be appended to is read
+
+        Returns
+        -------
+        FAISS
+            Vector index of the chatbot
+        """
+        from langchain.vectorstores import FAISS
+        from api.services.embedding import get_embeddings
+
+        path = VectorStoreService._index_path(chatbot_id)
+        manifest = VectorStoreService._read_manifest(path)
+        records = VectorStoreService._read_log(path, manifest["log_bytes"]) if manifest else []
+        with open(os.path.join(path, f"{VectorStoreService.INDEX_NAME}.pkl"), "rb") as f:
+            docstore, index_to_docstore_id = pickle.load(f)
+        # The chunks appended since the last full save follow the saved ones
+        for record in records:
+            docstore._dict.update(zip(record["ids"], record["documents"]))
+            start = len(index_to_docstore_id)
+            index_to_docstore_id.update({start + j: chunk_id for j, chunk_id in enumerate(record["ids"])})
+        # Rows past the manifest were left by an append that did not complete
+        vectors = FlatIndex.load(os.path.join(path, VectorStoreService.VECTORS_NAME), mmap=mmap, rows=manifest["rows"] if manifest else None)
+        if VECTOR_INDEX_COMPRESSION != "none":
+            # Windows appended while the index was not compressed have no codes, the index is encoded again
+            if all(record["codes"] is not None for record in records) and vectors.load_codes(
+                os.path.join(path, VectorStoreService.CODES_NAME), VECTOR_INDEX_COMPRESSION, tuple(record["codes"] for record in records)
+            ) and isinstance(vectors.quantizer, ScalarQuantizer):
+                vectors.quantizer.clipped += sum(record["clipped"] for record in records)
+            VectorStoreService._compress(vectors)
+        index = FAISS(get_embeddings().embed_query, vectors, docstore, index_to_docstore_id)
+        try:
+            with open(os.path.join(path, VectorStoreService.LEXICAL_NAME), "rb") as f:
+                index.lexical = pickle.load(f)
+            index.lexical.add(document.page_content for record in records for document in record["documents"])
+        except FileNotFoundError:
+            # Index saved before the lexical indexes, it gets one on its next save
+            index.lexical = None
+        VectorStoreService._check_lexical(index)
+        return index
+
+    @staticmethod
+    def _check_lexical(index: "FAISS"):
+        """
+        Build the lexical index of an index that has none, or one that does not match its vectors
+        """
+        lexical = getattr(index, "lexical", None)
+        if lexical is None or lexical.n_docs != index.index.ntotal:
+            index.lexical = BM25Index.build(
+                index.docstore.search(index.index_to_docstore_id[position]).page_content for position in range(index.index.ntotal)
+            )
+
+    @staticmethod
+    def _compress(vectors: FlatIndex):
+        """
+        Give the vectors of an index the codes of VECTOR_INDEX_COMPRESSION
+
+        Vectors without a quantizer of that kind get a new one trained on them, so an index is trained again
+        when it is rebuilt, while the vectors appended to it are encoded with the quantizer it already has.
+        A quantizer is trained again once the index grew VECTOR_INDEX_RETRAIN_GROWTH times past the vectors it was trained on,
+        a product quantizer as soon as an index too small to fill its centroids grows,
+        and a scalar quantizer when it clipped too many values of the vectors appended since its training.
+        """
+        if VECTOR_INDEX_COMPRESSION == "none" or vectors.ntotal == 0:
+            vectors.quantizer = vectors.codes = None
+            return
+        if VectorStoreService._needs_training(vectors.quantizer, vectors.ntotal):
+            vectors.compress(train_quantizer(VECTOR_INDEX_COMPRESSION, vectors.vectors, VECTOR_INDEX_PQ_SUBVECTORS))
+        elif vectors.codes.shape[0] != vectors.ntotal:
+            vectors.compress(vectors.quantizer)
+        vectors.rescore_factor = VECTOR_INDEX_RESCORE_FACTOR
+
+    @staticmethod
+    def _needs_training(quantizer, ntotal: int) -> bool:
+        """
+        Tell if the quantizer of an index of ntotal vectors must be trained again, see _compress
+        """
+        return (
+            quantizer is None or quantizer.kind != VECTOR_INDEX_COMPRESSION
+            or ntotal >= quantizer.trained_rows * VECTOR_INDEX_RETRAIN_GROWTH
+            or (isinstance(quantizer, ProductQuantizer) and quantizer.n_centroids < min(ProductQuantizer.MAX_CENTROIDS, ntotal))
+            or (isinstance(quantizer, ScalarQuantizer) and quantizer.clipped_share(ntotal) > ScalarQuantizer.MAX_CLIPPED_SHARE)
+        )
+
+    @staticmethod
+    def _save(chatbot_id: int, index: "FAISS"):
+        """
+        Save the index of a chatbot to disk and keep it loaded in this process, with its vectors memory mapped
+        """
+        path = VectorStoreService._index_path(chatbot_id)
+        os.makedirs(path, exist_ok=True)
+        # Indexes built by langchain hold a faiss index, they are saved as plain vectors
+        vectors = index.index if isinstance(index.index, FlatIndex) else FlatIndex.from_faiss(index.index)
+        VectorStoreService._check_lexical(index)
+        VectorStoreService._compress(vectors)
+        file_names = [f"{VectorStoreService.INDEX_NAME}.pkl", VectorStoreService.LEXICAL_NAME, VectorStoreService.VECTORS_NAME]
+        # Write to a temporary folder first so other processes never read a half written index
+        with tempfile.TemporaryDirectory(dir=path) as tmp_path:
+            with open(os.path.join(tmp_path, f"{VectorStoreService.INDEX_NAME}.pkl"), "wb") as f:
+                pickle.dump((index.docstore, index.index_to_docstore_id), f)
+            with open(os.path.join(tmp_path, VectorStoreService.LEXICAL_NAME), "wb") as f:
+                pickle.dump(index.lexical, f)
+            if vectors.codes is not None:
+                vectors.save_codes(os.path.join(tmp_path, VectorStoreService.CODES_NAME))
+                file_names.insert(2, VectorStoreService.CODES_NAME)
+            elif os.path.exists(os.path.join(path, VectorStoreService.CODES_NAME)):
+                # Codes of an index saved while it was compressed no longer match its vectors
+                os.remove(os.path.join(path, VectorStoreService.CODES_NAME))
+            vectors.save(os.path.join(tmp_path, VectorStoreService.VECTORS_NAME))
+            for file_name in file_names:
+                os.replace(os.path.join(tmp_path, file_name), os.path.join(path, file_name))
+        # The manifest is replaced last, its modification time marks a complete save, the append log starts over
+        VectorStoreService._write_manifest(path, vectors.ntotal, vectors.ntotal, 0)
+        # Serve the saved file instead of the copy in memory, with the codes already encoded
+        index.index = FlatIndex.load(os.path.join(path, VectorStoreService.VECTORS_NAME), mmap=VECTOR_INDEX_MMAP)
+        index.index.quantizer, index.index.codes, index.index.rescore_factor = vectors.quantizer, vectors.codes, vectors.rescore_factor
+        VectorStoreService._set_resident(chatbot_id, VectorStoreService._saved_mtime(chatbot_id), index)
+
+    @staticmethod
+    @contextmanager
+    def _write_lock(chatbot_id: int):
+        """
+        Hold the lock that serializes writes to the index of a chatbot, across threads and processes
+        """
+        path = VectorStoreService._index_path(chatbot_id)
+        os.makedirs(path, exist_ok=True)
+        with VectorStoreService._lock:
+            thread_lock = VectorStoreService._locks.setdefault(chatbot_id, threading.Lock())
+        with thread_lock, open(os.path.join(path, ".lock"), "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    @staticmethod
+    def _load_training_data() -> Iterator["Document"]:
+        """
+        Read the pages of the seed training data one at a time
+
+        Returns
+        -------
+        Iterator[Document]
+            Pages of the training data PDF
+        """
+        if not os.path.exists(TRAINING_DATA_PATH):
+            raise HTTPException(status_code=404, detail="Chatbot has no training data")
+        return pdf.iter_pages(TRAINING_DATA_PATH)
+
+    @staticmethod
+    def text_splitter():
+        """
+        Get the splitter of the content ingested into an index
+
+        Chunks are measured in tokens of the embedding and chat models, INGEST_CHUNK_TOKENS at most,
+        with INGEST_CHUNK_OVERLAP_TOKENS shared by consecutive chunks, and split on paragraphs,
+        then lines, then words, so the context of an answer can be packed to a token budget.
+        """
+        from langchain.text_splitter import RecursiveCharacterTextSplitter
+        return RecursiveCharacterTextSplitter(chunk_size=INGEST_CHUNK_TOKENS, chunk_overlap=INGEST_CHUNK_OVERLAP_TOKENS, length_function=count_tokens)
+
+    @staticmethod
+    def chunk_windows(pages: Iterable["Document"], splitter) -> Iterator[Tuple[List[str], List[int], int]]:
+        """
+        Chunk pages and group their chunks in windows of at least INGEST_WINDOW_CHUNKS chunks
+
+        A window always ends with the last chunk of a page, so the pages it covers are complete once it is stored.
+        Only the chunks of the current window are held in memory.
+
+        Parameters
+        ----------
+        pages : Iterable[Document]
+            Pages to chunk, with their page number in the metadata
+        splitter : TextSplitter
+            Splitter of the page text
+
+        Returns
+        -------
+        Iterator[Tuple[List[str], List[int], int]]
+            Chunks of each window with the page of each chunk, and the number of pages read up to the end of the window
+        """
+        texts: List[str] = []
+        page_numbers: List[int] = []
+        pages_read = 0
+        for page in pages:
+            page_number = page.metadata.get("page", pages_read)
+            for chunk in splitter.split_text(page.page_content):
+                texts.append(chunk)
+                page_numbers.append(page_number)
+            pages_read = page_number + 1
+            if len(texts) >= INGEST_WINDOW_CHUNKS:
+                yield texts, page_numbers, pages_read
+                texts, page_numbers = [], []
+        if texts:
+            yield texts, page_numbers, pages_read
+
+    @staticmethod
+    def chunk_id(datasource_id: int, ordinal: int) -> str:
+        """
+        Get the ID in the index of a chunk of a data source, a chunk always gets the same ID
+        """
+        return f"datasource-{datasource_id}-{ordinal}"
+
+    @staticmethod
+    def chunk_metadata(chatbot_id: int, datasource_id: int, page: int) -> dict:
+        """
+        Get the metadata stored in the index with a chunk of a data source
+        """
+        return {"chatbot_id": chatbot_id, "datasource_id": datasource_id, "page": page}
+
+    @staticmethod
+    def stored_chunks(chatbot_id: int, datasource_id: int | None = None) -> Iterator[Tuple[List[str], List[dict], List[str]]]:
+        """
+        Read the chunk rows of the data sources of a chatbot, one window of INGEST_WINDOW_CHUNKS rows at a time
+
+        Parameters
+        ----------
+        chatbot_id : int
+            ID of the chatbot
+        datasource_id : int, optional
+            Only read the chunks of this data source, by default the chunks of every data source ready or being ingested,
+            the chunks of deleted and failed data sources are never indexed
+
+        Returns
+        -------
+        Iterator[Tuple[List[str], List[dict], List[str]]]
+            Texts, metadatas and IDs in the index of the chunks of each window
+        """
+        query = select(
+            DataSourceChunkModel.datasource_id, DataSourceChunkModel.ordinal, DataSourceChunkModel.page, DataSourceChunkModel.text
+        ).join(DataSourceModel, DataSourceModel.id == DataSourceChunkModel.datasource_id).where(
+            DataSourceChunkModel.chatbot_id == chatbot_id,
+            DataSourceModel.status.in_([DataSourceModel.STATUS_READY, DataSourceModel.STATUS_PROCESSING])
+        )
+        if datasource_id is not None:
+            query = query.where(DataSourceChunkModel.datasource_id == datasource_id)
+        query = query.order_by(DataSourceChunkModel.datasource_id, DataSourceChunkModel.ordinal)
+
+        db = SessionLocal()
+        try:
+            # Rows are fetched by window, a chatbot with many chunks is never read to memory at once
+            result = db.execute(query.execution_options(yield_per=INGEST_WINDOW_CHUNKS))
+            for rows in result.partitions():
+                yield (
+                    [row.text for row in rows],
+                    [VectorStoreService.chunk_metadata(chatbot_id, row.datasource_id, row.page) for row in rows],
+                    [VectorStoreService.chunk_id(row.datasource_id, row.ordinal) for row in rows],
+                )
+        finally:
+            db.close()
+
+    @staticmethod
+    def append(chatbot_id: int, texts: List[str], metadatas: List[dict], ids: List[str]) -> int:
+        """
+        Embed chunks and append them to the saved index of a chatbot
+
+        Chunks whose ID is already in the index are skipped without being embedded,
+        so appending the chunks of an interrupted ingestion again never duplicates them.
+        Only the new chunks are embedded, the existing vectors are reused as they are.
+        The new chunks are appended in place to the saved index, so a window only costs its own chunks,
+        and the loaded index keeps its vectors memory mapped.
+
+        Parameters
+        ----------
+        chatbot_id : int
+            ID of the chatbot
+        texts : List[str]
+            Text of the chunks
+        metadatas : List[dict]
+            Metadata of each chunk
+        ids : List[str]
+            ID of each chunk in the index
+
+        Returns
+        -------
+        int
+            Number of chunks appended
+        """
+        from api.services.embedding import get_embeddings
+
+        # Make sure the chatbot has an index to append to
+        indexed = VectorStoreService.get_index(chatbot_id).docstore._dict
+        new = [i for i, chunk_id in enumerate(ids) if chunk_id not in indexed]
+        if not new:
+            return 0
+
+        # Embed outside the write lock, this is the slow part of the ingest
+        embeddings = get_embeddings().embed_documents([texts[i] for i in new])
+
+        with VectorStoreService._write_lock(chatbot_id):
+            # The latest saved index, the one loaded by this process unless another process appended to it since
+            saved_mtime = VectorStoreService._saved_mtime(chatbot_id)
+            index = VectorStoreService._get_resident(chatbot_id, saved_mtime)
+            if index is None:
+                index = VectorStoreService._load(chatbot_id)
+            # Another process may have appended some of the chunks in the meantime
+            keep = [j for j, i in enumerate(new) if ids[i] not in index.docstore._dict]
+            if not keep:
+                return 0
+            new_texts = [texts[new[j]] for j in keep]
+            new_embeddings = [embeddings[j] for j in keep]
+            new_metadatas = [metadatas[new[j]] for j in keep]
+            new_ids = [ids[new[j]] for j in keep]
+
+            if not VectorStoreService._append_saved(chatbot_id, index, new_texts, new_embeddings, new_metadatas, new_ids):
+                # Save the index whole, to a fresh copy of it, the loaded one keeps serving queries until it is replaced
+                index = VectorStoreService._load(chatbot_id, mmap=False)
+                index.add_embeddings(list(zip(new_texts, new_embeddings)), metadatas=new_metadatas, ids=new_ids)
+                # The lexical index is extended with the same chunks, in the same order
+                index.lexical.add(new_texts)
+                VectorStoreService._save(chatbot_id, index)
+            VectorStoreService.bump_version(chatbot_id)
+        return len(keep)
+
+    @staticmethod
+    def _append_saved(chatbot_id: int, index: "FAISS", texts: List[str], embeddings: List[List[float]], metadatas: List[dict], ids: List[str]) -> bool:
+        """
+        Append chunks in place to the saved index of a chatbot and keep the new index loaded, the caller holds its write lock
+
+        The vectors are written after the saved ones, the chunks with their codes to the append log, then the manifest commits them.
+        The loaded index is not changed, the new one shares its memory mapped vectors and its chunks.
+        The index is not appended to once the rows appended since its last full save would pass the rows of that save,
+        so rewriting it whole costs as much as the rows appended before, or when its quantizer must be trained again.
+
+        Parameters
+        ----------
+        chatbot_id : int
+            ID of the chatbot
+        index : FAISS
+            Latest saved index of the chatbot
+        texts : List[str]
+            Text of the new chunks
+        embeddings : List[List[float]]
+            Vector of each chunk
+        metadatas : List[dict]
+            Metadata of each chunk
+        ids : List[str]
+            ID of each chunk in the index
+
+        Returns
+        -------
+        bool
+            Whether the chunks were appended, False if the index must be saved whole
+        """
+        from langchain.docstore.in_memory import InMemoryDocstore
+        from langchain.schema import Document
+        from langchain.vectorstores import FAISS
+
+        path = VectorStoreService._index_path(chatbot_id)
+        manifest = VectorStoreService._read_manifest(path) or {"rows": index.index.ntotal, "base_rows": index.index.ntotal, "log_bytes": 0}
+        rows = manifest["rows"] + len(ids)
+        if rows - manifest["base_rows"] > manifest["base_rows"]:
+            return False
+
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        codes = None
+        clipped = 0
+        quantizer = index.index.quantizer
+        if index.index.codes is not None:
+            if isinstance(quantizer, ScalarQuantizer):
+                clipped = quantizer.clipped
+            codes = quantizer.encode(vectors)
+            if isinstance(quantizer, ScalarQuantizer):
+                clipped = quantizer.clipped - clipped
+            if VectorStoreService._needs_training(quantizer, rows):
+                return False
+
+        vectors_path = os.path.join(path, VectorStoreService.VECTORS_NAME)
+        if not FlatIndex.append_saved(vectors_path, manifest["rows"], vectors):
+            return False
+        documents = [Document(page_content=text, metadata=metadata) for text, metadata in zip(texts, metadatas)]
+        # Bytes past the manifest were left by an append that did not complete, they are overwritten
+        fd = os.open(os.path.join(path, VectorStoreService.LOG_NAME), os.O_RDWR | os.O_CREAT)
+        with os.fdopen(fd, "r+b") as f:
+            f.seek(manifest["log_bytes"])
+            pickle.dump({"ids": ids, "documents": documents, "codes": codes, "clipped": clipped}, f)
+            log_bytes = f.tell()
+            f.truncate()
+        VectorStoreService._write_manifest(path, rows, manifest["base_rows"], log_bytes)
+
+        # The new index copies the mappings of the loaded one, not its vectors, chunks or postings
+        if VECTOR_INDEX_MMAP:
+            all_vectors = FlatIndex.load(vectors_path, mmap=True, rows=rows).vectors
+        else:
+            all_vectors = np.concatenate([index.index.vectors, vectors])
+        docstore = InMemoryDocstore({**index.docstore._dict, **dict(zip(ids, documents))})
+        index_to_docstore_id = {**index.index_to_docstore_id, **{manifest["rows"] + j: chunk_id for j, chunk_id in enumerate(ids)}}
+        appended = FAISS(index.embedding_function, index.index.extended(all_vectors, codes), docstore, index_to_docstore_id)
+        appended.lexical = index.lexical.copy()
+        appended.lexical.add(texts)
+        VectorStoreService._set_resident(chatbot_id, VectorStoreService._saved_mtime(chatbot_id), appended)
+        return True
+
+    @staticmethod
+    def _build(chatbot_id: int, previous: "FAISS | None", draft: "FAISS | None" = None) -> "FAISS":
+        """
+        Build the index of a chatbot from the seed training data and the stored chunks of its data sources
+
+        Parameters
+        ----------
+        chatbot_id : int
+            ID of the chatbot
+        previous : FAISS, optional
+            Current index of the chatbot, its seed chunks and the vectors of the chunks it already holds are reused
+        draft : FAISS, optional
+            Index built earlier without the write lock, the vectors of the chunks it holds are reused too
+
+        Returns
+        -------
+        FAISS
+            New vector index of the chatbot
+        """
+        from langchain.vectorstores import FAISS
+        from api.services.embedding import get_embeddings
+
+        index = None
+
+        def add(text_embeddings, metadatas, ids=None):
+            nonlocal index
+            if index is None:
+                index = FAISS.from_embeddings(text_embeddings, get_embeddings(), metadatas=metadatas, ids=ids)
+            else:
+                index.add_embeddings(text_embeddings, metadatas=metadatas, ids=ids)
+
+        sources = [source for source in (previous, draft) if source is not None]
+        positions = [{chunk_id: position for position, chunk_id in source.index_to_docstore_id.items()} for source in sources]
+
+        def stored_vector(chunk_id: str):
+            # Vector of a chunk already held by the previous index or the draft
+            for source, source_positions in zip(sources, positions):
+                if chunk_id in source_positions:
+                    return source.index.reconstruct(source_positions[chunk_id])
+            return None
+
+        if previous is None:
+            # The training data is only read the first time, one window at a time
+            for texts, page_numbers, _ in VectorStoreService.chunk_windows(VectorStoreService._load_training_data(), VectorStoreService.text_splitter()):
+                add(
+                    list(zip(texts, get_embeddings().embed_documents(texts))),
+                    [{"source": TRAINING_DATA_PATH, "page": page_number} for page_number in page_numbers]
+                )
+        else:
+            # The seed chunks are copied with their vectors
+            seed = [(chunk_id, document) for chunk_id, document in previous.docstore._dict.items() if "datasource_id" not in document.metadata]
+            if seed:
+                add(
+                    [(document.page_content, stored_vector(chunk_id)) for chunk_id, document in seed],
+                    [document.metadata for _, document in seed]
+                )
+
+        for texts, metadatas, ids in VectorStoreService.stored_chunks(chatbot_id):
+            # Chunks already indexed keep their vector, the others are embedded
+            vectors = [stored_vector(chunk_id) for chunk_id in ids]
+            missing = [i for i, vector in enumerate(vectors) if vector is None]
+            if missing:
+                for i, embedding in zip(missing, get_embeddings().embed_documents([texts[i] for i in missing])):
+                    vectors[i] = embedding
+            add(list(zip(texts, vectors)), metadatas, ids)
+
+        if index is None:
+            raise HTTPException(status_code=404, detail="Chatbot has no training data")
+        return index
+
+    @staticmethod
+    def reindex(chatbot_id: int) -> int:
+        """
+        Rebuild the index of a chatbot from the stored chunks of its data sources
+
+        Chunks of deleted and failed data sources are dropped, the vectors of the chunks already indexed are reused,
+        so only chunks missing from the index are embedded.
+        The missing chunks are embedded into a draft without the write lock, so appends and queries are not held up,
+        the lock is only taken to merge the draft with the latest saved index and save the result.
+
+        Parameters
+        ----------
+        chatbot_id : int
+            ID of the chatbot
+
+        Returns
+        -------
+        int
+            New version of the chatbot data
+        """
+        # Embedding is the slow part of a rebuild, it is done on a draft outside the lock
+        previous = VectorStoreService._load(chatbot_id) if VectorStoreService._saved_mtime(chatbot_id) is not None else None
+        draft = VectorStoreService._build(chatbot_id, previous)
+        with VectorStoreService._write_lock(chatbot_id):
+            # Chunks appended while the draft was built are in the latest saved index, its vectors are reused with the draft ones
+            latest = VectorStoreService._load(chatbot_id) if VectorStoreService._saved_mtime(chatbot_id) is not None else None
+            VectorStoreService._save(chatbot_id, VectorStoreService._build(chatbot_id, latest if latest is not None else draft, draft))
+            return VectorStoreService.bump_version(chatbot_id)
+
+    @staticmethod
+    def get_version(chatbot_id: int) -> int:
+        """
+        Get the version of the knowledge base of a chatbot, bumped every time its data changes
+
+        Parameters
+        ----------
+        chatbot_id : int
+            ID of the chatbot
+
+        Returns
+        -------
+        int
+            Version of the chatbot data, 0 if it never changed
+        """
+        try:
+            with open(os.path.join(VectorStoreService._index_path(chatbot_id), "version")) as f:
+                return int(f.read())
+        except FileNotFoundError:
+            return 0
+
+    @staticmethod
+    def bump_version(chatbot_id: int) -> int:
+        """
+        Bump the version of the knowledge base of a chatbot, so answers cached for the previous data are not served
+
+        The version has its own lock, held only to read and replace the version file, so the version can be bumped
+        right away while the index is being written, like when a data source is deleted before its chunks are dropped.
+
+        Parameters
+        ----------
+        chatbot_id : int
+            ID of the chatbot
+
+        Returns
+        -------
+        int
+            New version of the chatbot data
+        """
+        path = VectorStoreService._index_path(chatbot_id)
+        os.makedirs(path, exist_ok=True)
+        # flock locks are held by an open file, so the threads of a process exclude each other too
+        with open(os.path.join(path, "version.lock"), "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                version = VectorStoreService.get_version(chatbot_id) + 1
+                fd, tmp_path = tempfile.mkstemp(dir=path)
+                with os.fdopen(fd, "w") as f:
+                    f.write(str(version))
+                os.replace(tmp_path, os.path.join(path, "version"))
+                return version
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    @staticmethod
+    def get_index(chatbot_id: int) -> "FAISS":
+        """
+        Get the index of a chatbot
+
+        The index is read from disk on its first query by this process, when another process saved
+        a newer version of it, or when it was evicted to stay under the memory budget.
+        A chatbot without a saved index gets one built from the training data and the stored chunks of its data sources.
+
+        Parameters
+        ----------
+        chatbot_id : int
+            ID of the chatbot
+
+        Returns
+        -------
+        FAISS
+            Vector index of the chatbot
+        """
+        index = VectorStoreService._get_resident(chatbot_id, VectorStoreService._saved_mtime(chatbot_id))
+        if index is not None:
+            return index
+
+        from langchain.vectorstores import FAISS
+        from api.services.embedding import get_embeddings
+
+        with VectorStoreService._write_lock(chatbot_id):
+            # Another thread may have loaded the index while we waited for the lock
+            saved_mtime = VectorStoreService._saved_mtime(chatbot_id)
+            index = VectorStoreService._get_resident(chatbot_id, saved_mtime)
+            if index is not None:
+                return index
+
+            if saved_mtime is None:
+                path = VectorStoreService._index_path(chatbot_id)
+                legacy_path = os.path.join(path, f"{VectorStoreService.INDEX_NAME}.faiss")
+                if os.path.exists(legacy_path):
+                    # Index saved by a previous version as a faiss file, converted once to plain vectors
+                    index = FAISS.load_local(path, get_embeddings(), VectorStoreService.INDEX_NAME)
+                    VectorStoreService._save(chatbot_id, index)
+                    os.remove(legacy_path)
+                else:
+                    # First use of the chatbot on this node, build its index from the training data and the stored chunks
+                    index = VectorStoreService._build(chatbot_id, None)
+                    VectorStoreService._save(chatbot_id, index)
+                return index
+
+            index = VectorStoreService._load(chatbot_id)
+            VectorStoreService._set_resident(chatbot_id, saved_mtime, index)
+            return index
+
+    @staticmethod
+    def stats() -> dict:
+        """
+        Get the memory taken by the indexes loaded in this process
+
+        The bytes of an index are its vectors, or its codes when it is compressed, and its chunks,
+        memory mapped vectors only take the pages touched by the searches, so this is an upper bound of its resident memory.
+
+        Returns
+        -------
+        dict
+            Memory budget, loaded bytes, evictions since the process started and bytes of each loaded chatbot
+        """
+        with VectorStoreService._indexes_lock:
+            return {
+                "budget_bytes": VECTOR_INDEX_MEMORY_BUDGET_MB * 1024 * 1024,
+                "resident_bytes": VectorStoreService._resident_bytes,
+                "mmap": VECTOR_INDEX_MMAP,
+                "compression": VECTOR_INDEX_COMPRESSION,
+                "evictions": VectorStoreService.evictions,
+                "chatbots": {chatbot_id: size for chatbot_id, (_, _, size) in VectorStoreService._indexes.items()},
+            }
@@ -0,0 +1,103 @@
+"""
+Compare the memory, the recall and the latency of the vector index compressions, run from the root of the repository
+
+    python scripts/benchmark_compression.py --vectors 20000 --k 8
+    python scripts/benchmark_compression.py --index-dir indexes/chatbot_1
+
+The vectors are clustered synthetic embeddings, or the saved vectors of a chatbot index.
+Every compression is searched with the queries, and its neighbors are compared to the exact search of the plain vectors:
+recall@k is the share of the exact k nearest neighbors found, without re-scoring and with the re-scoring of the index.
+The memory of a compressed index is its codes and quantizer, its vectors stay memory mapped on disk.
+The latency is the time of a re-scored search per query, with all the queries searched at once,
+and with one query per search like the questions of the chat.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import numpy as np
+
+sys.path.insert(0, os.getcwd())
+from api.services.utils.flat_index import FlatIndex
+from api.services.utils.quantization import train_quantizer
+
+COMPRESSIONS = ["none", "int8", "pq"]
+
+def synthetic_vectors(n_vectors: int, dimensions: int, rng: np.random.Generator) -> np.ndarray:
+    """
+    Get unit vectors grouped around topics, like the embeddings of the chunks of a few documents
+
+    Embeddings vary along far fewer directions than their dimensions, the vectors of a topic are spread
+    along a few hundred random directions, with a little noise on all of them.
+    """
+    topics = rng.standard_normal((max(n_vectors // 200, 1), dimensions)).astype(np.float32)
+    directions = rng.standard_normal((256, dimensions)).astype(np.float32) / np.sqrt(256)
+    vectors = (
+        topics[rng.integers(0, topics.shape[0], n_vectors)]
+        + rng.standard_normal((n_vectors, 256)).astype(np.float32) @ directions * 0.8
+        + 0.1 * rng.standard_normal((n_vectors, dimensions)).astype(np.float32)
+    )
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+def recall(found: np.ndarray, exact: np.ndarray) -> float:
+    """
+    Get the share of the exact neighbors of the queries that were found
+    """
+    return float(np.mean([len(np.intersect1d(f, e)) / len(e) for f, e in zip(found, exact)]))
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the memory, recall and latency of the vector index compressions")
+    parser.add_argument("--index-dir", help="Folder of a saved chatbot index, synthetic vectors are used if not set")
+    parser.add_argument("--vectors", type=int, default=20000, help="Number of synthetic vectors")
+    parser.add_argument("--dimensions", type=int, default=1536, help="Dimensions of the synthetic vectors")
+    parser.add_argument("--queries", type=int, default=100, help="Number of queries, taken near random vectors of the index")
+    parser.add_argument("--k", type=int, default=8, help="Neighbors of each query")
+    parser.add_argument("--pq-subvectors", type=int, default=192, help="Sub vectors of the product quantization")
+    parser.add_argument("--rescore-factor", type=int, default=8, help="Candidates re-scored exactly per neighbor")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    if args.index_dir:
+        vectors = np.load(os.path.join(args.index_dir, "vectors.npy"))
+    else:
+        vectors = synthetic_vectors(args.vectors, args.dimensions, rng)
+    queries = vectors[rng.integers(0, vectors.shape[0], args.queries)]
+    queries = queries + 0.3 * rng.standard_normal(queries.shape).astype(np.float32) / np.sqrt(vectors.shape[1])
+
+    with tempfile.TemporaryDirectory() as tmp_path:
+        # The vectors are memory mapped like the saved indexes
+        path = os.path.join(tmp_path, "vectors.npy")
+        FlatIndex(vectors).save(path)
+        _, exact = FlatIndex.load(path, mmap=False).search(queries, args.k)
+
+        print(f"{vectors.shape[0]} vectors of {vectors.shape[1]} dimensions, {args.queries} queries, k={args.k}\n")
+        print(f"{'compression':<14}{'memory MB':>12}{'ratio':>8}{'train s':>10}{'recall':>10}{'re-scored':>12}{'batch ms/q':>12}{'single ms':>11}")
+        plain_bytes = vectors.nbytes
+        for compression in COMPRESSIONS:
+            index = FlatIndex.load(path, mmap=compression != "none")
+            start = time.perf_counter()
+            if compression != "none":
+                index.compress(train_quantizer(compression, index.vectors, args.pq_subvectors))
+            train_s = time.perf_counter() - start
+
+            # Without re-scoring, the k best candidates of the codes are the neighbors
+            index.rescore_factor = 1
+            _, approximate = index.search(queries, args.k)
+            index.rescore_factor = args.rescore_factor
+            start = time.perf_counter()
+            _, rescored = index.search(queries, args.k)
+            batch_ms = (time.perf_counter() - start) * 1000 / args.queries
+            start = time.perf_counter()
+            for query in queries:
+                index.search(query[np.newaxis], args.k)
+            single_ms = (time.perf_counter() - start) * 1000 / args.queries
+
+            print(
+                f"{compression:<14}{index.nbytes / 1024 / 1024:>12.1f}{plain_bytes / index.nbytes:>8.1f}{train_s:>10.2f}"
+                f"{recall(approximate, exact):>10.3f}{recall(rescored, exact):>12.3f}{batch_ms:>12.2f}{single_ms:>11.2f}"
+            )
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,74 @@
+"""
+Check the time and memory it takes to import the app, run from the root of the repository
+
+    python scripts/check_import_time.py --budget-ms 2500 --budget-rss-mb 150
+
+The app is imported in a fresh interpreter with -X importtime.
+The check fails if the import goes over budget, or if a heavy dependency is imported at startup
+instead of on first use.
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+# Dependencies that must only be loaded on first use
+LAZY_MODULES = ["langchain", "faiss", "transformers", "pandas", "matplotlib", "pypdf"]
+
+# Print the peak memory of the interpreter once the app is imported
+IMPORT_APP = "import resource, api.main; print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)"
+
+def parse_importtime(stderr: str):
+    """
+    Parse the -X importtime output into (module, cumulative microseconds) pairs
+    """
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        modules.append((name.strip(), int(cumulative)))
+    return modules
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Check the import time budget of the app")
+    parser.add_argument("--budget-ms", type=float, default=2500, help="Maximum time to import api.main, in milliseconds")
+    parser.add_argument("--budget-rss-mb", type=float, default=150, help="Maximum peak memory after importing api.main, in megabytes")
+    parser.add_argument("--top", type=int, default=15, help="Number of slowest top level imports to print")
+    args = parser.parse_args()
+
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", IMPORT_APP],
+        capture_output=True, text=True, env={**os.environ, "PYTHONPATH": os.getcwd()},
+    )
+    if result.returncode != 0:
+        print(result.stderr, file=sys.stderr)
+        return result.returncode
+
+    modules = parse_importtime(result.stderr)
+    total_ms = dict(modules).get("api.main", 0) / 1000
+    # ru_maxrss is in kilobytes on Linux
+    rss_mb = int(result.stdout.strip().splitlines()[-1]) / 1024
+
+    # Imports of other top level packages are the ones worth looking at
+    top_level = sorted((m for m in modules if "." not in m[0]), key=lambda m: m[1], reverse=True)
+    print(f"{'module':<40}{'cumulative ms':>15}")
+    for name, cumulative in top_level[:args.top]:
+        print(f"{name:<40}{cumulative / 1000:>15.1f}")
+    print(f"\napi.main imported in {total_ms:.0f} ms (budget {args.budget_ms:.0f} ms), peak RSS {rss_mb:.0f} MB (budget {args.budget_rss_mb:.0f} MB)")
+
+    failed = False
+    eager = sorted({name for name, _ in modules if name.split(".")[0] in LAZY_MODULES and "." not in name})
+    if eager:
+        print(f"Imported at startup instead of on first use: {', '.join(eager)}")
+        failed = True
+    if total_ms > args.budget_ms:
+        print("Import time is over budget")
+        failed = True
+    if rss_mb > args.budget_rss_mb:
+        print("Peak memory is over budget")
+        failed = True
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())